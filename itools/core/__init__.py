@@ -19,7 +19,7 @@
 from sys import platform
 
 # Import from itools
-from .cache import LRUCache
+from .cache import LRUCache, TwoQueueCache
 from .freeze import freeze, frozendict, frozenlist
 from .lazy import lazy
 from .mimetypes_ import add_type, guess_all_extensions, guess_extension
@@ -51,6 +51,7 @@ __all__ = [
     'lazy',
     # Caching
     'LRUCache',
+    'TwoQueueCache',
     # Mimetypes
     'add_type',
     'guess_all_extensions',
@@ -15,19 +15,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
-This module implements a LRU (Least Recently Used) Cache.
+This module implements a LRU (Least Recently Used) Cache, and a 2Q cache
+of weighted values.
 http://en.wikipedia.org/wiki/Cache_algorithms
 """
 
-# Import from itools
-from .odict import OrderedDict
+# Import from the Standard Library
+from collections import OrderedDict
 
 
 class LRUCache(OrderedDict):
     """LRU stands for Least-Recently-Used.
 
-    The LRUCache is a mapping from key to value, it is implemented as a dict
-    with some differences:
+    The LRUCache is a mapping from key to value, it is implemented as an
+    ordered dict with some differences:
 
     - The elements within the cache are ordered by the access time, starting
       from the least-recently used value.  All iteration methods ('items',
@@ -56,6 +57,8 @@ class LRUCache(OrderedDict):
 
     - touch(key): defines the value identified by the given key as to be
       accessed, hence it will be at the end of the list.
+
+    Setting the value of a key already in the cache touches it too.
     """
 
     def __init__(self, size_min, size_max=None, automatic=True):
@@ -83,32 +86,276 @@ class LRUCache(OrderedDict):
         # Whether to free memory automatically or not (boolean)
         self.automatic = automatic
 
-    def _append(self, key):
-        super()._append(key)
+    def _check_integrity(self):
+        """This method is for testing purposes, it checks the size of the
+        cache.
+        """
+        if self.automatic is True:
+            assert len(self) <= self.size_max
+
+    ######################################################################
+    # Override dict API
+    def __setitem__(self, key, value):
+        if key in self:
+            # Already there, touch
+            OrderedDict.__setitem__(self, key, value)
+            self.move_to_end(key)
+            return
 
+        OrderedDict.__setitem__(self, key, value)
         # Free memory if needed
         if self.automatic is True and len(self) > self.size_max:
             while len(self) > self.size_min:
-                self.popitem()
+                OrderedDict.popitem(self, last=False)
+
+    def __reduce__(self):
+        # Used by pickle, 'copy.copy' and 'copy.deepcopy'; the items are
+        # given in order, so the access order is kept
+        args = (self.size_min, self.size_max, self.automatic)
+        return self.__class__, args, None, None, iter(super().items())
+
+    def copy(self):
+        message = "use 'copy.copy' or 'copy.deepcopy' to copy a cache"
+        raise NotImplementedError(message)
+
+    @classmethod
+    def fromkeys(cls, seq, value=None):
+        raise NotImplementedError("the 'fromkeys' method is not supported")
+
+    def iterkeys(self):
+        return iter(self)
 
+    def itervalues(self):
+        return iter(super().values())
+
+    def keys(self):
+        return list(self)
+
+    def popitem(self, last=False):
+        """Remove and return the least-recently used item (or the most
+        recently used if 'last' is true).
+        """
+        if not self:
+            raise KeyError('popitem(): cache is empty')
+        return super().popitem(last=last)
+
+    def setdefault(self, key, default=None):
+        raise NotImplementedError("the 'setdefault' method is not supported")
+
+    def update(self, value=None, **kw):
+        raise NotImplementedError("the 'update' method is not supported")
+
+    def values(self):
+        return list(super().values())
+
+    ######################################################################
+    # Specific API
     def touch(self, key):
-        # (1) Get the node from the key-to-node map
-        node = self.key2node[key]
+        self.move_to_end(key)
 
-        # (2) Touch in the doubly-linked list
-        # Already the last one
-        if node.next is None:
-            return
 
-        # Unlink
-        if node.prev is None:
-            self.first = node.next
+
+class TwoQueueCache:
+    """A mapping from key to value, where every value has a weight (e.g. its
+    approximate size in memory) and a group (e.g. its class name), and
+    following the 2Q replacement policy [1], which is scan resistant: a
+    single traversal of many values does not flush the values used often.
+
+    - New values enter the 'in' queue, first in first out.  Hitting them
+      there does not change anything.
+
+    - The keys of the values removed from the 'in' queue are remembered
+      (only the keys) in the 'out' queue.  If the key is added again
+      while still there, the value enters the 'main' queue, least
+      recently used.
+
+    The cache is full when it holds more than 'size_max' values or more
+    than 'weight_max'.  The values to remove, until it holds no more than
+    'size_min' values and 'weight_min', are given by 'victims'; it is the
+    responsibility of external code to remove them, with 'evict'.  The
+    'in' queue takes up to 'kin' of 'weight_min', the 'out' queue holds up
+    to 'kout' times 'size_max' keys.
+
+    Statistics are kept by group, see 'get_stats'.
+
+    [1] http://www.vldb.org/conf/1994/P439.PDF
+    """
+
+    def __init__(self, size_min, size_max=None, weight_min=None,
+                 weight_max=None, kin=0.25, kout=0.5):
+        if size_max is None:
+            size_max = size_min
+        elif size_max < size_min:
+            raise ValueError("the 'size_max' is smaller than 'size_min'")
+        if weight_max is None:
+            weight_max = weight_min
+        elif weight_min is None or weight_max < weight_min:
+            raise ValueError("the 'weight_max' is smaller than 'weight_min'")
+
+        self.size_min = size_min
+        self.size_max = size_max
+        self.weight_min = weight_min
+        self.weight_max = weight_max
+        self.kin = kin
+        self.kout = kout
+        # {key: value}
+        self.data = {}
+        # The queues {key: (weight, group)}, and the ghosts {key: None}
+        self.a1in = OrderedDict()
+        self.am = OrderedDict()
+        self.a1out = OrderedDict()
+        self.a1in_weight = 0
+        self.weight = 0
+        # {group: {'count', 'weight', 'hits', 'misses', 'evictions'}}
+        self.stats = {}
+
+    def _get_stats(self, group):
+        stats = self.stats.get(group)
+        if stats is None:
+            stats = {'count': 0, 'weight': 0, 'hits': 0, 'misses': 0,
+                     'evictions': 0}
+            self.stats[group] = stats
+        return stats
+
+    #######################################################################
+    # Dict API
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def get(self, key, default=None):
+        """Return the value, the access is not recorded (see 'touch').
+        """
+        return self.data.get(key, default)
+
+    def items(self):
+        return self.data.items()
+
+    def keys(self):
+        return self.data.keys()
+
+    def values(self):
+        return self.data.values()
+
+    def pop(self, key):
+        value = self.data.pop(key)
+        if key in self.a1in:
+            weight, group = self.a1in.pop(key)
+            self.a1in_weight -= weight
+        else:
+            weight, group = self.am.pop(key)
+        self.weight -= weight
+        stats = self.stats[group]
+        stats['count'] -= 1
+        stats['weight'] -= weight
+        return value
+
+    def clear(self):
+        self.data.clear()
+        self.a1in.clear()
+        self.am.clear()
+        self.a1out.clear()
+        self.a1in_weight = self.weight = 0
+        for stats in self.stats.values():
+            stats['count'] = stats['weight'] = 0
+
+    #######################################################################
+    # Cache API
+    def set(self, key, value, weight=1, group=None):
+        """Add the value with the given weight.  If there is already a value
+        for the key it is replaced, in the same queue.
+        """
+        is_new = key not in self.data
+        if not is_new:
+            queue = self.am if key in self.am else self.a1in
+            self.pop(key)
+        elif key in self.a1out:
+            del self.a1out[key]
+            queue = self.am
+        else:
+            queue = self.a1in
+        self.data[key] = value
+        queue[key] = (weight, group)
+        if queue is self.a1in:
+            self.a1in_weight += weight
+        self.weight += weight
+        stats = self._get_stats(group)
+        stats['count'] += 1
+        stats['weight'] += weight
+        if is_new:
+            stats['misses'] += 1
+
+    def touch(self, key):
+        """Record an access (a cache hit) to the value.
+        """
+        if key in self.am:
+            self.am.move_to_end(key)
+            group = self.am[key][1]
         else:
-            node.prev.next = node.next
-        node.next.prev = node.prev
-
-        # Link
-        node.prev = self.last
-        node.next = None
-        self.last.next = node
-        self.last = node
+            group = self.a1in[key][1]
+        self.stats[group]['hits'] += 1
+
+    def is_full(self):
+        return len(self.data) > self.size_max or (
+            self.weight_max is not None and self.weight > self.weight_max)
+
+    def has_room(self):
+        return len(self.data) <= self.size_min and (
+            self.weight_min is None or self.weight <= self.weight_min)
+
+    def victims(self):
+        """Yield the keys of the values to remove first, until there is
+        room.
+        """
+        if self.weight_min is None:
+            a1in_max = self.size_min * self.kin
+            a1in_size = lambda: len(self.a1in)
+        else:
+            a1in_max = self.weight_min * self.kin
+            a1in_size = lambda: self.a1in_weight
+        for key in list(self.a1in):
+            if self.has_room() or a1in_size() <= a1in_max:
+                break
+            if key in self.a1in:
+                yield key
+        for queue in self.am, self.a1in:
+            for key in list(queue):
+                if self.has_room():
+                    return
+                if key in queue:
+                    yield key
+
+    def evict(self, key):
+        """Remove the value from the cache, and remember its key.
+        """
+        in_a1in = key in self.a1in
+        group = (self.a1in if in_a1in else self.am)[key][1]
+        value = self.pop(key)
+        self.stats[group]['evictions'] += 1
+        if in_a1in:
+            a1out = self.a1out
+            a1out[key] = None
+            while len(a1out) > self.size_max * self.kout:
+                a1out.popitem(last=False)
+        return value
+
+    def get_stats(self):
+        """Return the statistics by group, as a dict {group: stats}: the
+        number of values and their weight, the number of hits, of misses
+        (values added) and of evictions.
+        """
+        return {group: dict(stats) for group, stats in self.stats.items()}
@@ -15,8 +15,19 @@
 
 """
 This module implements an ordered dictionary, to be removed by Python 2.7
+
+Deprecated: it is not used anymore by itools, use collections.OrderedDict
+instead.
 """
 
+# Import from the Standard Library
+from warnings import warn
+
+
+warn('itools.core.odict is deprecated, use collections.OrderedDict',
+     DeprecationWarning, stacklevel=2)
+
+
 class DNode:
     """This class makes the nodes of a doubly-linked list.
     """
@@ -48,6 +48,7 @@ class CSVFile(TextFile):
                        'text/csv', 'text/x-csv',
                        'application/csv', 'application/x-csv']
     class_extension = 'csv'
+    footprint_ratio = 6
 
     # Hash with column names and its types
     # Example: {'firstname': Unicode, 'lastname': Unicode, 'age': Integer}
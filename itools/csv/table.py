@@ -20,8 +20,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from the Standard Library
+from bisect import bisect_left, bisect_right, insort
 from copy import deepcopy
 from datetime import datetime
+from math import inf
 
 # Import from itools
 from itools.datatypes import DateTime, String, Unicode
@@ -497,6 +499,11 @@ class Record(dict):
 class Table(TextFile):
 
     record_class = Record
+    footprint_ratio = 8
+    # The changes are appended to the file, unless the ratio of the records
+    # in the file that are dead (deleted or changed after) exceeds this,
+    # then the file is written again (see to_str_append)
+    compact_ratio = 0.5
 
     #######################################################################
     # Hash with field names and its types
@@ -507,6 +514,12 @@ class Table(TextFile):
     record_parameters = {
         'language': String(multiple=False)}
 
+    # The records are indexed by the value of the fields 'indexed' or
+    # 'unique' (but the multilingual ones), to search them (see search);
+    # and sorted by the value of these fields, to search ranges of values
+    # (see search_range)
+    sorted_indexes = ()
+
     def get_datatype(self, name):
         # Table schema
         if name == 'ts':
@@ -567,6 +580,16 @@ class Table(TextFile):
         self.properties = None
         self.records = []
         self.changed_properties = False
+        # The ids of the records changed since loaded or saved, None if
+        # unknown (see set_changed)
+        self.changed_records = set()
+        # The number of records in the file
+        self.file_records = 0
+        # The number of records not deleted, None if unknown
+        self.n_records = 0
+        # The indexes, built when first used (see build_indexes)
+        self.indexes = None
+        self.sorted_index = None
 
     def new(self):
         # Add the properties record
@@ -582,6 +605,7 @@ class Table(TextFile):
         n = 0
         for name, value, parameters in parse_table(file.read()):
             if name == 'id':
+                self.file_records += 1
                 uid, seq = value.split('/')
                 uid = int(uid)
                 # Build the new record
@@ -623,6 +647,8 @@ class Table(TextFile):
             else:
                 record[name] = property
 
+        self.n_records = len(records) - records.count(None)
+
     def _record_to_str(self, id, record):
         lines = ['id:%d/0\n' % id]
         names = record.keys()
@@ -668,6 +694,135 @@ class Table(TextFile):
 
         return ''.join(lines)
 
+    def to_str_append(self):
+        changed = self.changed_records
+        if changed is None:
+            return None
+
+        # Compact
+        changed_properties = self.changed_properties
+        n_file = self.file_records + len(changed) + changed_properties
+        n_live = self.get_n_records() + (self.properties is not None)
+        if n_file and (n_file - n_live) / n_file > self.compact_ratio:
+            return None
+
+        # The changed records, in full (a record replaces the previous one
+        # with the same id), and the deleted ones
+        lines = ['\n']
+        if changed_properties and self.properties is not None:
+            lines.append(self._record_to_str(-1, self.properties))
+        records = self.records
+        for id in sorted(changed):
+            record = records[id]
+            if record is None:
+                lines.append('id:%d/DELETED\n\n' % id)
+            else:
+                lines.append(self._record_to_str(id, record))
+        return ''.join(lines)
+
+    def set_saved(self, appended):
+        if appended:
+            self.file_records += len(self.changed_records)
+            self.file_records += self.changed_properties
+        else:
+            self.file_records = self.get_n_records()
+            self.file_records += self.properties is not None
+        self.changed_records = set()
+        self.changed_properties = False
+
+    def set_changed(self):
+        # Changed by other means than the API (like a record changed in
+        # place): the whole file must be written, and the indexes built
+        # again
+        self.changed_records = None
+        self.n_records = None
+        self.indexes = None
+        self.sorted_index = None
+        super().set_changed()
+
+    def _set_record_changed(self, id):
+        changed = self.changed_records
+        super().set_changed()
+        if changed is not None:
+            changed.add(id)
+        self.changed_records = changed
+
+    #######################################################################
+    # Indexes
+    #######################################################################
+    def get_index_key(self, record, name):
+        value = self.get_record_value(record, name)
+        if type(value) is list:
+            return tuple(value)
+        return value
+
+    def build_indexes(self):
+        indexes = {}
+        for name, datatype in self.record_properties.items():
+            if is_multilingual(datatype):
+                continue
+            if (getattr(datatype, 'indexed', False) or
+                    getattr(datatype, 'unique', False)):
+                indexes[name] = {}
+        sorted_index = {name: [] for name in self.sorted_indexes}
+
+        get_key = self.get_index_key
+        records = [x for x in self.records if x is not None]
+        for name in list(indexes):
+            index = indexes[name]
+            try:
+                for record in records:
+                    index.setdefault(get_key(record, name), []).append(
+                        record.id)
+            except TypeError:
+                # Unhashable values, the records will be scanned
+                del indexes[name]
+        for name, index in sorted_index.items():
+            for record in records:
+                key = get_key(record, name)
+                if key is not None:
+                    index.append((key, record.id))
+            index.sort()
+
+        self.indexes = indexes
+        self.sorted_index = sorted_index
+
+    def _index_record(self, record, remove=False):
+        indexes = self.indexes
+        if indexes is None:
+            return
+
+        get_key = self.get_index_key
+        id = record.id
+        try:
+            for name, index in indexes.items():
+                key = get_key(record, name)
+                if remove:
+                    ids = index.get(key)
+                    if not ids or id not in ids:
+                        raise KeyError(key)
+                    ids.remove(id)
+                    if not ids:
+                        del index[key]
+                else:
+                    insort(index.setdefault(key, []), id)
+            for name, index in self.sorted_index.items():
+                key = get_key(record, name)
+                if key is None:
+                    continue
+                if remove:
+                    i = bisect_left(index, (key, id))
+                    if index[i:i+1] != [(key, id)]:
+                        raise KeyError(key)
+                    del index[i]
+                else:
+                    insort(index, (key, id))
+        except (TypeError, KeyError):
+            # Unhashable or uncomparable values, or a value not indexed (the
+            # record was changed in place): build them again
+            self.indexes = None
+            self.sorted_index = None
+
     #######################################################################
     # API / Public
     #######################################################################
@@ -690,8 +845,11 @@ class Table(TextFile):
         self.properties_to_dict(kw, record)
         record['ts'] = Property(datetime.now())
         # Change
-        self.set_changed()
+        self._set_record_changed(_id)
         self.records.append(record)
+        self._index_record(record)
+        if self.n_records is not None:
+            self.n_records += 1
         # Back
         return record
 
@@ -708,9 +866,11 @@ class Table(TextFile):
                 if search and (search[0] != self.records[_id]):
                     raise UniqueError(name, kw[name])
         # Update record
-        self.set_changed()
+        self._set_record_changed(_id)
+        self._index_record(record, remove=True)
         self.properties_to_dict(kw, record)
         record['ts'] = Property(datetime.now())
+        self._index_record(record)
 
     def update_properties(self, **kw):
         record = self.properties
@@ -723,7 +883,9 @@ class Table(TextFile):
         self.properties_to_dict(kw, record, first=True)
         record['ts'] = Property(datetime.now())
         # Change
-        self.set_changed()
+        changed = self.changed_records
+        super().set_changed()
+        self.changed_records = changed
         self.changed_properties = True
 
     def del_record(self, _id):
@@ -732,8 +894,11 @@ class Table(TextFile):
             msg = 'cannot delete record "%s" because it was deleted before'
             raise LookupError(msg % _id)
         # Change
-        self.set_changed()
+        self._set_record_changed(_id)
+        self._index_record(record, remove=True)
         self.records[_id] = None
+        if self.n_records is not None:
+            self.n_records -= 1
 
     def get_record_ids(self):
         i = 0
@@ -743,9 +908,10 @@ class Table(TextFile):
             i += 1
 
     def get_n_records(self):
-        ids = self.get_record_ids()
-        ids = list(ids)
-        return len(ids)
+        if self.n_records is None:
+            records = self.records
+            self.n_records = len(records) - records.count(None)
+        return self.n_records
 
     def get_records(self):
         return (x for x in self.records if x)
@@ -829,7 +995,34 @@ class Table(TextFile):
 
     def search(self, key, value):
         get = self.get_record_value
-        return [x for x in self.records if x and get(x, key) == value]
+        if self.indexes is None:
+            self.build_indexes()
+        index = self.indexes.get(key)
+        if index is None:
+            return [x for x in self.records if x and get(x, key) == value]
+
+        # Indexed
+        try:
+            ids = index.get(tuple(value) if type(value) is list else value)
+        except TypeError:
+            return [x for x in self.records if x and get(x, key) == value]
+        if not ids:
+            return []
+        records = self.records
+        return [ records[x] for x in ids if get(records[x], key) == value ]
+
+    def search_range(self, key, start=None, end=None):
+        """Returns the records with a value for the given field between
+        'start' and 'end' (included, None for no limit), sorted by value.
+        The field must be in 'sorted_indexes'.
+        """
+        if self.indexes is None:
+            self.build_indexes()
+        index = self.sorted_index[key]
+        i = 0 if start is None else bisect_left(index, (start, -1))
+        j = len(index) if end is None else bisect_right(index, (end, inf))
+        records = self.records
+        return [ records[id] for value, id in index[i:j] ]
 
     def update_from_csv(self, data, columns, skip_header=False):
         """Update the table by adding record from data
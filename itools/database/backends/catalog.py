@@ -17,22 +17,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import pickle
 from decimal import Decimal as decimal
 from datetime import datetime
+from importlib import import_module
+from multiprocessing import get_context
 from marshal import dumps, loads
 from hashlib import sha1
 
 # Import from xapian
 from xapian import Database, WritableDatabase, DB_OPEN, DB_BACKEND_GLASS
 from xapian import Document, Query, QueryParser, Enquire
-from xapian import MultiValueKeyMaker
+from xapian import MultiValueKeyMaker, ValueCountMatchSpy
 from xapian import sortable_serialise, sortable_unserialise, TermGenerator
 
 # Import from itools
-from itools.core import fixed_offset, lazy, merge_dicts
+from itools.core import LRUCache, fixed_offset, lazy, merge_dicts
 from itools.datatypes import Decimal, Integer, Unicode, String
 from itools.fs import lfs
-from itools.i18n import is_punctuation
+from itools.i18n import get_sort_key, is_punctuation
 from logging import getLogger
 from itools.i18n.accept import select_language
 from itools.database.queries import AllQuery, _AndQuery, NotQuery, _OrQuery, PhraseQuery
@@ -95,10 +98,26 @@ def warn_not_indexed_nor_stored(name):
 
 class Doc:
 
-    def __init__(self, xdoc, fields, metadata):
+    def __init__(self, xdoc, fields, metadata, languages=None):
         self._xdoc = xdoc
         self._fields = fields
         self._metadata = metadata
+        # The map {name: [language, ...]} of the multilingual fields, usually
+        # shared by all the documents of the catalog
+        self._languages = {} if languages is None else languages
+
+    def _load_values(self, projection):
+        """Decodes at once the stored values of the given projection (see
+        Catalog._get_projection).
+        """
+        xdoc = self._xdoc
+        values = self.__dict__
+        for name, stored, field_cls, multilingual in projection:
+            raw_value = xdoc.get_value(stored)
+            if raw_value:
+                values[name] = _decode(field_cls, raw_value)
+            elif not multilingual:
+                values[name] = field_cls.get_default()
 
     def __getattr__(self, name):
         # 1. Get the raw value
@@ -120,18 +139,14 @@ class Doc:
 
         # 3. Special Case: multilingual field (language negotiation)
         if issubclass(field_cls, Unicode) and 'from' not in info:
-            prefix = f'{name}_'
-            n = len(prefix)
-
             languages = []
             values = {}
-            for k in self._metadata:
-                if k[:n] == prefix:
-                    language = k[n:]
-                    value = getattr(self, f'{name}_{language}')
-                    if not field_cls.is_empty(value):
-                        languages.append(language)
-                        values[language] = value
+            for language in _get_languages(name, self._metadata,
+                                           self._languages):
+                value = getattr(self, f'{name}_{language}')
+                if not field_cls.is_empty(value):
+                    languages.append(language)
+                    values[language] = value
 
             if languages:
                 language = select_language(languages)
@@ -167,18 +182,15 @@ class Doc:
                 if self._metadata.get(name):
                     return getattr(self, name)
             else:
-                prefix = f'{name}_'
-                n = len(prefix)
                 # Language negotiation
                 languages = []
                 values = {}
-                for k in self._metadata:
-                    if k[:n] == prefix:
-                        language = k[n:]
-                        value = getattr(self, f'{name}_{language}')
-                        if not field_cls.is_empty(value):
-                            languages.append(language)
-                            values[language] = value
+                for language in _get_languages(name, self._metadata,
+                                               self._languages):
+                    value = getattr(self, f'{name}_{language}')
+                    if not field_cls.is_empty(value):
+                        languages.append(language)
+                        values[language] = value
                 if languages:
                     language = select_language(languages)
                     if language is None:
@@ -190,36 +202,135 @@ class Doc:
 
 class SearchResults:
 
-    def __init__(self, catalog, xquery):
+    def __init__(self, catalog, xquery, key=None):
         self._catalog = catalog
         self._xquery = xquery
+        # The normalized query, with the fields it depends on (see
+        # _get_query_key), used to cache the results
+        self._key = key
 
     @lazy
     def _enquire(self):
-        enquire = Enquire(self._catalog._db)
-        enquire.set_query(self._xquery)
-        return enquire
+        return self._make_enquire()
 
     @lazy
     def _max(self):
-        enquire = self._enquire
-        db = self._catalog._db
-        doccount = db.get_doccount()
-        return enquire.get_mset(0, doccount).size()
+        return self.get_count()
 
     def __len__(self):
         """Returns the number of documents found."""
         return self._max
 
+    def get_count(self, exact=True):
+        """Returns the number of documents found.
+
+        If "exact" is True (the default) the number is computed by the
+        matcher without building the match set, and cached by the catalog
+        until its next change.  Otherwise the matcher estimation is returned,
+        which is cheaper but may be inexact (use it for "about N results").
+        """
+        if not exact:
+            return self.get_count_bounds()[1]
+
+        catalog = self._catalog
+        key = str(self._xquery)
+        count = catalog._get_cached_count(key)
+        if count is None:
+            doccount = catalog._db.get_doccount()
+            # With check_at_least >= doccount the bounds are exact, and with
+            # maxitems = 0 no document is retrieved
+            mset = self._enquire.get_mset(0, 0, doccount)
+            count = mset.get_matches_estimated()
+            catalog._set_cached_count(key, count)
+        return count
+
+    def get_count_bounds(self, check_at_least=0):
+        """Returns the tuple (lower bound, estimation, upper bound) of the
+        number of documents found, as given by the matcher.  The higher
+        "check_at_least" the more accurate (and slow) the estimation.
+        """
+        mset = self._enquire.get_mset(0, 0, check_at_least)
+        return (mset.get_matches_lower_bound(),
+                mset.get_matches_estimated(),
+                mset.get_matches_upper_bound())
+
+    def get_facets(self, names, limit=None):
+        """Returns the number of documents found by value of the given
+        stored fields, as a dict {name: [(value, count), ...]}, the most
+        frequent values first.  With "limit" only the first values of each
+        field are returned.
+
+        The documents are counted in a single pass of the matcher.  The
+        values of the multilingual fields are those of the user language
+        (use "title_fr" for the values of a given language).  The unknown
+        fields, and the empty values, are ignored.
+        """
+        catalog = self._catalog
+        facets = {}
+        spies = []
+        enquire = self._make_enquire()
+        for name in names:
+            facets[name] = []
+            value, field_cls = catalog._get_facet_value(name)
+            if value is not None:
+                spy = ValueCountMatchSpy(value)
+                enquire.add_matchspy(spy)
+                spies.append((name, spy, field_cls))
+
+        if not spies:
+            return facets
+
+        # The spies see every match, no document is retrieved
+        doccount = catalog._db.get_doccount()
+        enquire.get_mset(0, 0, doccount)
+
+        # Decode and sort (the spies iterate in the order of the encoded
+        # values, kept for the values with the same count)
+        for name, spy, field_cls in spies:
+            counts = {}
+            for item in spy.values():
+                value = _decode(field_cls, item.term)
+                if field_cls.multiple:
+                    # The count is that of the combination of values (in
+                    # order, for the values with the same count)
+                    for value in dict.fromkeys(value):
+                        counts[value] = counts.get(value, 0) + item.termfreq
+                else:
+                    counts[value] = item.termfreq
+            counts = sorted(counts.items(), key=lambda x: -x[1])
+            facets[name] = counts if limit is None else counts[:limit]
+        return facets
+
     def search(self, query=None, **kw):
         xquery = _get_xquery(self._catalog, query, **kw)
-        query = Query(Query.OP_AND, [self._xquery, xquery])
-        return self.__class__(self._catalog, query)
+        key = self._key
+        if key is not None:
+            key = _and_query_keys([key, _get_query_key(query, **kw)])
+        xquery = Query(Query.OP_AND, [self._xquery, xquery])
+        return self.__class__(self._catalog, xquery, key)
+
+    def _make_enquire(self, sort_values=None, reverse=False):
+        """Returns a new enquire object for the query, sorted by the given
+        value number, or list of value numbers (see Catalog._get_sort_values)
+        """
+        enquire = Enquire(self._catalog._db)
+        enquire.set_query(self._xquery)
+        if sort_values is None:
+            enquire.set_sort_by_relevance()
+        elif isinstance(sort_values, list):
+            sorter = MultiValueKeyMaker()
+            for value in sort_values:
+                sorter.add_value(value, reverse)
+            enquire.set_sort_by_key_then_relevance(sorter, reverse)
+        else:
+            enquire.set_sort_by_value_then_relevance(sort_values, reverse)
+        return enquire
 
-    def get_documents(self, sort_by=None, reverse=False, start=0, size=0):
+    def get_documents(self, sort_by=None, reverse=False, start=0, size=0,
+                      fields=None):
         """Returns the documents for the search, sorted by weight.
 
-        Four optional arguments are accepted, which will modify the documents
+        Five optional arguments are accepted, which will modify the documents
         returned.
 
         First, it is possible to sort by a field, or a list of fields, instead
@@ -227,7 +338,9 @@ class SearchResults:
 
           - "sort_by", if given it must be the name of an stored field, or
             a list of names of stored fields. The results will be sorted by
-            this fields, instead of by the weight.
+            this fields, instead of by the weight.  The sortable unicode
+            fields are sorted following the collation of their language
+            (for multilingual fields, the language of the user).
 
           - "reverse", a boolean value that says whether the results will be
             ordered from smaller to greater (reverse is False, the default),
@@ -242,53 +355,225 @@ class SearchResults:
           - "size": returns at most documents as specified by this parameter.
 
         By default all the documents are returned.
+
+        Finally, if the documents are to be used to show only some values:
+
+          - "fields": the list of the names of the stored fields to decode
+            at once when a document is loaded, instead of one by one on
+            attribute access.
+
+        The documents are returned as a lazy sequence (see Documents), they
+        are only loaded from the catalog when accessed.  The window is
+        sorted once, when first accessed, and only the ids of its documents
+        are kept.
+
+        Changed: a list was returned before, the sequence supports 'len',
+        indexing, slicing and iteration; use 'list(...)' for a list.
         """
-        enquire = self._enquire
-        # sort_by != None
-        metadata = self._catalog._metadata
-        if sort_by is not None:
-            if isinstance(sort_by, list):
-                sorter = MultiValueKeyMaker()
-                for name in sort_by:
-                    # If there is a problem, ignore this field
-                    if name not in metadata:
-                        warn_not_stored(name)
-                        continue
-                    sorter.add_value(metadata[name]['value'], reverse)
-                enquire.set_sort_by_key_then_relevance(sorter, reverse)
-            else:
-                # If there is a problem, ignore the sort
-                if sort_by in metadata:
-                    value = metadata[sort_by]['value']
-                    enquire.set_sort_by_value_then_relevance(value, reverse)
-                else:
-                    warn_not_stored(sort_by)
-        else:
-            enquire.set_sort_by_relevance()
+        catalog = self._catalog
+        sort_values = catalog._get_sort_values(sort_by)
+        enquire = self._make_enquire(sort_values, reverse)
 
         # start/size
-        if size == 0:
-            size = self._catalog._db.get_doccount()
+        total = len(self)
+        start = min(start, total)
+        n = total - start
+        if size:
+            n = min(size, n)
 
         # Construction of the results
-        fields = self._catalog._fields
-        results = [Doc(x.document, fields, metadata)
-                   for x in enquire.get_mset(start, size)]
-
+        projection = catalog._get_projection(fields) if fields else None
         # sort_by=None/reverse=True
-        if sort_by is None and reverse:
-            results.reverse()
+        documents_reverse = sort_by is None and reverse
+
+        # Cache the ids of the documents of small windows
+        key = self._key
+        if key is None or n > catalog.results_cache_max_ids:
+            return Documents(catalog, enquire, start, n, documents_reverse,
+                             projection)
+
+        key, depends = key
+        if sort_by is None:
+            # The order by relevance depends on every document
+            depends = None
+        elif type(sort_by) is list:
+            sort_values = tuple(sort_values)
+            depends = depends.union(sort_by)
+        else:
+            depends = depends.union([sort_by])
+        key = (key, sort_values, reverse, start, n)
+        docids = catalog._get_cached_results(key)
+        if docids is None:
+            docids = [x.docid for x in enquire.get_mset(start, n)]
+            catalog._set_cached_results(key, depends, docids)
+        return CachedDocuments(catalog, docids, 0, len(docids),
+                               documents_reverse, projection)
+
+
+class Documents:
+    """A read-only sequence of the documents found by a search.
+
+    The ids of the documents in the window are found at once (a single
+    match), when first accessed.  Then the documents are fetched from the
+    catalog page by page, and only the current page is kept in memory.  It
+    supports 'len', indexing, slicing and iteration (that may stop at any
+    time).
+    """
 
-        return results
+    # Number of documents fetched at once
+    page_size = 500
+
+    def __init__(self, catalog, enquire, start, size, reverse=False,
+                 projection=None):
+        self._catalog = catalog
+        self._enquire = enquire
+        self._fields = catalog._fields
+        self._metadata = catalog._metadata
+        self._languages = catalog._languages
+        self._projection = projection
+        # The window within the match set
+        self._start = start
+        self._size = size
+        self._reverse = reverse
+        # The ids of the documents, from the position 'docids_start' within
+        # the match set
+        self._docids = None
+        self._docids_start = start
+        # The current page
+        self._page_start = None
+        self._page = None
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} ({self._size} documents)>'
+
+    def _get_docids(self):
+        if self._docids is None:
+            mset = self._enquire.get_mset(self._start, self._size)
+            self._docids = [x.docid for x in mset]
+            self._docids_start = self._start
+        return self._docids
+
+    def _load_page(self, first, maxitems):
+        first -= self._docids_start
+        docids = self._get_docids()[first:first + maxitems]
+        get_document = self._catalog._db.get_document
+        return [get_document(x) for x in docids]
+
+    def _get_document(self, index):
+        """Returns the document at the given position of the window, without
+        taking into account the reverse order.
+        """
+        page_size = self.page_size
+        page_start = index - index % page_size
+        if page_start != self._page_start:
+            # Release the previous page before loading the next one
+            self._page = None
+            maxitems = min(page_size, self._size - page_start)
+            self._page = self._load_page(self._start + page_start, maxitems)
+            self._page_start = page_start
+
+        xdoc = self._page[index - page_start]
+        doc = Doc(xdoc, self._fields, self._metadata, self._languages)
+        if self._projection:
+            doc._load_values(self._projection)
+        return doc
+
+    def _get_window(self, start, size, reverse):
+        documents = self.__class__(self._catalog, self._enquire, start, size,
+                                   reverse, self._projection)
+        # Share the ids found, if any
+        documents._docids = self._docids
+        documents._docids_start = self._docids_start
+        return documents
+
+    def __getitem__(self, index):
+        size = self._size
+
+        # Slice
+        if type(index) is slice:
+            start, stop, step = index.indices(size)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            n = max(stop - start, 0)
+            if self._reverse:
+                start = size - stop
+            return self._get_window(self._start + start, n, self._reverse)
+
+        # Index
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('documents index out of range')
+        if self._reverse:
+            index = size - index - 1
+        return self._get_document(index)
+
+    def __iter__(self):
+        indexes = range(self._size)
+        if self._reverse:
+            indexes = reversed(indexes)
+
+        try:
+            for index in indexes:
+                # The catalog may have fewer documents than expected
+                try:
+                    doc = self._get_document(index)
+                except IndexError:
+                    return
+                yield doc
+        finally:
+            self._page_start = None
+            self._page = None
+
+    def __reversed__(self):
+        documents = self._get_window(self._start, self._size,
+                                     not self._reverse)
+        return iter(documents)
+
+
+class CachedDocuments(Documents):
+    """The documents found by a search, from the list of their ids (as kept
+    by the catalog results cache).
+    """
+
+    def __init__(self, catalog, docids, start, size, reverse=False,
+                 projection=None):
+        super().__init__(catalog, None, start, size, reverse, projection)
+        self._docids = docids
+        self._docids_start = 0
+
+    def _get_window(self, start, size, reverse):
+        return self.__class__(self._catalog, self._docids, start, size,
+                              reverse, self._projection)
 
 
 class Catalog:
     nb_changes = 0
     _db = None
     read_only = False
-
-    def __init__(self, ref, fields, read_only=False, asynchronous_mode=True):
+    # Number of queries whose count is kept in cache
+    count_cache_size = 1000
+    # Number of search results whose document ids are kept in cache, and
+    # maximum number of ids by result
+    results_cache_size = 500
+    results_cache_max_ids = 1000
+    # Number of compiled queries (Xapian queries of the itools atoms) kept
+    # in cache
+    xquery_cache_size = 2000
+    # Number of changed documents kept in memory by Xapian before writing
+    # them to disk (XAPIAN_FLUSH_THRESHOLD)
+    flush_threshold = 2000
+
+    def __init__(self, ref, fields, read_only=False, asynchronous_mode=True,
+                 flush_threshold=None):
         self.read_only = read_only
+        # Set XAPIAN_FLUSH_THRESHOLD (read by Xapian when opening)
+        if flush_threshold is not None:
+            self.flush_threshold = flush_threshold
+        os.environ["XAPIAN_FLUSH_THRESHOLD"] = str(self.flush_threshold)
         # Load the database
         if isinstance(ref, (Database, WritableDatabase)):
             path = None
@@ -303,14 +588,22 @@ class Catalog:
         db = self._db
         self._asynchronous = asynchronous_mode
         self._fields = fields
+        # The revision is incremented on every change, it is used to
+        # invalidate the caches
+        self._revision = 0
+        self._count_cache = LRUCache(self.count_cache_size)
+        # The results cache {key: (fields, docids)}
+        self._results_cache = LRUCache(self.results_cache_size)
+        self._results_hits = 0
+        self._results_misses = 0
+        self._results_invalidations = 0
+        self._xquery_cache = LRUCache(self.xquery_cache_size)
         # FIXME: There's a bug in xapian:
         # We cannot get stored values if DB not flushed
         self.commit_each_transaction = True
         # Asynchronous mode
         if not read_only and asynchronous_mode:
             db.begin_transaction(self.commit_each_transaction)
-        # Set XAPIAN_FLUSH_THRESHOLD
-        os.environ["XAPIAN_FLUSH_THRESHOLD"] = "2000"
         # Load the xfields from the database
         self._metadata = {}
         self._value_nb = 0
@@ -336,6 +629,17 @@ class Catalog:
                     metadata[name] = merge_dicts(
                         metadata[name],
                         self._get_info_stored())
+                # If the field was in the catalog but is newly sortable,
+                # its sort keys are not used until the catalog is reindexed
+                # (see fill_sort_values)
+                if 'sort' not in metadata[name] and _is_sortable(field_cls):
+                    log.debug(f"[Catalog] Field is now sortable: {name}")
+                    log.warning(f"[Catalog] Reindex to sort by {name}")
+                    has_changes = True
+                    metadata[name] = merge_dicts(
+                        metadata[name],
+                        self._get_info_sortable(),
+                        sort_pending=True)
                 # If the field was stored in the catalog but is newly indexed
                 if 'prefix' not in metadata[name] and getattr(field_cls, 'indexed', False):
                     log.debug(f"[Catalog] Stored field is now indexed: {name}")
@@ -343,7 +647,16 @@ class Catalog:
                     metadata[name] = merge_dicts(
                         metadata[name],
                         self._get_info_indexed())
+        # The languages of the multilingual fields newly sortable
+        for name, info in list(metadata.items()):
+            field_cls = self._fields.get(info.get('from'))
+            if (field_cls is not None and 'sort' not in info and
+                    _is_sortable(field_cls)):
+                has_changes = True
+                metadata[name] = merge_dicts(
+                    info, self._get_info_sortable(), sort_pending=True)
         if has_changes:
+            self._reset_metadata_caches()
             self._db.set_metadata('metadata', dumps(metadata))
             self._db.commit_transaction()
             self._db.begin_transaction(self.commit_each_transaction)
@@ -358,6 +671,7 @@ class Catalog:
             raise ValueError("The transactions are synchronous")
         db = self._db
         db.commit_transaction()
+        self._bump_revision()
         if self.commit_each_transaction:
             db.commit()
         else:
@@ -379,6 +693,8 @@ class Catalog:
         else:
             db.cancel_transaction()
             db.begin_transaction(self.commit_each_transaction)
+        self._bump_revision()
+        self._clear_results_cache()
         self._load_all_internal()
 
     def close(self):
@@ -405,15 +721,92 @@ class Catalog:
             self._db.close()
             self._db = None
 
+    def fill_sort_values(self):
+        """To be called once every document has been indexed again, after
+        a field became sortable: then its sort keys are used to sort.
+        """
+        metadata = self._metadata
+        names = [ x for x, info in metadata.items() if 'sort_pending' in info ]
+        if not names:
+            return
+
+        for name in names:
+            del metadata[name]['sort_pending']
+        self._reset_metadata_caches()
+        self._clear_results_cache()
+        self._db.set_metadata('metadata', dumps(metadata))
+
     #######################################################################
     # API / Public / (Un)Index
     #######################################################################
     def index_document(self, document):
         self.nb_changes += 1
         abspath, term, xdoc = self.get_xdoc_from_document(document)
+        self._invalidate_results(term, xdoc)
         self._db.replace_document(term, xdoc)
+        self._bump_revision()
         log.debug(f"Indexed : {abspath}")
 
+    def index_documents(self, documents, workers=None, chunksize=100):
+        """Index the given documents (an iterable of dicts of values, like
+        'index_document') within the current transaction, and return how
+        many documents have been indexed.
+
+        If 'workers' is greater than 1, the Xapian documents are built by a
+        pool of that many processes, by chunks of 'chunksize' documents, and
+        written to the catalog by the current process.  The documents with
+        values for fields (or languages) new to the catalog are indexed by
+        the current process.
+
+        Only the Xapian documents are built in parallel: the values given
+        (see 'get_catalog_values') are still computed by the current
+        process, when consumed.  The processes are spawned, not forked, as
+        the current process may run other threads; so it is meant for
+        offline work, like rebuilding the catalog.
+
+        The fields are sent to the processes as the datatypes they derive
+        from and the attributes given (see _get_field_spec), they must be
+        importable.  Else the documents are indexed by the current process.
+        """
+        initargs = None
+        if workers and workers > 1:
+            try:
+                fields = {
+                    name: _get_field_spec(field_cls)
+                    for name, field_cls in self._fields.items() }
+                initargs = (fields, self._metadata, self._value_nb,
+                            self._prefix_nb)
+                pickle.dumps(initargs)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                log.warning("[Catalog] The fields cannot be sent to the "
+                            "workers, index by this process", exc_info=True)
+                initargs = None
+
+        if initargs is None:
+            n = 0
+            for document in documents:
+                self.index_document(document)
+                n += 1
+            return n
+
+        n = 0
+        db = self._db
+        context = get_context('spawn')
+        with context.Pool(workers, _init_index_worker, initargs) as pool:
+            for result in pool.imap(_build_xdoc, documents, chunksize):
+                abspath, term, xdoc = result
+                if term is None:
+                    # New field, must be registered by this process
+                    self.index_document(xdoc)
+                else:
+                    self.nb_changes += 1
+                    db.replace_document(term, _load_xdoc(*xdoc))
+                    log.debug(f"Indexed : {abspath}")
+                n += 1
+        self._bump_revision()
+        self._clear_results_cache()
+        return n
+
     def unindex_document(self, abspath):
         """Remove the document that has value stored in its abspath.
            If the document does not exist => no error
@@ -422,12 +815,33 @@ class Catalog:
         data = _reduce_size(_encode(self._fields['abspath'], abspath))
         if type(data) is bytes:
             data = data.decode("utf-8")
+        self._invalidate_results('Q' + data, None)
         self._db.delete_document('Q' + data)
+        self._bump_revision()
         log.debug(f"Unindexed : {abspath}")
 
+    def has_document(self, abspath):
+        """Return whether a document is indexed with the given abspath.
+        """
+        data = _reduce_size(_encode(self._fields['abspath'], abspath))
+        return self._db.term_exists(b'Q' + data)
+
     def get_xdoc_from_document(self, doc_values):
         """Return (abspath, term, xdoc) from the document (resource or values as dict)
         """
+        abspath, term, xdoc, metadata_modified = self._make_xdoc(doc_values)
+        # Store metadata ?
+        if metadata_modified:
+            self._reset_metadata_caches()
+            self._db.set_metadata('metadata', dumps(self._metadata))
+        # Ok
+        return abspath, term, xdoc
+
+    def _make_xdoc(self, doc_values):
+        """Return (abspath, term, xdoc, metadata_modified) from the document,
+        the new fields are registered in the catalog metadata (but the
+        metadata is not stored).
+        """
         term = None
         metadata = self._metadata
         # Check the input
@@ -482,6 +896,10 @@ class Catalog:
                         if 'value' in lang_info:
                             xdoc.add_value(lang_info['value'],
                                            _encode(field_cls, lang_value))
+                        # Is sortable ?
+                        if 'sort' in lang_info:
+                            xdoc.add_value(lang_info['sort'],
+                                           _make_sort_key(lang_value, language))
                         # Is indexed ?
                         if 'prefix' in lang_info:
                             # Comment: Index twice
@@ -494,16 +912,15 @@ class Catalog:
                 # Is stored ?
                 if 'value' in info:
                     xdoc.add_value(info['value'], _encode(field_cls, value))
+                # Is sortable ?
+                if 'sort' in info:
+                    xdoc.add_value(info['sort'], _make_sort_key(value, None))
                 # Is indexed ?
                 if 'prefix' in info:
                     # By default language='en'
                     _index(xdoc, field_cls, value, info['prefix'], 'en')
-        # Store metadata ?
-        if metadata_modified:
-            metadata = self._metadata
-            self._db.set_metadata('metadata', dumps(metadata))
         # Ok
-        return abspath, term, xdoc
+        return abspath, term, xdoc, metadata_modified
 
     #######################################################################
     # API / Public / Search
@@ -525,6 +942,204 @@ class Catalog:
     #######################################################################
     # API / Private
     #######################################################################
+    def _bump_revision(self):
+        """Called on every change of the catalog, invalidates the caches.
+        """
+        self._revision += 1
+        self._count_cache.clear()
+
+    def get_results_cache_stats(self):
+        """Return the statistics of the results cache.
+        """
+        return {
+            'size': len(self._results_cache),
+            'hits': self._results_hits,
+            'misses': self._results_misses,
+            'invalidations': self._results_invalidations}
+
+    def _get_cached_results(self, key):
+        cache = self._results_cache
+        value = cache.get(key)
+        if value is None:
+            self._results_misses += 1
+            return None
+        self._results_hits += 1
+        cache.touch(key)
+        return value[1]
+
+    def _set_cached_results(self, key, depends, docids):
+        self._results_cache[key] = (depends, docids)
+
+    def _clear_results_cache(self):
+        self._results_invalidations += len(self._results_cache)
+        self._results_cache.clear()
+
+    def _invalidate_results(self, term, xdoc):
+        """Remove from the results cache the results that may change when
+        the document identified by the given term is replaced by the given
+        Xapian document (or removed if None).
+        """
+        cache = self._results_cache
+        if not cache:
+            return
+
+        # The fields changed
+        db = self._db
+        old_xdoc = None
+        for item in db.postlist(term):
+            old_xdoc = db.get_document(item.docid)
+            break
+        touched = self._get_touched_fields(old_xdoc, xdoc)
+        if not touched:
+            return
+
+        # Invalidate
+        for key, (depends, docids) in list(cache.items()):
+            if depends is None or not touched.isdisjoint(depends):
+                del cache[key]
+                self._results_invalidations += 1
+
+    def _get_touched_fields(self, old_xdoc, new_xdoc):
+        """Return the set of the names of the fields whose terms or values
+        differ between the two given Xapian documents (any can be None).
+        The special name '*' is included if the document is added or
+        removed.
+        """
+        prefixes, values = self._get_fields_map()
+        touched = set()
+        if old_xdoc is None or new_xdoc is None:
+            touched.add('*')
+
+        old_terms = _get_xdoc_terms(old_xdoc)
+        new_terms = _get_xdoc_terms(new_xdoc)
+        for prefix in set(old_terms).union(new_terms):
+            if old_terms.get(prefix) != new_terms.get(prefix):
+                touched.update(prefixes.get(prefix, ()))
+
+        old_values = _get_xdoc_values(old_xdoc)
+        new_values = _get_xdoc_values(new_xdoc)
+        for number in set(old_values).union(new_values):
+            if old_values.get(number) != new_values.get(number):
+                touched.update(values.get(number, ()))
+
+        return touched
+
+    def _reset_metadata_caches(self):
+        """Called when the metadata changes, reset what depends on it.
+        """
+        self._languages = {}
+        self._fields_map = None
+        self._xquery_cache.clear()
+
+    def _get_fields_map(self):
+        """Return the maps {prefix: names} and {value number: names}.
+        """
+        if self._fields_map is None:
+            prefixes = {}
+            values = {}
+            for name, info in self._metadata.items():
+                # The languages of a field depend on the field
+                names = {name, info['from']} if 'from' in info else {name}
+                if 'prefix' in info:
+                    prefix = info['prefix'].encode()
+                    prefixes.setdefault(prefix, set()).update(names)
+                if 'value' in info:
+                    values.setdefault(info['value'], set()).update(names)
+            self._fields_map = prefixes, values
+        return self._fields_map
+
+    def _get_cached_count(self, key):
+        cache = self._count_cache
+        count = cache.get(key)
+        if count is not None:
+            cache.touch(key)
+        return count
+
+    def _set_cached_count(self, key, count):
+        self._count_cache[key] = count
+
+    def _get_sort_values(self, sort_by):
+        """Return the value number to sort by the given field, or the list
+        of value numbers for the given list of fields (see
+        SearchResults._make_enquire).  The unknown fields are ignored.
+        """
+        if sort_by is None:
+            return None
+
+        if isinstance(sort_by, list):
+            values = [self._get_sort_value(x) for x in sort_by]
+            return [x for x in values if x is not None]
+
+        return self._get_sort_value(sort_by)
+
+    def _get_sort_value(self, name):
+        metadata = self._metadata
+        info = metadata.get(name)
+        # If there is a problem, ignore this field
+        if info is None or 'value' not in info:
+            warn_not_stored(name)
+            return None
+
+        # Multilingual: the values of the user language
+        if 'from' not in info and 'sort' in info:
+            languages = _get_languages(name, metadata, self._languages)
+            if languages:
+                language = select_language(languages) or languages[0]
+                info = metadata[f'{name}_{language}']
+
+        # The sort keys are not used until they are filled (see
+        # fill_sort_values)
+        if 'sort' not in info or 'sort_pending' in info:
+            return info['value']
+        return info['sort']
+
+    def _get_facet_value(self, name):
+        """Return the value number and the field class to count the values
+        of the given field (see SearchResults.get_facets).
+        """
+        metadata = self._metadata
+        info = metadata.get(name)
+        # If there is a problem, ignore this field
+        if info is None or 'value' not in info:
+            warn_not_stored(name)
+            return None, None
+
+        # Multilingual: the values of the user language
+        field_cls = _get_field_cls(name, self._fields, info)
+        if issubclass(field_cls, Unicode) and 'from' not in info:
+            languages = _get_languages(name, metadata, self._languages)
+            if languages:
+                language = select_language(languages) or languages[0]
+                info = metadata[f'{name}_{language}']
+
+        return info['value'], field_cls
+
+    def _get_projection(self, names):
+        """Returns the list of (name, value number, field class, multilingual)
+        used by Doc._load_values to decode the stored values of the given
+        fields.  The languages of the multilingual fields are included.
+        """
+        metadata = self._metadata
+        fields = self._fields
+        projection = []
+        seen = set()
+        names = list(names)
+        for name in names:
+            if name in seen:
+                continue
+            seen.add(name)
+            info = metadata.get(name)
+            if info is None or 'value' not in info:
+                warn_not_stored(name)
+                continue
+            field_cls = _get_field_cls(name, fields, info)
+            multilingual = issubclass(field_cls, Unicode) and 'from' not in info
+            if multilingual:
+                languages = _get_languages(name, metadata, self._languages)
+                names.extend(f'{name}_{x}' for x in languages)
+            projection.append((name, info['value'], field_cls, multilingual))
+        return projection
+
     def _get_info(self, field_cls, name):
         # The key field ?
         if name == 'abspath':
@@ -540,6 +1155,9 @@ class Catalog:
         # Indexed ?
         if getattr(field_cls, 'indexed', False):
             info = merge_dicts(info, self._get_info_indexed())
+        # Sortable ?
+        if _is_sortable(field_cls):
+            info = merge_dicts(info, self._get_info_sortable())
         # Ok
         return info
 
@@ -548,6 +1166,12 @@ class Catalog:
         self._value_nb += 1
         return {'value': value}
 
+    def _get_info_sortable(self):
+        # The sort key is stored in its own value
+        value = self._value_nb
+        self._value_nb += 1
+        return {'sort': value}
+
     def _get_info_indexed(self):
         prefix = _get_prefix(self._prefix_nb)
         self._prefix_nb += 1
@@ -558,6 +1182,7 @@ class Catalog:
         """
         self._value_nb = 0
         self._prefix_nb = 0
+        self._reset_metadata_caches()
 
         metadata = self._db.get_metadata('metadata')
 
@@ -575,12 +1200,43 @@ class Catalog:
             for name, info in self._metadata.items():
                 if 'value' in info:
                     self._value_nb += 1
+                if 'sort' in info:
+                    self._value_nb += 1
                 if 'prefix' in info:
                     self._prefix_nb += 1
 
+    @lazy
+    def _query_parser(self):
+        """The query parser used for the text queries.
+        """
+        qp = QueryParser()
+        qp.set_database(self._db)
+        return qp
+
     def _query2xquery(self, query):
         """take a "itools" query and return a "xapian" query
         """
+        # The Xapian queries of the atoms (but text queries, which depend on
+        # the content of the database) are kept in cache
+        if type(query) in (PhraseQuery, RangeQuery, StartQuery):
+            key = _get_query_key(query)
+            if key is not None:
+                key = key[0]
+                cache = self._xquery_cache
+                xquery = cache.get(key)
+                if xquery is None:
+                    xquery = self._compile_query(query)
+                    cache[key] = xquery
+                else:
+                    cache.touch(key)
+                return xquery
+
+        return self._compile_query(query)
+
+    def _compile_query(self, query):
+        """take a "itools" query and return a "xapian" query, see
+        _query2xquery
+        """
         query_class = type(query)
         fields = self._fields
         metadata = self._metadata
@@ -720,8 +1376,7 @@ class Catalog:
                 raise TypeError(f"unexpected {type(value)} for 'value'")
             value = value.translate(TRANSLATE_MAP)
 
-            qp = QueryParser()
-            qp.set_database(self._db)
+            qp = self._query_parser
             return qp.parse_query(_encode(field_cls, value), TQ_FLAGS, prefix)
 
         i2x = self._query2xquery
@@ -742,6 +1397,89 @@ class Catalog:
             return Query(OP_AND_NOT, Query(''), i2x(query.query))
 
 
+#######################################################################
+# Bulk indexing (see Catalog.index_documents)
+#######################################################################
+_index_worker = None
+
+
+def _get_field_spec(field_cls):
+    """Return a picklable description of the given datatype, to be made
+    again by _make_field: the module and name of the datatype it derives
+    from, and the attributes given to the prototypes made from it (like
+    "String(indexed=True)"), the first one first.
+    """
+    attributes = []
+    while field_cls.__name__.startswith('[anonymous]'):
+        attributes.append({
+            name: value for name, value in vars(field_cls).items()
+            if not name.startswith('__') })
+        field_cls = field_cls.__bases__[0]
+    attributes.reverse()
+    return field_cls.__module__, field_cls.__qualname__, attributes
+
+
+def _make_field(module, name, attributes):
+    """Return the datatype described by the values returned by
+    _get_field_spec.
+    """
+    field_cls = import_module(module)
+    for attribute in name.split('.'):
+        field_cls = getattr(field_cls, attribute)
+    for kw in attributes:
+        field_cls = field_cls(**kw)
+    return field_cls
+
+
+def _init_index_worker(fields, metadata, value_nb, prefix_nb):
+    """Initialize the worker process with a copy of the catalog, without
+    database.  The fields are given as returned by _get_field_spec.
+    """
+    global _index_worker
+    catalog = object.__new__(Catalog)
+    catalog._fields = {
+        name: _make_field(*spec) for name, spec in fields.items() }
+    catalog._metadata = metadata.copy()
+    catalog._value_nb = value_nb
+    catalog._prefix_nb = prefix_nb
+    _index_worker = (catalog, metadata, value_nb, prefix_nb)
+
+
+def _build_xdoc(doc_values):
+    """Called in a worker process, return (abspath, term, xdoc) where xdoc
+    is the (picklable) description of the Xapian document, see _load_xdoc.
+
+    If the document has values for new fields, term is None and the
+    document values are returned as is.
+    """
+    catalog, metadata, value_nb, prefix_nb = _index_worker
+    abspath, term, xdoc, metadata_modified = catalog._make_xdoc(doc_values)
+    if metadata_modified:
+        # Restore the metadata of the parent process
+        catalog._metadata = metadata.copy()
+        catalog._value_nb = value_nb
+        catalog._prefix_nb = prefix_nb
+        return abspath, None, doc_values
+
+    terms = [(x.term, x.wdf, list(x.positer)) for x in xdoc]
+    values = [(x.num, x.value) for x in xdoc.values()]
+    return abspath, term, (terms, values)
+
+
+def _load_xdoc(terms, values):
+    """Make the Xapian document from its description, see _build_xdoc.
+    """
+    xdoc = Document()
+    for term, wdf, positions in terms:
+        for position in positions:
+            xdoc.add_posting(term, position)
+        if wdf > len(positions) or not positions:
+            xdoc.add_term(term, wdf - len(positions))
+    for number, value in values:
+        xdoc.add_value(number, value)
+    return xdoc
+
+
 def make_catalog(uri, fields):
     """Creates a new and empty catalog in the given uri.
 
@@ -830,6 +1568,144 @@ def _get_field_cls(name, fields, info):
     return fields[name] if (name in fields) else fields[info['from']]
 
 
+def _get_xdoc_terms(xdoc):
+    """Return the terms of the given Xapian document, with their positions,
+    grouped by prefix: {prefix: {(term, positions), ...}}
+    """
+    terms = {}
+    if xdoc is None:
+        return terms
+    for item in xdoc:
+        term = item.term
+        # The prefixes are 'X' * n + one letter
+        n = len(term) - len(term.lstrip(b'X')) + 1
+        prefix = term[:n]
+        value = (term, tuple(item.positer))
+        terms.setdefault(prefix, set()).add(value)
+    return terms
+
+
+def _get_xdoc_values(xdoc):
+    if xdoc is None:
+        return {}
+    return {x.num: x.value for x in xdoc.values()}
+
+
+def _get_query_key(query=None, **kw):
+    """Return a normalized, hashable, version of the given query (or of the
+    keyword parameters, see _get_xquery), and the set of the names of the
+    fields it depends on, where '*' stands for all the documents.
+
+    Return None if the query cannot be normalized.
+    """
+    if query is None:
+        if not kw:
+            return ('all',), frozenset(['*'])
+        keys = [_get_query_key(PhraseQuery(name, value))
+                for name, value in kw.items()]
+        return _and_query_keys(keys)
+
+    query_class = type(query)
+    if query_class is AllQuery:
+        return ('all',), frozenset(['*'])
+
+    if query_class in (PhraseQuery, StartQuery, TextQuery):
+        value = _freeze_value(query.value)
+        if value is None:
+            return None
+        key = (query_class.__name__, query.name, value)
+        return key, frozenset([query.name])
+
+    if query_class is RangeQuery:
+        left = _freeze_value(query.left)
+        right = _freeze_value(query.right)
+        key = ('RangeQuery', query.name, left, right)
+        return key, frozenset([query.name])
+
+    if query_class is NotQuery:
+        key = _get_query_key(query.query)
+        if key is None:
+            return None
+        key, depends = key
+        return ('not', key), depends.union(['*'])
+
+    if isinstance(query, _MultipleQuery):
+        keys = [_get_query_key(x) for x in query.atoms]
+        if len(keys) == 1:
+            return keys[0]
+        if query_class is _AndQuery:
+            return _and_query_keys(keys)
+        if query_class is _OrQuery:
+            return _join_query_keys('or', keys)
+
+    return None
+
+
+def _and_query_keys(keys):
+    return _join_query_keys('and', keys)
+
+
+def _join_query_keys(operator, keys):
+    if None in keys:
+        return None
+    # The nested queries of the same operator are flattened, and the order
+    # of the sub-queries does not matter
+    atoms = set()
+    for key, depends in keys:
+        if key[0] == operator:
+            atoms.update(key[1])
+        else:
+            atoms.add(key)
+    depends = frozenset().union(*[x[1] for x in keys])
+    if len(atoms) == 1:
+        return atoms.pop(), depends
+    return (operator, tuple(sorted(atoms, key=repr))), depends
+
+
+def _freeze_value(value):
+    """Return a hashable version of the given query value, or None.
+    """
+    if isinstance(value, (list, tuple)):
+        value = tuple(value)
+    elif isinstance(value, (set, frozenset)):
+        value = tuple(sorted(value, key=repr))
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    # Keep the type (1 and True are equal, but not the same query)
+    return type(value).__name__, value
+
+
+def _is_sortable(field_cls):
+    """Only the unicode fields need a sort key, the encoded value of the
+    others is already sortable.
+    """
+    return (getattr(field_cls, 'sortable', False) and
+            getattr(field_cls, 'stored', False) and
+            issubclass(field_cls, Unicode))
+
+
+def _make_sort_key(value, language):
+    # Multiple: sort by the first value
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else ''
+    return get_sort_key(value, language)
+
+
+def _get_languages(name, metadata, cache):
+    """Returns the languages of the given multilingual field, the result is
+    kept in the given cache.
+    """
+    languages = cache.get(name)
+    if languages is None:
+        prefix = f'{name}_'
+        n = len(prefix)
+        languages = [k[n:] for k in metadata if k[:n] == prefix]
+        cache[name] = languages
+    return languages
+
+
 def _reduce_size(data):
     # 'data' must be a byte string
 
@@ -944,6 +1820,18 @@ def _index(xdoc, field_cls, value, prefix, language):
 
 
 def _make_PhraseQuery(field_cls, value, prefix):
+    # Not unicode: the words are the terms made by _index, in order
+    if not issubclass(field_cls, Unicode):
+        is_multiple = isinstance(value, (tuple, list, set, frozenset))
+        if field_cls.multiple and is_multiple:
+            values = value
+        else:
+            values = [value]
+        prefix = prefix.encode()
+        words = [prefix + _reduce_size(_encode_simple_value(field_cls, x))
+                 for x in values]
+        return Query(OP_PHRASE, words)
+
     # Get the words
     # XXX It's too complex (slow), we must use xapian
     #     Problem => _index_cjk
@@ -973,7 +1861,6 @@ def _get_xquery(catalog, query=None, **kw):
 
     # Case 3: build the query from the keyword parameters
     metadata = catalog._metadata
-    fields = catalog._fields
     xqueries = []
     for name, value in kw.items():
         # If name is a field not yet indexed, return nothing
@@ -982,10 +1869,7 @@ def _get_xquery(catalog, query=None, **kw):
             return Query()
 
         # Ok
-        info = metadata[name]
-        prefix = info['prefix']
-        field_cls = _get_field_cls(name, fields, info)
-        query = _make_PhraseQuery(field_cls, value, prefix)
+        query = catalog._query2xquery(PhraseQuery(name, value))
         xqueries.append(query)
 
     return Query(OP_AND, xqueries)
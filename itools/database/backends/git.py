@@ -13,25 +13,33 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import deque
+from contextlib import nullcontext
 from datetime import datetime, timedelta, time
-from heapq import heappush, heappop
-from multiprocessing import Process
-from os.path import abspath, dirname
+from multiprocessing import Process, get_context
+from os.path import abspath, dirname, exists
+from queue import Empty
+from threading import Condition, Thread
+from time import monotonic
+import time as time_
 from uuid import uuid4
+import logging
 import os
 
 # Import from pygit2
-from pygit2 import TreeBuilder, GIT_FILEMODE_TREE, init_repository
+from pygit2 import GIT_STATUS_CURRENT, GitError, hashfile
+from pygit2 import init_repository
 
 # Import from itools
 from itools.database import Metadata
 from itools.database.magic_ import magic_from_buffer
-from itools.database.git import open_worktree
+from itools.database.git import Heap, open_worktree
 from itools.fs import lfs
-from itools.fs.common import READ_WRITE
+from itools.fs.common import APPEND, READ_WRITE
 
 # Import from here
-from .catalog import Catalog, _get_xquery, SearchResults, make_catalog
+from .catalog import Catalog, _get_xquery, _get_query_key, SearchResults
+from .catalog import make_catalog
 from .patchs import PatchsBackend
 from .registry import register_backend
 
@@ -40,54 +48,405 @@ TEST_DB_WITHOUT_COMMITS = bool(int(os.environ.get('TEST_DB_WITHOUT_COMMITS') or
 TEST_DB_DESACTIVATE_GIT = bool(int(os.environ.get('TEST_DB_DESACTIVATE_GIT') or 0))
 TEST_DB_DESACTIVATE_STATIC_HISTORY = bool(int(os.environ.get('TEST_DB_DESACTIVATE_STATIC_HISTORY') or 1))
 TEST_DB_DESACTIVATE_PATCH = bool(int(os.environ.get('TEST_DESACTIVATE_PATCH') or 1))
+DB_GROUP_COMMIT = bool(int(os.environ.get('DB_GROUP_COMMIT') or 0))
 
+log = logging.getLogger("itools.database")
 
-class Heap:
-    """
-    This object behaves very much like a sorted dict, but for security only a
-    subset of the dict API is exposed:
 
-       >>> len(heap)
-       >>> heap[path] = value
-       >>> value = heap.get(path)
-       >>> path, value = heap.popitem()
+class GroupCommitter:
+    """Commits to Git in a background thread the transactions of the
+    backend, several transactions at once (group commit).
 
-    The keys are relative paths as used in Git trees, like 'a/b/c' (and '' for
-    the root).
+    The transactions are queued by 'put' once their files are written.  The
+    thread waits up to 'delay' seconds for more transactions, then makes a
+    single Git commit for up to 'size' transactions.  If 'fsync' is True the
+    files of the batch are synced to disk before the commit.
 
-    The dictionary is sorted so deeper paths are considered smaller, and so
-    returned first by 'popitem'. The order relation between two paths of equal
-    depth is undefined.
+    The queue is only kept in memory.  On start the files changed and not
+    committed (if the server stopped before) are found in the patches (see
+    PatchsBackend.get_changed_keys), or in the status of the working tree
+    if there is no commit yet, and committed first.  So the patches are
+    written synchronously, before the files.
 
-    This data structure is used by RWDatabase._save_changes to build the tree
-    objects before commit.
+    The files are written, and committed, with the lock of the worktree.
     """
 
-    def __init__(self):
-        self._dict = {}
-        self._heap = []
+    def __init__(self, backend, delay=1.0, size=100, fsync=True):
+        self.backend = backend
+        self.delay = delay
+        self.size = size
+        self.fsync = fsync
+        # The queue of transactions [((author, date, message), keys), ...]
+        self.queue = []
+        self.busy = False
+        self.stopped = False
+        self.condition = Condition()
+        # Statistics
+        self.nb_batches = 0
+        self.nb_transactions = 0
+        # Recover the transactions not committed
+        keys = self.get_uncommitted_keys()
+        if keys:
+            log.warning(f'[Git] Commit {len(keys)} files not committed')
+            self.queue.append(((None, None, 'Autocommit'), keys))
+        # Start
+        self.thread = Thread(target=self.run, name='itools-git-committer',
+                             daemon=True)
+        self.thread.start()
+
+    def get_uncommitted_keys(self):
+        """Return the keys of the metadata files changed since the last
+        commit, and not committed.
+        """
+        backend = self.backend
+        worktree = backend.worktree
+        with worktree.lock:
+            try:
+                metadata = worktree.get_metadata()
+            except (KeyError, GitError):
+                # No commit yet (there is no HEAD)
+                return {
+                    key for key, flags in worktree.repo.status().items()
+                    if key.endswith('metadata') and flags != GIT_STATUS_CURRENT }
+
+            # Compared to the last commit (the index file may be behind)
+            tree = worktree.lookup(metadata['tree'])
+            keys = set()
+            since = metadata['committer_date']
+            for key in backend.patchs_backend.get_changed_keys(since):
+                if not key.endswith('metadata'):
+                    continue
+                path = worktree._get_abspath(key)
+                sha = str(hashfile(path)) if exists(path) else None
+                try:
+                    entry = tree[key]
+                except KeyError:
+                    committed = None
+                else:
+                    committed = str(entry.id)
+                if sha != committed:
+                    keys.add(key)
+            return keys
+
+    def put(self, data, keys):
+        """Queue a transaction: 'data' as returned by
+        RWDatabase._before_commit, and the keys of the files changed.
+        """
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError('the committer is stopped')
+            # Keep the author, date and message (not the documents)
+            self.queue.append((data[:3], set(keys)))
+            self.condition.notify_all()
+
+    def wait(self):
+        """Block until every queued transaction has been committed.
+        """
+        with self.condition:
+            while self.queue or self.busy:
+                self.condition.wait()
+
+    def stop(self):
+        """Commit the queued transactions, then stop the thread.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        condition = self.condition
+        while True:
+            with condition:
+                while not self.queue and not self.stopped:
+                    condition.wait()
+                if not self.queue:
+                    return
+                # Give some time to other transactions to join the batch
+                deadline = monotonic() + self.delay
+                while len(self.queue) < self.size and not self.stopped:
+                    timeout = deadline - monotonic()
+                    if timeout <= 0:
+                        break
+                    condition.wait(timeout)
+                batch = self.queue[:self.size]
+                del self.queue[:self.size]
+                self.busy = True
+
+            try:
+                self.commit(batch)
+            except Exception:
+                log.error("Group commit failed", exc_info=True)
+                if not self.stopped:
+                    # Retry later, with the next transactions
+                    with condition:
+                        self.queue[0:0] = batch
+                        condition.wait(self.delay)
+            finally:
+                with condition:
+                    self.busy = False
+                    condition.notify_all()
+
+    def commit(self, batch):
+        backend = self.backend
+        keys = set()
+        messages = []
+        for (_, _, message), transaction_keys in batch:
+            keys.update(transaction_keys)
+            message = message or 'no comment'
+            if message not in messages:
+                messages.append(message)
+
+        # Durability
+        if self.fsync:
+            for key in keys:
+                fs = backend.get_handler_fs_by_key(key)
+                if fs.exists(key):
+                    fd = os.open(fs.get_absolute_path(key), os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+
+        # The files are committed in their current state (a later change
+        # is committed again by the next batch).  The request threads do not
+        # write the files meanwhile (see GitBackend.do_transaction)
+        fs = backend.fs
+        keys = [x for x in keys if x.endswith('metadata')]
+        with backend.worktree.lock:
+            added = [x for x in keys if fs.exists(x)]
+            removed = [x for x in keys if not fs.exists(x)]
+            if added or removed:
+                git_author, git_date, _ = batch[-1][0]
+                data = git_author, git_date, '\n'.join(messages), [], []
+                backend.do_git_transaction(None, data, added, [], removed,
+                                           None)
+
+        # Ok
+        self.nb_batches += 1
+        self.nb_transactions += len(batch)
+
+
+def run_git_committer(path, queue, stats, interval, window):
+    """The main loop of the committer process (see GitCommitter).
+
+    The messages read from the queue are:
+
+      ('keys', keys)       -- the keys changed by a transaction
+      ('all',)             -- commit every file of the working tree
+      ('flush',)           -- commit now
+      None                 -- commit now and exit
+    """
+    worktree = open_worktree(path)
+    pending = set()
+    full = False
+    nb_pending = 0
+    last_commit = 0
+    while True:
+        # Wake up when the next commit is due
+        timeout = 60
+        if pending or full:
+            timeout = min(timeout, max(last_commit + interval - time_.time(), 1))
+        try:
+            message = queue.get(timeout=timeout)
+        except Empty:
+            message = ()
+
+        # Read
+        flush = False
+        if message is None:
+            flush = True
+        elif message:
+            if message[0] == 'keys':
+                pending.update(message[1])
+            elif message[0] == 'all':
+                full = True
+            if message[0] in ('keys', 'all'):
+                nb_pending += 1
+            else:
+                flush = True
+
+        # Commit, on schedule or when asked
+        if not pending and not full:
+            if message is None:
+                return
+            continue
+        if not flush:
+            now = datetime.now()
+            if now.timestamp() - last_commit < interval:
+                continue
+            if window and not is_in_window(now.time(), window):
+                continue
+
+        if full:
+            worktree.git_add_all()
+            tree = None
+        else:
+            added = {x for x in pending if exists(worktree._get_abspath(x))}
+            removed = pending - added
+            worktree.git_add(*added)
+            worktree.git_rm(*removed)
+            tree = worktree.make_tree(added, removed)
+        # Nothing to commit (keys recovered twice)
+        head = worktree._resolve_reference('HEAD')
+        if tree is None or head is None or tree != worktree.lookup(head).tree.id:
+            worktree.git_commit('Autocommit', tree=tree)
+        worktree.write_index()
+        pending.clear()
+        full = False
+        last_commit = time_.time()
+        # Statistics
+        with stats.get_lock():
+            stats[0] += nb_pending
+            stats[1] = last_commit
+            stats[2] += 1
+        nb_pending = 0
+        if message is None:
+            return
+
 
-    def __len__(self):
-        return len(self._dict)
+def is_in_window(t, window):
+    start, end = window
+    if start <= end:
+        return start <= t < end
+    return t >= start or t < end
 
-    def get(self, path):
-        return self._dict.get(path)
 
-    def __setitem__(self, path, value):
-        if path not in self._dict:
-            n = -path.count('/') if path else 1
-            heappush(self._heap, (n, path))
+class GitCommitter:
+    """The big databases are not committed on every transaction (see
+    TEST_DB_WITHOUT_COMMITS), the keys changed are sent to a committer
+    process, that commits them at most every 'interval' seconds, within the
+    'window' of time (a tuple of datetime.time, or None for anytime).
 
-        self._dict[path] = value
+    The committer process is restarted if it dies.  On start the keys
+    changed since the last commit are found in the patches (see
+    PatchsBackend.get_changed_keys), or every file is committed if there
+    are no patches.  So the patches are written synchronously, before the
+    files.
 
-    def popitem(self):
-        key = heappop(self._heap)
-        path = key[1]
-        return path, self._dict.pop(path)
+    The committer process is spawned, not forked, as the server runs other
+    threads (like the patches writer).  So the main module of the program
+    is imported again by the committer process: its entry point must be
+    guarded by "if __name__ == '__main__':", else the committer process
+    starts the program again.
+    """
+
+    def __init__(self, backend, interval=7200, window=None):
+        self.backend = backend
+        self.interval = interval
+        self.window = window
+        self.restarts = 0
+        self.process = None
+        self.start()
+
+    def start(self):
+        backend = self.backend
+        # Recover the keys changed since the last commit
+        try:
+            since = backend.worktree.get_metadata()['committer_date']
+        except (KeyError, GitError):
+            # No commit yet (there is no HEAD)
+            keys = None
+        else:
+            keys = backend.patchs_backend.get_changed_keys(since)
+
+        # Start
+        context = get_context('spawn')
+        # (nb transactions committed, time of last commit, nb commits)
+        self.stats = context.Array('d', 3)
+        # The time of the transactions sent and not yet committed
+        self.times = deque()
+        self.nb_committed = 0
+        self.queue = context.Queue()
+        self.process = context.Process(
+            target=run_git_committer, name='itools-git-committer',
+            args=(backend.path_data, self.queue, self.stats, self.interval,
+                  self.window))
+        self.process.daemon = True
+        self.process.start()
+        if keys is None:
+            self._put(('all',))
+        elif keys:
+            self._put(('keys', keys))
+        self.queue.put(('flush',))
+
+    def _put(self, message):
+        self._update_times()
+        self.times.append(time_.time())
+        self.queue.put(message)
+
+    def _update_times(self):
+        times = self.times
+        nb_committed = int(self.stats[0])
+        while self.nb_committed < nb_committed and times:
+            times.popleft()
+            self.nb_committed += 1
+
+    def check(self):
+        """Restart the committer process if it died.
+        """
+        process = self.process
+        if process is not None and not process.is_alive():
+            log.error(f"The git committer died ({process.exitcode}), restart")
+            self.restarts += 1
+            self.start()
+
+    def put(self, keys):
+        """Send the keys changed by a transaction.
+        """
+        self.check()
+        keys = [x for x in keys if x.endswith('metadata')]
+        if keys:
+            self._put(('keys', keys))
+
+    def commit_all(self):
+        """Commit now every file of the working tree.
+        """
+        self.check()
+        self._put(('all',))
+        self.queue.put(('flush',))
+
+    def get_stats(self):
+        """Return the queue depth (the number of transactions not yet
+        committed), the lag (the age in seconds of the oldest transaction
+        not yet committed), and the time of the last commit.
+        """
+        self._update_times()
+        times = self.times
+        last_commit = self.stats[1]
+        return {
+            'queue_depth': len(times),
+            'lag': time_.time() - times[0] if times else 0,
+            'last_commit': (datetime.fromtimestamp(last_commit)
+                            if last_commit else None),
+            'commits': int(self.stats[2]),
+            'restarts': self.restarts}
+
+    def stop(self, timeout=None):
+        """Commit the keys sent, then stop the committer process.
+        """
+        process = self.process
+        if process is None:
+            return
+        self.process = None
+        if process.is_alive():
+            self.queue.put(None)
+            process.join(timeout)
 
 
 class GitBackend:
 
+    # The schedule of the commits of the big databases (see GitCommitter),
+    # by default at night and at most every two hours
+    git_committer_interval = 7200
+    git_committer_window = (time(21, 0), time(6, 0))
+
+    # Group commit (see GroupCommitter)
+    group_commit = DB_GROUP_COMMIT
+    group_commit_delay = 1.0
+    group_commit_size = 100
+    group_commit_fsync = True
+
     def __init__(self, path, fields, read_only=False):
         self.nb_transactions = 0
         self.last_transaction_dtime = None
@@ -105,7 +464,8 @@ class GitBackend:
         if TEST_DB_DESACTIVATE_GIT is True:
             self.worktree = None
         else:
-            self.worktree = open_worktree(self.path_data)
+            self.worktree = open_worktree(self.path_data,
+                                          read_only=read_only)
         # Initialize the database, but chrooted
         self.fs = lfs.open(self.path_data)
         # Static FS
@@ -116,7 +476,28 @@ class GitBackend:
         # Patchs backend
         self.patchs_backend = PatchsBackend(path, self.fs, read_only)
         # Catalog
+        if not read_only:
+            self.recover_catalog_swap()
         self.catalog = self.get_catalog()
+        # Group commit
+        self.committer = None
+        if (self.group_commit and not read_only and self.worktree
+                and not TEST_DB_WITHOUT_COMMITS):
+            # The keys changed must be known, on restart, before the files
+            # are written
+            self.patchs_backend.synchronous = True
+            self.committer = GroupCommitter(self, self.group_commit_delay,
+                                            self.group_commit_size,
+                                            self.group_commit_fsync)
+        # Committer of the big databases
+        self.git_committer = None
+        if (TEST_DB_WITHOUT_COMMITS and not read_only and self.worktree):
+            # The keys changed must be known, on restart, before the files
+            # are written
+            self.patchs_backend.synchronous = True
+            self.git_committer = GitCommitter(self,
+                                              self.git_committer_interval,
+                                              self.git_committer_window)
 
     @classmethod
     def init_backend(cls, path, fields, init=False, soft=False):
@@ -174,20 +555,34 @@ class GitBackend:
         return fs.get_mtime(key)
 
     def save_handler(self, key, handler):
-        data = handler.to_str()
-        text = isinstance(data, str)
-        # Save the file
         fs = self.get_handler_fs(handler)
-        # Write and truncate (calls to "_save_state" must be done with the
-        # pointer pointing to the beginning)
-        if not fs.exists(key):
-            with fs.make_file(key, text=text) as f:
+        exists = fs.exists(key)
+        own = (key == handler.key)
+        # Append the changes only, if the file is as loaded or saved last
+        data = None
+        if (exists and own and handler.timestamp is not None
+                and fs.get_mtime(key) == handler.timestamp):
+            data = handler.to_str_append()
+        if data is not None:
+            with fs.open(key, text=isinstance(data, str), mode=APPEND) as f:
                 f.write(data)
-                f.truncate(f.tell())
+            handler.set_saved(True)
         else:
-            with fs.open(key, text=text, mode=READ_WRITE) as f:
-                f.write(data)
-                f.truncate(f.tell())
+            data = handler.to_str()
+            text = isinstance(data, str)
+            # Save the file
+            # Write and truncate (calls to "_save_state" must be done with the
+            # pointer pointing to the beginning)
+            if not exists:
+                with fs.make_file(key, text=text) as f:
+                    f.write(data)
+                    f.truncate(f.tell())
+            else:
+                with fs.open(key, text=text, mode=READ_WRITE) as f:
+                    f.write(data)
+                    f.truncate(f.tell())
+            if own:
+                handler.set_saved(False)
         # Set dirty = None
         handler.timestamp = self.get_handler_mtime(key)
         handler.dirty = None
@@ -232,23 +627,32 @@ class GitBackend:
         else:
             # it's a catalog transaction, we have to do nothing
             pass
-        # Added and changed
-        added_and_changed = list(added) + list(changed)
-        for key in added_and_changed:
-            handler = handlers.get(key)
-            parent_path = dirname(key)
-            fs = self.get_handler_fs(handler)
-            if not fs.exists(parent_path):
-                fs.make_folder(parent_path)
-            self.save_handler(key, handler)
-        # Remove files (if not removed via git-rm)
-        for key in removed:
-            if not key.endswith('metadata') or TEST_DB_WITHOUT_COMMITS:
-                fs = self.get_handler_fs_by_key(key)
-                fs.remove(key)
+        # Not while the group committer adds the files
+        committer = self.committer
+        lock = self.worktree.lock if committer else nullcontext()
+        with lock:
+            # Added and changed
+            added_and_changed = list(added) + list(changed)
+            for key in added_and_changed:
+                handler = handlers.get(key)
+                parent_path = dirname(key)
+                fs = self.get_handler_fs(handler)
+                if not fs.exists(parent_path):
+                    fs.make_folder(parent_path)
+                self.save_handler(key, handler)
+            # Remove files (if not removed via git-rm)
+            for key in removed:
+                if (not key.endswith('metadata') or TEST_DB_WITHOUT_COMMITS
+                        or committer):
+                    fs = self.get_handler_fs_by_key(key)
+                    fs.remove(key)
         # Do git transaction for metadata
-        if not TEST_DB_WITHOUT_COMMITS:
+        if committer:
+            committer.put(data, added_and_changed + list(removed))
+        elif not TEST_DB_WITHOUT_COMMITS:
             self.do_git_transaction(commit_message, data, added, changed, removed, handlers)
+        elif self.git_committer:
+            self.git_committer.put(added_and_changed + list(removed))
         else:
             # Commit at start
             if not self.last_transaction_dtime:
@@ -273,13 +677,27 @@ class GitBackend:
         """
         if TEST_DB_DESACTIVATE_GIT is True:
             return
-        p1 = Process(target=self._do_git_big_commit)
+        if self.git_committer:
+            self.git_committer.commit_all()
+            self.last_transaction_dtime = datetime.now()
+            return
+        # With libgit2 a thread is enough, do not fork the server
+        if self.worktree.spawn_git:
+            p1 = Process(target=self._do_git_big_commit)
+        else:
+            p1 = Thread(target=self._do_git_big_commit, daemon=True)
         p1.start()
         self.last_transaction_dtime = datetime.now()
 
     def _do_git_big_commit(self):
-        self.worktree._call(['git', 'add', '-A'])
-        self.worktree._call(['git', 'commit', '-m', 'Autocommit'])
+        worktree = self.worktree
+        if worktree.spawn_git:
+            worktree._call(['git', 'add', '-A'])
+            worktree._call(['git', 'commit', '-m', 'Autocommit'])
+        else:
+            with worktree.lock:
+                worktree.git_add_all()
+                worktree.git_commit('Autocommit')
 
     def do_git_transaction(self, commit_message, data, added, changed, removed, handlers):
         # 3. Git add
@@ -294,65 +712,7 @@ class GitBackend:
         git_author, git_date, git_msg, docs_to_index, docs_to_unindex = data
         git_msg = git_msg or 'no comment'
         # 4. Create the tree
-        repo = self.worktree.repo
-        index = repo.index
-        try:
-            head = repo.revparse_single('HEAD')
-        except KeyError:
-            git_tree = None
-        else:
-            root = head.tree
-            # Initialize the heap
-            heap = Heap()
-            heap[''] = repo.TreeBuilder(root)
-            for key in git_add:
-                entry = index[key]
-                heap[key] = (entry.id, entry.mode)
-            for key in git_rm:
-                heap[key] = None
-
-            while heap:
-                path, value = heap.popitem()
-                # Stop condition
-                if path == '':
-                    git_tree = value.write()
-                    break
-
-                if type(value) is TreeBuilder:
-                    if len(value) == 0:
-                        value = None
-                    else:
-                        oid = value.write()
-                        value = (oid, GIT_FILEMODE_TREE)
-
-                # Split the path
-                if '/' in path:
-                    parent, name = path.rsplit('/', 1)
-                else:
-                    parent = ''
-                    name = path
-
-                # Get the tree builder
-                tb = heap.get(parent)
-                if tb is None:
-                    try:
-                        tentry = root[parent]
-                    except KeyError:
-                        tb = repo.TreeBuilder()
-                    else:
-                        tree = repo[tentry.id]
-                        tb = repo.TreeBuilder(tree)
-                    heap[parent] = tb
-
-                # Modify
-                if value is None:
-                    # Sometimes there are empty folders left in the
-                    # filesystem, but not in the tree, then we get a
-                    # "Failed to remove entry" error.  Be robust.
-                    if tb.get(name) is not None:
-                        tb.remove(name)
-                else:
-                    tb.insert(name, value[0], value[1])
+        git_tree = self.worktree.make_tree(git_add, git_rm)
         # 5. Git commit
         self.worktree.git_commit(git_msg, git_author, git_date, tree=git_tree)
 
@@ -379,14 +739,87 @@ class GitBackend:
             return None
         return Catalog(path, self.fields, read_only=self.read_only)
 
+    def get_catalog_rebuild(self):
+        """Return the catalog being rebuilt beside the current one (see
+        RWDatabase.rebuild_catalog), create it if needed.
+        """
+        path = f'{self.path}/catalog.rebuild'
+        return make_catalog(path, self.fields)
+
+    def swap_catalog_rebuild(self, catalog):
+        """Replace the current catalog by the given rebuilt catalog.
+
+        The current catalog is renamed to 'catalog.old', then the rebuilt
+        catalog to 'catalog'.  If interrupted in between, the swap is
+        completed when the database is opened (see recover_catalog_swap).
+        """
+        path = f'{self.path}/catalog'
+        old_path = f'{self.path}/catalog.old'
+        catalog.close()
+        self.catalog.close()
+        if lfs.exists(old_path):
+            lfs.remove(old_path)
+        os.rename(path, old_path)
+        os.rename(f'{path}.rebuild', path)
+        self.catalog = self.get_catalog()
+        lfs.remove(old_path)
+
+    def recover_catalog_swap(self):
+        """Complete the swap of the catalogs if it was interrupted (see
+        swap_catalog_rebuild).
+        """
+        path = f'{self.path}/catalog'
+        old_path = f'{self.path}/catalog.old'
+        if not lfs.exists(old_path):
+            return
+        if not lfs.exists(path):
+            # The rebuilt catalog is complete, it was being swapped in
+            if lfs.exists(f'{path}.rebuild'):
+                log.warning('[Catalog] Complete the swap of the catalogs')
+                os.rename(f'{path}.rebuild', path)
+            else:
+                log.warning('[Catalog] Restore the old catalog')
+                os.rename(old_path, path)
+                return
+        lfs.remove(old_path)
+
+    def get_blob_ids(self):
+        """Return the git blob ids of the metadata files in the index, or
+        None if not known (see RWDatabase.prune_metadata_cache).
+        """
+        worktree = self.worktree
+        if worktree is None:
+            return None
+        with worktree.lock:
+            return {
+                str(entry.id) for entry in worktree.index
+                if entry.path.endswith('.metadata') }
+
     def search(self, query=None, **kw):
         """Launch a search in the catalog.
         """
         catalog = self.catalog
         xquery = _get_xquery(catalog, query, **kw)
-        return SearchResults(catalog, xquery)
+        key = _get_query_key(query, **kw)
+        return SearchResults(catalog, xquery, key)
+
+    def flush_commits(self):
+        """With group commit, block until the transactions saved have been
+        committed to Git.
+        """
+        if self.committer:
+            self.committer.wait()
 
     def close(self):
+        if self.committer:
+            self.committer.stop()
+            self.committer = None
+        if self.git_committer:
+            self.git_committer.stop()
+            self.git_committer = None
+        if self.worktree:
+            self.worktree.write_index()
+        self.patchs_backend.close()
         self.catalog.close()
 
 
@@ -17,7 +17,7 @@
 from os.path import dirname
 
 # Import from itools
-from itools.fs import lfs, WRITE
+from itools.fs import lfs, APPEND, WRITE
 
 # Import from here
 from .registry import register_backend
@@ -66,17 +66,37 @@ class LFSBackend:
         return self.fs.get_mtime(key)
 
     def save_handler(self, key, handler):
+        # Append the changes only, if the file is as loaded or saved last
+        fs = self.fs
+        exists = fs.exists(key)
+        own = (key == handler.key)
+        data = None
+        if (exists and own and handler.timestamp is not None
+                and fs.get_mtime(key) == handler.timestamp):
+            data = handler.to_str_append()
+        if data is not None:
+            with fs.open(key, APPEND, text=isinstance(data, str)) as f:
+                f.write(data)
+            handler.set_saved(True)
+            return
+
         data = handler.to_str()
         text = isinstance(data, str)
         # Save the file
-        if not self.fs.exists(key):
-            with self.fs.make_file(key, text=text) as f:
+        if not exists:
+            with fs.make_file(key, text=text) as f:
                 f.write(data)
                 f.truncate(f.tell())
         else:
-            with self.fs.open(key, WRITE, text=text) as f:
+            with fs.open(key, WRITE, text=text) as f:
                 f.write(data)
                 f.truncate(f.tell())
+        if own:
+            handler.set_saved(False)
+
+    def get_blob_ids(self):
+        # The files are not versioned
+        return None
 
     def traverse_resources(self):
         raise NotImplementedError
@@ -14,142 +14,422 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime, timedelta
-from glob import glob
-from time import strftime
-from uuid import uuid4
+from logging import getLogger
+from os.path import exists
+from queue import Queue
+from sqlite3 import connect
+from struct import Struct
+from threading import Lock, Thread
+from time import monotonic
 import difflib
+import json
 import os
-import tarfile
+import zlib
 
 # Import from itools
 from itools.fs import lfs
-from itools.loop import cron
 
 
 TEST_DB_WITHOUT_PATCHS = bool(int(os.environ.get('TEST_DB_WITHOUT_PATCHS') or 0))
 
+log = getLogger("itools.database")
+
+# The records of the segments are prefixed by the size of the compressed data
+FRAME = Struct('>I')
+
 
 class PatchsBackend:
+    """Keeps a diff of the metadata changed by every transaction, to help
+    debug, and to recover the changes not yet committed to Git on the big
+    databases (see GitCommitter).
+
+    The diffs are appended, compressed, to a segment file by day in
+    database/.git/patchs/segments/, and indexed by time, author and key
+    in a SQLite database beside.  They are written by a background thread,
+    or by create_patch, synced to disk, if 'synchronous' is True (to
+    recover the changes after a crash).  The segments older than
+    'rotate_interval' are compacted into a segment by month.
+
+    The older versions wrote one file by transaction in
+    database/.git/patchs/YYYYMMDD/, these are still read by
+    get_changed_keys.
+    """
 
     rotate_interval = timedelta(weeks=2)
+    # How often to look for segments to compact
+    compact_interval = timedelta(hours=1)
+    # The zlib compression level of the new records, and of the compacted
+    # segments
+    compress_level = 1
+    compact_level = 9
+    # Write the patches in create_patch, synced to disk
+    synchronous = False
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY,
+            segment TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            time REAL NOT NULL,
+            author TEXT);
+        CREATE INDEX IF NOT EXISTS records_time ON records (time);
+        CREATE INDEX IF NOT EXISTS records_segment ON records (segment);
+        CREATE TABLE IF NOT EXISTS keys (
+            key TEXT NOT NULL,
+            record INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS keys_key ON keys (key, record);
+        """
 
     def __init__(self, db_path, db_fs, read_only):
         self.db_fs = db_fs
         self.db_path = db_path
-        # Init patchs folder
+        self.read_only = read_only
+        # Init patchs folder (not on a read-only database)
         self.patchs_path = f'{db_path}/database/.git/patchs'
-        if not lfs.exists(self.patchs_path):
-            lfs.make_folder(self.patchs_path)
-        self.patchs_fs = lfs.open(self.patchs_path)
-        # Launch rotate on patchs folder (only one time, so only on RW database)
+        self.segments_path = f'{self.patchs_path}/segments'
+        if not read_only:
+            for path in self.patchs_path, self.segments_path:
+                if not lfs.exists(path):
+                    lfs.make_folder(path)
+        self.patchs_fs = None
+        if lfs.exists(self.patchs_path):
+            self.patchs_fs = lfs.open(self.patchs_path)
+        # The index
+        self.lock = Lock()
+        self.connection = None
+        # The writer thread (only on RW database)
+        self.queue = None
+        self.thread = None
         if not read_only:
             self.launch_rotate()
 
 
-    def get_last_rotate_date(self):
-        # Find the more recent date
-        dates = []
-        n2 = '[0-9][0-9]'
-        date_pattern = n2 + n2 + '-' + n2 + '-' + n2 + '_' + n2 + n2
-        for name in glob(self.patchs_path + '/' + date_pattern + '.tgz'):
-            try:
-                date = datetime.strptime(name[-18:-3], '%Y-%m-%d_%H%M')
-            except ValueError:
-                continue
-            dates.append(date)
-        if dates:
-            dates.sort()
-            return dates[-1]
-        return None
+    def _get_connection(self):
+        """Return the connection to the index, or None if the database is
+        read-only and there is no index.
+        """
+        if self.connection is None:
+            path = f'{self.segments_path}/index.sqlite'
+            if self.read_only:
+                if not exists(path):
+                    return None
+                connection = connect(f'file:{path}?mode=ro', uri=True,
+                                     check_same_thread=False)
+            else:
+                connection = connect(path, check_same_thread=False)
+                connection.executescript(self.schema)
+            self.connection = connection
+        return self.connection
 
 
+    #######################################################################
+    # Writer thread
+    #######################################################################
     def launch_rotate(self):
-        # FIXME it's too slow, we need to optimize it
-        return
-        last = self.get_last_rotate_date()
-        # If here, there is no rotated files => so, we create one
-        if not last:
-            last = datetime.now()
-            self.rotate()
-        # Compute the next call
-        next_call = last + self.rotate_interval - datetime.now()
-        if next_call <= timedelta(0):
-            next_call = timedelta(seconds=1)
-        # Call cron
-        cron(self.rotate, next_call)
+        """Start the thread that writes the patches, and compacts the old
+        segments from time to time.
+        """
+        self.queue = Queue()
+        self.thread = Thread(target=self._run, name='itools-patchs',
+                             daemon=True)
+        self.thread.start()
+
+
+    def _run(self):
+        queue = self.queue
+        next_compact = monotonic()
+        while True:
+            record = queue.get()
+            try:
+                if record is None:
+                    return
+                self._write(*record)
+                # Compact
+                if monotonic() >= next_compact:
+                    next_compact = monotonic()
+                    next_compact += self.compact_interval.total_seconds()
+                    self.rotate()
+            except Exception:
+                log.error("Cannot write the patch", exc_info=True)
+            finally:
+                queue.task_done()
+
+
+    def _append(self, segment, data, level, sync=False):
+        path = f'{self.segments_path}/{segment}.log'
+        data = zlib.compress(data, level)
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(FRAME.pack(len(data)))
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        return offset, FRAME.size + len(data)
+
+
+    def _read(self, segment, offset, length):
+        path = f'{self.segments_path}/{segment}.log'
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return zlib.decompress(data[FRAME.size:])
+
+
+    def _write(self, the_time, author, keys, data, sync=False):
+        segment = the_time.strftime('%Y%m%d')
+        with self.lock:
+            offset, length = self._append(segment, data,
+                                          self.compress_level, sync)
+            # Index (the transactions are synced to disk by SQLite)
+            connection = self._get_connection()
+            cursor = connection.execute(
+                'INSERT INTO records (segment, offset, length, time, author)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (segment, offset, length, the_time.timestamp(), author))
+            record = cursor.lastrowid
+            connection.executemany(
+                'INSERT INTO keys (key, record) VALUES (?, ?)',
+                [(x, record) for x in keys])
+            connection.commit()
+
+
+    def flush(self):
+        """Block until the patches created have been written.
+        """
+        if self.queue is not None:
+            self.queue.join()
+
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.queue = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
 
 
     def rotate(self):
-        gzip_folders = []
+        """Compact the segments older than 'rotate_interval' into a segment
+        by month.  The segments are found with the index.
+        """
+        limit = datetime.now() - self.rotate_interval
+        limit = limit.replace(hour=0, minute=0, second=0, microsecond=0)
+        with self.lock:
+            cursor = self._get_connection().execute(
+                'SELECT DISTINCT segment FROM records'
+                ' WHERE length(segment) = 8 AND segment < ?',
+                (limit.strftime('%Y%m%d'),))
+            segments = [x[0] for x in cursor]
+
+        for segment in sorted(segments):
+            log.info(f"[Database] Compact the patchs of {segment}")
+            target = segment[:6]
+            with self.lock:
+                connection = self._get_connection()
+                cursor = connection.execute(
+                    'SELECT id, offset, length FROM records'
+                    ' WHERE segment = ? ORDER BY offset', (segment,))
+                for record, offset, length in cursor.fetchall():
+                    data = self._read(segment, offset, length)
+                    offset, length = self._append(target, data,
+                                                  self.compact_level)
+                    connection.execute(
+                        'UPDATE records SET segment = ?, offset = ?,'
+                        ' length = ? WHERE id = ?',
+                        (target, offset, length, record))
+                connection.commit()
+            os.remove(f'{self.segments_path}/{segment}.log')
+
+        # We return always the interval to be "cron" compliant
+        return self.rotate_interval
+
+
+    #######################################################################
+    # Query
+    #######################################################################
+    def get_patches(self, key=None, since=None, author=None):
+        """Yield the patches, oldest first, as tuples (time, author, keys,
+        changes).  Only those changing the given key, made since the given
+        datetime, or by the given author if given.  See create_patch for
+        the changes.
+        """
+        self.flush()
+
+        where = []
+        args = []
+        if key is not None:
+            where.append('id IN (SELECT record FROM keys WHERE key = ?)')
+            args.append(key)
+        if since is not None:
+            where.append('time >= ?')
+            args.append(since.timestamp())
+        if author is not None:
+            where.append('author = ?')
+            args.append(str(author))
+        query = 'SELECT id, segment, offset, length, time, author FROM records'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY time, id'
+
+        with self.lock:
+            connection = self._get_connection()
+            if connection is None:
+                return
+            records = connection.execute(query, args).fetchall()
+
+        for record, segment, offset, length, the_time, author in records:
+            with self.lock:
+                cursor = self._get_connection().execute(
+                    'SELECT key FROM keys WHERE record = ?', (record,))
+                keys = [x[0] for x in cursor]
+                data = self._read(segment, offset, length)
+            try:
+                changes = json.loads(data)
+            except ValueError:
+                # A text diff
+                changes = [{'diff': data.decode('utf-8')}]
+            yield datetime.fromtimestamp(the_time), author, keys, changes
+
+
+    def replay(self, since, callback):
+        """Call the given callback with the patches made since the given
+        datetime, oldest first (see get_patches).
+        """
+        for patch in self.get_patches(since=since):
+            callback(*patch)
+
+
+    def get_changed_keys(self, since):
+        """Return the keys of the metadata changed by the transactions made
+        since the given datetime, as recorded by the patches.  Return None
+        if the patches are not written.
+        """
+        if TEST_DB_WITHOUT_PATCHS is True:
+            return None
+
+        self.flush()
+        keys = set()
+        with self.lock:
+            connection = self._get_connection()
+            if connection is not None:
+                cursor = connection.execute(
+                    'SELECT DISTINCT key FROM keys WHERE record IN'
+                    ' (SELECT id FROM records WHERE time >= ?)',
+                    (since.timestamp(),))
+                keys.update(x[0] for x in cursor)
+
+        return keys | self._get_legacy_changed_keys(since)
+
+
+    def _get_legacy_changed_keys(self, since):
+        """Same as get_changed_keys, for the patches written by the older
+        versions, one file by transaction.
+        """
+        keys = set()
+        if self.patchs_fs is None:
+            return keys
         for name in self.patchs_fs.get_names():
             try:
-                patchs_date = datetime.strptime(name, '%Y%m%d')
+                day = datetime.strptime(name, '%Y%m%d')
             except ValueError:
                 continue
-            delta = datetime.now() - patchs_date
-            if delta > self.rotate_interval:
-                gzip_folders.append(self.patchs_path + '/' + name)
-        # Check if we have something to gzip ?
-        if not gzip_folders:
-            return self.rotate_interval
-        print('[Database] Launch patchs rotation. May take time')
-        # Create TAR file
-        tar_destination = self.patchs_path + f"/{strftime('%Y-%m-%d_%H%M')}.tgz"
-        with tarfile.open(tar_destination, "w:gz" ) as tar:
-            for gzip_folder in gzip_folders:
-                tar.add(gzip_folder)
-        # Remove old folders
-        for gzip_folder in gzip_folders:
-            self.patchs_fs.remove(gzip_folder)
-        # We return always True to be "cron" compliant
-        return self.rotate_interval
-
+            if day.date() < since.date():
+                continue
+            folder = f'{self.patchs_path}/{name}'
+            for patch_name in os.listdir(folder):
+                # The name starts by the time
+                try:
+                    the_time = datetime.strptime(f'{name} {patch_name[:15]}',
+                                                 '%Y%m%d %Hh%Mm%S.%f')
+                except ValueError:
+                    continue
+                if the_time < since:
+                    continue
+                # The "--- key" and "+++ key" lines
+                with open(f'{folder}/{patch_name}', 'rb') as f:
+                    previous = b''
+                    for line in f:
+                        if line.startswith(b'+++ ') and \
+                           previous.startswith(b'--- '):
+                            keys.add(line[4:].rstrip(b'\n').decode())
+                        previous = line
+        return keys
 
 
+    #######################################################################
+    # Write
+    #######################################################################
     def create_patch(self, added, changed, removed, handlers, git_author):
         """
-        We create a patch into database/.git/patchs at each transaction.
+        We create a patch at each transaction.
         The idea is to commit into GIT each N transactions on big databases to avoid
         performances problems.
         We want to keep a diff on each transaction, to help debug.
+
+        The patch is a list of changes, one by metadata key:
+
+          {'key': key, 'op': 'add', 'new': <text>}
+          {'key': key, 'op': 'change', 'properties': {name: [old, new]}}
+          {'key': key, 'op': 'remove', 'old': <text>}
+
+        Where old and new are the serialized properties (None if missing),
+        as given by Metadata.get_changes, without reading the file again.
+        If the changes are not known (or none are found) the text diff of
+        the file is given instead: {'key': key, 'op': 'change', 'diff':
+        <unified diff>}.  Every key changed is recorded.
+
+        The patch is compressed and written by the writer thread.
         """
         if TEST_DB_WITHOUT_PATCHS is True:
             return
         author_id, author_email = git_author
-        diffs = {}
+        changes = []
         # Added
         for key in added:
             if key.endswith('.metadata'):
-                after = handlers.get(key).to_str().splitlines(True)
-                diff = difflib.unified_diff([], after, fromfile=key, tofile=key)
-                diffs[key] = ''.join(diff)
+                new = handlers.get(key).to_str()
+                changes.append({'key': key, 'op': 'add', 'new': new})
         # Changed
         for key in changed:
             if key.endswith('.metadata'):
+                handler = handlers.get(key)
+                properties = handler.get_changes()
+                if properties:
+                    changes.append({'key': key, 'op': 'change',
+                                    'properties': properties})
+                    continue
+                # The changes are not known (or none found): diff, the key
+                # must be recorded anyway
                 with self.db_fs.open(key) as f:
                     before = f.readlines()
                 before = [x.decode() for x in before]
-                after = handlers.get(key).to_str().splitlines(True)
+                after = handler.to_str().splitlines(True)
                 diff = difflib.unified_diff(before, after, fromfile=key, tofile=key)
-                diffs[key] = ''.join(diff)
+                changes.append({'key': key, 'op': 'change',
+                                'diff': ''.join(diff)})
         # Removed
         for key in removed:
             if key.endswith('.metadata'):
                 with self.db_fs.open(key) as f:
-                    before = f.readlines()
-                before = [x.decode() for x in before]
-                after = ''
-                diff = difflib.unified_diff(before, after, fromfile=key, tofile=key)
-                diffs[key] = ''.join(diff)
+                    old = f.read().decode()
+                changes.append({'key': key, 'op': 'remove', 'old': old})
+        if not changes:
+            return
         # Create patch
-        base_path = datetime.now().strftime('.git/patchs/%Y%m%d/')
-        if not self.db_fs.exists(base_path):
-            self.db_fs.make_folder(base_path)
-        the_time = datetime.now().strftime('%Hh%Mm%S.%f')
-        patch_key = f'{base_path}/{the_time}-user{author_id}-{uuid4()}.patch'
-        data = ''.join(diffs[x] for x in sorted(diffs))
-        data = data.encode()
+        changes.sort(key=lambda x: x['key'])
+        data = json.dumps(changes, ensure_ascii=False).encode()
+        keys = [x['key'] for x in changes]
+        author = None if author_id is None else str(author_id)
+        record = (datetime.now(), author, keys, data)
         # Write
-        with self.db_fs.open(patch_key, 'w') as f:
-            f.write(data)
-            f.truncate(f.tell())
+        if self.synchronous:
+            self._write(*record, sync=True)
+        elif self.queue is not None:
+            self.queue.put(record)
+        else:
+            self._write(*record)
@@ -15,20 +15,29 @@
 
 from calendar import timegm
 from datetime import datetime, timezone
+from heapq import heappush, heappop
+from itertools import islice
+from logging import getLogger
 from os import listdir, makedirs, remove, rmdir, walk
 from os.path import abspath, dirname, exists, getmtime, isabs, isdir, isfile
 from os.path import normpath
 from re import search
 from shutil import copy2, copytree
+from sqlite3 import connect
 from subprocess import Popen, PIPE
+from threading import Lock, RLock, Thread
 import time
 
 # Import from pygit2
-from pygit2 import Repository, Signature, GitError, init_repository
-from pygit2.enums import ObjectType, SortMode
+from pygit2 import Commit, Diff, Repository, Signature, GitError
+from pygit2 import GIT_FILEMODE_TREE, TreeBuilder, init_repository
+from pygit2.enums import DiffStatsFormat, ObjectType, ResetMode, SortMode
 
 # Import from itools
-from itools.core import lazy
+from itools.core import LRUCache, lazy
+
+
+log = getLogger("itools.database")
 
 
 def message_short(commit):
@@ -46,22 +55,328 @@ def message_short(commit):
     return message.rstrip()
 
 
+def match_paths(path, paths):
+    """Return whether the given path is one of the given paths, or within
+    one of them (folders).
+    """
+    for x in paths:
+        x = x.rstrip('/')
+        if path == x or path.startswith(f'{x}/'):
+            return True
+    return False
+
+
 def make_parent_dirs(path):
     folder = dirname(path)
     if not exists(folder):
         makedirs(folder)
 
 
+class Heap:
+    """
+    This object behaves very much like a sorted dict, but for security only a
+    subset of the dict API is exposed:
+
+       >>> len(heap)
+       >>> heap[path] = value
+       >>> value = heap.get(path)
+       >>> path, value = heap.popitem()
+
+    The keys are relative paths as used in Git trees, like 'a/b/c' (and '' for
+    the root).
+
+    The dictionary is sorted so deeper paths are considered smaller, and so
+    returned first by 'popitem'. The order relation between two paths of equal
+    depth is undefined.
+
+    This data structure is used by Worktree.make_tree to build the tree
+    objects before commit.
+    """
+
+    def __init__(self):
+        self._dict = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._dict)
+
+    def get(self, path):
+        return self._dict.get(path)
+
+    def __setitem__(self, path, value):
+        if path not in self._dict:
+            n = -path.count('/') if path else 1
+            heappush(self._heap, (n, path))
+
+        self._dict[path] = value
+
+    def popitem(self):
+        key = heappop(self._heap)
+        path = key[1]
+        return path, self._dict.pop(path)
+
+
+class HistoryIndex:
+    """Index of the commits by the paths they change, used by git_log to
+    get the history of some paths without walking the whole history.
+
+    The index is a SQLite database in the '.git' folder.  The commits not
+    yet indexed (made by git_commit, or by other means like the 'git'
+    command) are added when the index is used, if there are no more than
+    'max_update' of them.  Otherwise, and when the index is built the first
+    time or HEAD is not a descendant of the last commit indexed, it is built
+    by a background thread (see build), or explicitly (see rebuild).  Until
+    then git_log walks the history.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS commits (
+            seq INTEGER PRIMARY KEY,
+            sha TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS paths (
+            path TEXT NOT NULL,
+            seq INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS paths_path ON paths (path, seq);
+        """
+
+    # The number of commits added on use, more are added in the background
+    max_update = 100
+    # The number of commits added by transaction
+    batch_size = 1000
+
+    def __init__(self, worktree):
+        self.worktree = worktree
+        self.path = f'{worktree.path}.git/itools_history.sqlite'
+        self.lock = Lock()
+        self.connection = None
+        self.thread = None
+
+    def _get_connection(self):
+        if self.connection is None:
+            # The index is updated by other threads (the group committer,
+            # the background build), the transactions are explicit
+            connection = connect(self.path, timeout=10,
+                                 check_same_thread=False,
+                                 isolation_level=None)
+            connection.executescript(self.schema)
+            self.connection = connection
+        return self.connection
+
+    def _get_last(self):
+        cursor = self._get_connection().execute(
+            'SELECT sha FROM commits ORDER BY seq DESC LIMIT 1')
+        last = cursor.fetchone()
+        return last[0] if last else None
+
+    def _get_changed_paths(self, commit):
+        """Return the paths of the files changed by the given commit (from
+        its first parent, as git_log).
+        """
+        parents = commit.parents
+        if parents:
+            diff = parents[0].tree.diff_to_tree(commit.tree)
+        else:
+            diff = commit.tree.diff_to_tree()
+        paths = set()
+        for delta in diff.deltas:
+            paths.add(delta.old_file.path)
+            paths.add(delta.new_file.path)
+        return paths
+
+    def _add_commits(self, last, commits):
+        """Add the given commits [(sha, paths), ...] to the index, after the
+        given last commit indexed.  Return False if the index has been
+        changed by someone else meanwhile.
+        """
+        with self.lock:
+            connection = self._get_connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if self._get_last() != last:
+                    return False
+                for sha, paths in commits:
+                    cursor = connection.execute(
+                        'INSERT INTO commits (sha) VALUES (?)', (sha,))
+                    seq = cursor.lastrowid
+                    connection.executemany(
+                        'INSERT INTO paths (path, seq) VALUES (?, ?)',
+                        [(x, seq) for x in paths])
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        return True
+
+    def update(self, max_commits=None):
+        """Add to the index the commits of HEAD not yet indexed.  If there
+        are more than 'max_commits' (or the index is to be built from
+        scratch) do nothing and return False.
+        """
+        worktree = self.worktree
+        head = worktree._resolve_reference('HEAD')
+        if head is None:
+            return True
+
+        head = str(head)
+        repo = worktree.repo
+        with self.lock:
+            last = self._get_last()
+        if last == head:
+            return True
+
+        # The history has been rewritten (git reset): rebuild
+        if last is not None and not repo.descendant_of(head, last):
+            if max_commits is not None:
+                return False
+            log.info("[Git] Rebuild the history index")
+            with self.lock:
+                connection = self._get_connection()
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute('DELETE FROM paths')
+                connection.execute('DELETE FROM commits')
+                connection.execute('COMMIT')
+            last = None
+
+        # Oldest first
+        if max_commits is not None:
+            if last is None:
+                return False
+            walker = repo.walk(head, SortMode.TOPOLOGICAL | SortMode.REVERSE)
+            walker.hide(last)
+            walker = list(islice(walker, max_commits + 1))
+            if len(walker) > max_commits:
+                return False
+        else:
+            walker = repo.walk(head, SortMode.TOPOLOGICAL | SortMode.REVERSE)
+            if last is not None:
+                walker.hide(last)
+
+        # The diffs are made without holding the lock
+        batch = []
+        for commit in walker:
+            batch.append((str(commit.id), self._get_changed_paths(commit)))
+            if len(batch) >= self.batch_size:
+                if not self._add_commits(last, batch):
+                    return False
+                last = batch[-1][0]
+                batch = []
+        if batch and not self._add_commits(last, batch):
+            return False
+        return True
+
+    def build(self):
+        """Start a background thread to update the index, if not running.
+        """
+        with self.lock:
+            thread = self.thread
+            if thread is not None and thread.is_alive():
+                return
+            self.thread = Thread(target=self._build, daemon=True,
+                                 name='itools-git-history')
+            self.thread.start()
+
+    def _build(self):
+        log.info("[Git] Build the history index")
+        try:
+            self.update()
+        except Exception:
+            log.error("[Git] Cannot build the history index", exc_info=True)
+        else:
+            log.info("[Git] History index built")
+
+    def refresh(self):
+        """Add to the index the few commits not yet indexed, or start to
+        build it in the background (see build).  Return whether the index
+        is up to date.
+        """
+        thread = self.thread
+        if thread is not None and thread.is_alive():
+            return False
+        if self.update(self.max_update):
+            return True
+        self.build()
+        return False
+
+    def rebuild(self):
+        """Rebuild the index from scratch, in the current thread.
+        """
+        with self.lock:
+            connection = self._get_connection()
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM paths')
+            connection.execute('DELETE FROM commits')
+            connection.execute('COMMIT')
+        self.update()
+
+    def get_commits(self, paths, reverse=False, n=None):
+        """Return the SHAs of the commits of HEAD that change the given
+        paths (files or folders), the most recent first.  Return None if
+        the index is not up to date (see refresh).
+        """
+        if not self.refresh():
+            return None
+
+        where = []
+        args = []
+        for path in paths:
+            path = path.strip('/')
+            # The file, or the files within the folder
+            where.append('path = ? OR (path > ? AND path < ?)')
+            args.extend([path, f'{path}/', f'{path}0'])
+        where = ' OR '.join(where)
+        order = 'ASC' if reverse else 'DESC'
+        query = (
+            f'SELECT sha FROM commits WHERE seq IN '
+            f'(SELECT seq FROM paths WHERE {where}) ORDER BY seq {order}')
+        if n is not None:
+            query += f' LIMIT {int(n)}'
+
+        with self.lock:
+            cursor = self._get_connection().execute(query, args)
+            return [x[0] for x in cursor]
+
+
 class Worktree:
 
-    def __init__(self, path, repo):
+    # The objects cache (see lookup): the number of commits and trees, and
+    # the size in bytes of the blobs.  The blobs bigger than
+    # 'cache_blob_max_size' are not kept.
+    cache_size = 5000
+    cache_blobs_size = 32 * 1024 * 1024
+    cache_blob_max_size = 1024 * 1024
+
+    # The number of commits made with 'make_tree' before writing the index
+    # file (see git_commit)
+    index_write_interval = 100
+
+    # Call the 'git' command for the operations implemented with libgit2
+    # (diff, stats, reset, etc.), instead of doing them in-process
+    spawn_git = False
+
+    def __init__(self, path, repo, read_only=False):
         self.path = abspath(path) + '/'
         self.repo = repo
-        self.cache = {} # {sha: object}
+        self.read_only = read_only
+        # The worktree may be shared by threads: the objects cache and the
+        # index are guarded by this lock, to be held too by the thread
+        # making commits (see GroupCommitter)
+        self.lock = RLock()
+        # {sha: object}, the trees and commits apart from the blobs, so the
+        # big blobs do not push the trees out
+        self.cache = LRUCache(self.cache_size)
+        self.blobs_cache = LRUCache(self.cache_size, automatic=False)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_bytes = 0
+        # The history index is written in the repository, not if read-only
+        # (then git_log walks the history)
+        self.history = None if read_only else HistoryIndex(self)
         # FIXME These two fields are already available by libgit2. TODO
         # expose them through pygit2 and use them here.
         self.index_path = f'{path}/.git/index'
         self.index_mtime = None
+        # The number of commits since the index file was written
+        self.index_changes = 0
         # Check git commiter
         try:
             _, _ = self.username, self.useremail
@@ -170,13 +485,45 @@ class Worktree:
     def lookup(self, sha):
         """Return the object by the given SHA. We use a cache to warrant that
         two calls with the same SHA will resolve to the same object, so the
-        'is' operator will work.
+        'is' operator will work, as long as the object is kept in the cache
+        (the least recently used objects are removed from the cache).
         """
-        cache = self.cache
-        if sha not in cache:
-            cache[sha] = self.repo[sha]
-
-        return cache[sha]
+        sha = str(sha)
+        with self.lock:
+            for cache in self.cache, self.blobs_cache:
+                obj = cache.get(sha)
+                if obj is not None:
+                    cache.touch(sha)
+                    self.cache_hits += 1
+                    return obj
+
+            # Miss
+            self.cache_misses += 1
+            obj = self.repo[sha]
+            if obj.type != ObjectType.BLOB:
+                self.cache[sha] = obj
+                return obj
+
+            # Blobs, weighted by their size
+            size = obj.size
+            if size > self.cache_blob_max_size:
+                return obj
+            cache = self.blobs_cache
+            cache[sha] = obj
+            self.cache_bytes += size
+            while self.cache_bytes > self.cache_blobs_size:
+                _, blob = cache.popitem()
+                self.cache_bytes -= blob.size
+            return obj
+
+    def get_cache_stats(self):
+        """Return the statistics of the objects cache.
+        """
+        return {
+            'size': len(self.cache) + len(self.blobs_cache),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'bytes': self.cache_bytes}
 
     def lookup_from_commit_by_path(self, commit, path):
         """Return the object (tree or blob) the given path points to from the
@@ -210,19 +557,31 @@ class Worktree:
             raise RuntimeError('expected standard repository, not bare')
 
         path = self.index_path
-        if exists(path):
-            mtime = getmtime(path)
-            if not self.index_mtime or self.index_mtime < mtime:
-                index.read()
-                self.index_mtime = mtime
+        with self.lock:
+            if exists(path):
+                mtime = getmtime(path)
+                if not self.index_mtime or self.index_mtime < mtime:
+                    index.read()
+                    self.index_mtime = mtime
 
         return index
 
+    def write_index(self):
+        """Write the index file to disk, if it has been changed by the
+        commits made since it was last written (see git_commit).
+        """
+        with self.lock:
+            if self.index_changes:
+                self.index.write()
+                self.index_mtime = getmtime(self.index_path)
+                self.index_changes = 0
+
     def update_tree_cache(self):
         """libgit2 is able to read the tree cache, but not to write it.
         To speed up 'git_commit' this method should be called from time to
         time, it updates the tree cache by calling 'git write-tree'.
         """
+        self.write_index()
         command = ['git', 'write-tree']
         self._call(command)
 
@@ -245,6 +604,11 @@ class Worktree:
         n = len(self.path)
         for path in args:
             abspath = self._get_abspath(path)
+            # 0. File already removed from the filesystem
+            if not exists(abspath):
+                if path in index:
+                    index.remove(path)
+                continue
             # 1. File
             if isfile(abspath):
                 index.remove(path)
@@ -283,20 +647,41 @@ class Worktree:
         if add is True:
             self.git_add(target)
 
+    def git_add_all(self):
+        """Equivalent to 'git add -A', updates the index file with all the
+        files of the working tree (new, changed and removed).
+        """
+        if self.spawn_git:
+            self._call(['git', 'add', '-A'])
+            return
+
+        index = self.index
+        removed = [x.path for x in index
+                   if not exists(self._get_abspath(x.path))]
+        for path in removed:
+            index.remove(path)
+        index.add_all()
+
+    def _get_config(self, name):
+        if self.spawn_git:
+            return self._call(['git', 'config', '--get', name]).rstrip()
+        try:
+            return self.repo.config[name]
+        except KeyError:
+            raise OSError(f'{name} is not configured')
+
     @lazy
     def username(self):
-        cmd = ['git', 'config', '--get', 'user.name']
         try:
-            username = self._call(cmd).rstrip()
+            username = self._get_config('user.name')
         except OSError:
             raise ValueError("Please configure 'git config --global user.name'")
         return username
 
     @lazy
     def useremail(self):
-        cmd = ['git', 'config', '--get', 'user.email']
         try:
-            useremail = self._call(cmd).rstrip()
+            useremail = self._get_config('user.email')
         except OSError:
             raise ValueError("Please configure 'git config --global user.email'")
         return useremail
@@ -321,18 +706,97 @@ class Worktree:
         """
         if not reference:
             raise ValueError('excepted reference to reset')
-        cmd = ['git', 'reset', '--hard', '-q', reference]
-        return self._call(cmd)
+        if self.spawn_git:
+            cmd = ['git', 'reset', '--hard', '-q', reference]
+            return self._call(cmd)
+
+        commit = self.repo.revparse_single(reference).peel(Commit)
+        self.repo.reset(commit.id, ResetMode.HARD)
+        # The index file has been rewritten
+        self.index_mtime = None
+        self.index_changes = 0
+
+    def make_tree(self, added, removed):
+        """Build the tree of the next commit from the tree of HEAD, where
+        the given files have been added (from the index) or removed. Only
+        the trees on the path of the changed files are written, whatever
+        the size of the index.
+
+        Return None if there is no HEAD yet.
+        """
+        repo = self.repo
+        index = self.index
+        try:
+            head = repo.revparse_single('HEAD')
+        except KeyError:
+            return None
+
+        root = head.tree
+        # Initialize the heap
+        heap = Heap()
+        heap[''] = repo.TreeBuilder(root)
+        for key in added:
+            entry = index[key]
+            heap[key] = (entry.id, entry.mode)
+        for key in removed:
+            heap[key] = None
+
+        while heap:
+            path, value = heap.popitem()
+            # Stop condition
+            if path == '':
+                return value.write()
+
+            if type(value) is TreeBuilder:
+                if len(value) == 0:
+                    value = None
+                else:
+                    oid = value.write()
+                    value = (oid, GIT_FILEMODE_TREE)
+
+            # Split the path
+            if '/' in path:
+                parent, name = path.rsplit('/', 1)
+            else:
+                parent = ''
+                name = path
+
+            # Get the tree builder
+            tb = heap.get(parent)
+            if tb is None:
+                try:
+                    tentry = root[parent]
+                except KeyError:
+                    tb = repo.TreeBuilder()
+                else:
+                    tree = repo[tentry.id]
+                    tb = repo.TreeBuilder(tree)
+                heap[parent] = tb
+
+            # Modify
+            if value is None:
+                # Sometimes there are empty folders left in the
+                # filesystem, but not in the tree, then we get a
+                # "Failed to remove entry" error.  Be robust.
+                if tb.get(name) is not None:
+                    tb.remove(name)
+            else:
+                tb.insert(name, value[0], value[1])
 
     def git_commit(self, message, author=None, date=None, tree=None):
         """Equivalent to 'git commit', we must give the message and we can
         also give the author and date.
+
+        If the tree is given (see make_tree) the index file is only written
+        every 'index_write_interval' commits (and by 'write_index'), the
+        commits do not depend on it.
         """
         # TODO Check the 'nothing to commit' case
 
         # Write index
-        self.index.write()
-        self.index_mtime = getmtime(self.index_path)
+        self.index_changes += 1
+        if tree is None or self.index_changes >= self.index_write_interval:
+            self.write_index()
 
         # Tree
         if tree is None:
@@ -373,8 +837,19 @@ class Worktree:
         author = Signature(author[0], author[1], int(when_time), int(when_offset))
 
         # Create the commit
-        return self.repo.create_commit('HEAD', author, committer, message,
-                                       tree, parents)
+        commit = self.repo.create_commit('HEAD', author, committer, message,
+                                         tree, parents)
+
+        # Update the history index (not critical, it can be rebuilt), the
+        # commit is done
+        if self.history is not None:
+            try:
+                self.history.refresh()
+            except Exception:
+                log.warning("[Git] Cannot update the history index",
+                            exc_info=True)
+
+        return commit
 
     def git_log(self, paths=None, n=None, author=None, grep=None,
                 reverse=False, reference='HEAD'):
@@ -388,6 +863,9 @@ class Worktree:
           grep    -- filter out commits whose message does not match the
                      given pattern
           reverse -- return results in reverse order
+
+        The commits that change the paths are found with the history index
+        (see HistoryIndex), if the worktree is not read-only.
         """
         # Get the sha
         sha = self._resolve_reference(reference)
@@ -397,9 +875,26 @@ class Worktree:
         if reverse is True:
             sortmode |= SortMode.REVERSE
 
+        # Walk the history, or get the commits that change the paths from
+        # the history index
+        walk = None
+        if paths and reference == 'HEAD' and self.history is not None:
+            limit = n if not (author or grep) else None
+            try:
+                walk = self.history.get_commits(paths, reverse, limit)
+            except Exception:
+                log.warning("[Git] Cannot use the history index",
+                            exc_info=True)
+                walk = None
+            if walk is not None:
+                walk = (self.repo[x] for x in walk)
+                paths = None
+        if walk is None:
+            walk = self.repo.walk(sha, sortmode)
+
         # Go
         commits = []
-        for commit in self.repo.walk(sha, sortmode):
+        for commit in walk:
             # --author=<pattern>
             if author:
                 commit_author = commit.author
@@ -423,7 +918,9 @@ class Worktree:
                             break
                     else:
                         b = self.lookup_from_commit_by_path(parent, path)
-                        if a is not b:
+                        # Compare the ids, the objects may have been
+                        # removed from the cache in between
+                        if getattr(a, 'id', None) != getattr(b, 'id', None):
                             break
                 else:
                     continue
@@ -443,16 +940,44 @@ class Worktree:
         # Ok
         return commits
 
+    def _get_diff(self, since, until=None):
+        """Return the diff (pygit2) between two commits, or between the
+        given commit and its parent if 'until' is None.
+        """
+        repo = self.repo
+        since = repo.revparse_single(since).peel(Commit)
+        if until is not None:
+            until = repo.revparse_single(until).peel(Commit)
+            return repo.diff(since.tree, until.tree)
+
+        parents = since.parents
+        if parents:
+            return repo.diff(parents[0].tree, since.tree)
+        return since.tree.diff_to_tree(swap=True)
+
+    def iter_diff(self, since, until=None, paths=None):
+        """Same as 'git_diff', but yields the diff file by file, to not
+        keep the whole diff in memory.
+        """
+        if self.spawn_git:
+            yield self.git_diff(since, until, paths)
+            return
+
+        for patch in self._get_diff(since, until):
+            if paths and not match_paths(patch.delta.new_file.path, paths):
+                continue
+            yield patch.data
+
     def git_diff(self, since, until=None, paths=None):
         """Return the diff between two commits, eventually reduced to the
         given paths.
-
-        TODO Implement using Python's difflib standard library, to avoid
-        calling Git.
         """
+        if not self.spawn_git:
+            return b''.join(self.iter_diff(since, until, paths))
+
         if until is None:
             data = self._call(['git', 'show', since, '--pretty=format:'])
-            return data[1:]
+            return data.lstrip(b'\n')
 
         cmd = ['git', 'diff', f'{since}..{until}']
         if paths:
@@ -463,13 +988,21 @@ class Worktree:
     def git_stats(self, since, until=None, paths=None):
         """Return statistics of the changes done between two commits,
         eventually reduced to the given paths.
-
-        TODO Implement using libgit2
         """
+        if not self.spawn_git:
+            if paths:
+                diff = Diff.parse_diff(self.git_diff(since, until, paths))
+            else:
+                diff = self._get_diff(since, until)
+            if not diff.stats.files_changed:
+                return b''
+            stats = diff.stats.format(DiffStatsFormat.FULL, 80)
+            return stats.encode('utf-8')
+
         if until is None:
             cmd = ['git', 'show', '--pretty=format:', '--stat', since]
             data = self._call(cmd)
-            return data[1:]
+            return data.lstrip(b'\n')
 
         cmd = ['git', 'diff', '--stat', f'{since}..{until}']
         if paths:
@@ -479,14 +1012,26 @@ class Worktree:
 
     def get_files_changed(self, since, until):
         """Return the files that have been changed between two commits.
-
-        TODO Implement with libgit2
         """
+        if not self.spawn_git:
+            repo = self.repo
+            walker = repo.walk(repo.revparse_single(until).peel(Commit).id)
+            walker.hide(repo.revparse_single(since).peel(Commit).id)
+            paths = set()
+            for commit in walker:
+                parents = commit.parents
+                if parents:
+                    diff = repo.diff(parents[0].tree, commit.tree)
+                else:
+                    diff = commit.tree.diff_to_tree(swap=True)
+                paths.update(x.new_file.path for x in diff.deltas)
+            return frozenset(paths)
+
         expr = f'{since}..{until}'
         cmd = ['git', 'show', '--numstat', '--pretty=format:', expr]
         data = self._call(cmd)
         lines = data.splitlines()
-        return frozenset([line.split('\t')[-1] for line in lines if line])
+        return frozenset([line.split(b'\t')[-1].decode() for line in lines if line])
 
     def get_metadata(self, reference='HEAD'):
         """Resolves the given reference and returns metadata information
@@ -513,7 +1058,7 @@ class Worktree:
         }
 
 
-def open_worktree(path, init=False, soft=False):
+def open_worktree(path, init=False, soft=False, read_only=False):
     try:
         if init:
             repo = init_repository(path, False)
@@ -524,4 +1069,4 @@ def open_worktree(path, init=False, soft=False):
             return None
         raise
 
-    return Worktree(path, repo)
+    return Worktree(path, repo, read_only)
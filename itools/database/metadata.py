@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from copy import copy, deepcopy
 from logging import getLogger
+import marshal
 
 # Import from itools
 from itools.core import add_type, freeze
@@ -44,13 +46,42 @@ class Metadata(File):
 
     class_mimetypes = ['text/x-metadata']
     class_extension = 'metadata'
+    footprint_ratio = 8
+    shareable = True
 
     cls = None
+    # The state as loaded, kept when the handler is changed (see get_changes)
+    _snapshot = None
+    clone_exclude = File.clone_exclude | {'_snapshot'}
+    # Decode the properties when first used, not when loaded
+    lazy_decoding = True
+    # The version of the binary state (see dump_state)
+    binary_version = 1
 
     def reset(self):
         self.format = None
         self.version = None
-        self.properties = {}
+        self._properties = {}
+        # The properties not yet decoded {name: [(value, parameters), ...]}
+        self._raw = {}
+        # The text of the properties not changed since loaded {name: text}
+        self._raw_lines = {}
+
+    @property
+    def properties(self):
+        """The properties, all decoded.  They may be changed by the caller,
+        so the text loaded is not used any more (see to_str).
+        """
+        for name in list(self._raw):
+            self._decode_property(name)
+        self._raw_lines.clear()
+        return self._properties
+
+    @properties.setter
+    def properties(self, properties):
+        self._properties = properties
+        self._raw = {}
+        self._raw_lines = {}
 
     def __init__(self, key=None, string=None, database=None, cls=None, **kw):
         self.cls = cls
@@ -75,12 +106,11 @@ class Metadata(File):
         self.get_resource_class(new_class_id)
 
     def _load_state_from_file(self, file):
-        properties = self.properties
         data = file.read()
-        parser = parse_table(data)
+        parser = parse_table(data, raw=True)
 
         # Read the format & version
-        name, value, parameters = next(parser)
+        name, value, parameters, text = next(parser)
         if name != 'format':
             raise ValueError(f'unexpected "{name}" property')
         if 'version' in parameters:
@@ -94,25 +124,98 @@ class Metadata(File):
         # Get the schema
         resource_class = self.get_resource_class(self.format)
 
-        # Parse
-        for name, value, parameters in parser:
+        # Parse, the properties are decoded later (see _decode_property)
+        raw = self._raw
+        raw_lines = self._raw_lines
+        for name, value, parameters, text in parser:
             if name == 'format':
                 raise ValueError('unexpected "format" property')
 
-            # 1. Get the field
-            field = resource_class.get_field(name)
-            if field is None:
-                msg = 'unexpected field "{0}" in resource {1}, cls {2}'
-                msg = msg.format(name, self.key, resource_class)
-                if resource_class.fields_soft:
-                    log.warning(msg)
-                    field = DefaultField
-                else:
-                    raise ValueError(msg)
-
-            # 2. Deserialize the parameters
-            params_schema = field.parameters_schema
-            params_default = field.parameters_schema_default
+            self._check_field(resource_class, name)
+            if name in raw:
+                raw[name].append((value, parameters))
+                raw_lines[name] += text
+            else:
+                raw[name] = [(value, parameters)]
+                raw_lines[name] = text
+
+        if not self.lazy_decoding:
+            for name in list(raw):
+                self._decode_property(name)
+
+    def _check_field(self, resource_class, name):
+        field = resource_class.get_field(name)
+        if field is None:
+            msg = 'unexpected field "{0}" in resource {1}, cls {2}'
+            msg = msg.format(name, self.key, resource_class)
+            if resource_class.fields_soft:
+                log.warning(msg)
+                field = DefaultField
+            else:
+                raise ValueError(msg)
+        if field.multiple and field.multilingual:
+            error = 'property "%s" is both multilingual and multiple'
+            raise ValueError(error % name)
+
+    def dump_state(self):
+        """Return the state as loaded, in a compact binary form, to be loaded
+        faster than the text (see load_state_from_binary).  Return None if
+        some properties are decoded already.
+        """
+        if self._properties or self.dirty is not None:
+            return None
+        raw_lines = self._raw_lines
+        properties = [
+            (name, values, raw_lines[name])
+            for name, values in self._raw.items() ]
+        state = (self.binary_version, self.format, self.version, properties)
+        return marshal.dumps(state)
+
+    def load_state_from_binary(self, data):
+        """Load the state from the binary form given by dump_state.  The
+        fields are checked against the schema, as when loading the text.
+        """
+        self.reset()
+        try:
+            binary_version, format, version, properties = marshal.loads(data)
+            if binary_version != self.binary_version:
+                raise ValueError(f'unexpected version {binary_version}')
+            self.format = format
+            self.version = version
+            resource_class = self.get_resource_class(format)
+            for name, values, text in properties:
+                self._check_field(resource_class, name)
+                self._raw[name] = values
+                self._raw_lines[name] = text
+        except Exception:
+            self._clean_state()
+            raise
+        self.loaded = True
+
+    def _decode_property(self, name):
+        """Build the property of the given name from the values loaded.
+        """
+        resource_class = self.get_resource_class(self.format)
+        property = self._build_property(resource_class, name, self._raw[name])
+        if property is not None:
+            self._properties[name] = property
+        del self._raw[name]
+        if self.dirty is not None:
+            self._raw_lines.pop(name, None)
+
+    def _build_property(self, resource_class, name, values):
+        """Return the property of the given name (or the dict or list of
+        properties) from the given values [(value, parameters), ...].
+        """
+        field = resource_class.get_field(name) or DefaultField
+        params_schema = field.parameters_schema
+        params_default = field.parameters_schema_default
+        datatype = field.datatype
+        datatype.encrypted = field.encrypted
+        properties = {}
+        for value, parameters in values:
+            # 1. Deserialize the parameters
+            parameters = dict(parameters)
             try:
                 deserialize_parameters(parameters, params_schema,
                                        params_default)
@@ -120,14 +223,7 @@ class Metadata(File):
                 msg = 'in class "{0}", resource {1} property "{2}": {3}'
                 raise ValueError(msg.format(resource_class, self.key, name, e))
 
-            # 3. Get the datatype properties
-            if field.multiple and field.multilingual:
-                error = 'property "%s" is both multilingual and multiple'
-                raise ValueError(error % name)
-
-            # 4. Build the property
-            datatype = field.datatype
-            datatype.encrypted = field.encrypted
+            # 2. Build the property
             if datatype.encrypted:
                 value = datatype.decrypt(value)
             property = MetadataProperty(value, datatype, **parameters)
@@ -146,6 +242,47 @@ class Metadata(File):
             # Case 3: simple
             else:
                 properties[name] = property
+        return properties.get(name)
+
+    def _get_property(self, name):
+        """Return the property of the given name (decoded), or None.
+        """
+        if name in self._raw:
+            self._decode_property(name)
+        return self._properties.get(name)
+
+    def _get_property_lines(self, resource_class, format, name, property):
+        """Return the serialized lines of the given property.
+        """
+        # Get the field
+        field = resource_class.get_field(name)
+        if field is None:
+            msg = 'unexpected field "{0}" in resource "{1}" (format "{2}")'
+            msg = msg.format(name, self.key, format)
+            if resource_class.fields_soft:
+                log.warning(msg)
+                return []
+            raise ValueError(msg)
+        datatype = field.datatype
+        datatype.encrypted = field.encrypted
+        params_schema = field.parameters_schema
+        is_empty = datatype.is_empty
+        p_type = type(property)
+        if p_type is dict:
+            languages = list(property.keys())
+            languages = sorted(languages)
+            return [
+                property_to_str(name, property[x], datatype, params_schema)
+                for x in languages if not is_empty(property[x].value) ]
+        elif p_type is list:
+            return [
+                property_to_str(name, x, datatype, params_schema)
+                for x in property if not is_empty(x.value) ]
+        elif property.value is None:
+            return []
+        elif not is_empty(property.value):
+            return [property_to_str(name, property, datatype, params_schema)]
+        return []
 
     def to_str(self):
         resource_class = self.get_resource_class(self.format)
@@ -155,45 +292,90 @@ class Metadata(File):
         else:
             lines = [f'format;version={self.version}:{self.format}\n']
         # Properties are to be sorted by alphabetical order
-        properties = self.properties
-        names = sorted(list(properties.keys()))
+        raw_lines = self._raw_lines
+        names = sorted(set(self._properties) | set(self._raw))
 
-        # Properties
+        # Properties, those not changed as loaded
         for name in names:
-            property = properties[name]
-
-            # Get the field
-            field = resource_class.get_field(name)
-            if field is None:
-                msg = 'unexpected field "{0}" in resource "{1}" (format "{2}")'
-                msg = msg.format(name, self.key, self.format)
-                if resource_class.fields_soft:
-                    log.warning(msg)
-                    continue
-                raise ValueError(msg)
-            datatype = field.datatype
-            datatype.encrypted = field.encrypted
-            params_schema = field.parameters_schema
-            is_empty = datatype.is_empty
-            p_type = type(property)
-            if p_type is dict:
-                languages = list(property.keys())
-                languages = sorted(languages)
-                lines += [
-                    property_to_str(name, property[x], datatype, params_schema)
-                    for x in languages if not is_empty(property[x].value) ]
-            elif p_type is list:
-                lines += [
-                    property_to_str(name, x, datatype, params_schema)
-                    for x in property if not is_empty(x.value) ]
-            elif property.value is None:
-                pass
-            elif not is_empty(property.value):
-                lines.append(
-                    property_to_str(name, property, datatype, params_schema))
+            text = raw_lines.get(name)
+            if text is not None and resource_class.get_field(name):
+                lines.append(text)
+            else:
+                property = self._get_property(name)
+                lines += self._get_property_lines(resource_class, self.format,
+                                                  name, property)
 
         return ''.join(lines)
 
+    def set_changed(self):
+        # Keep the state as loaded, to build the patch without reading the
+        # file again (see get_changes).  The properties are copied, they
+        # may be changed in place.
+        if self.dirty is None and self.timestamp is not None:
+            properties = {
+                name: _copy_property(value)
+                for name, value in self._properties.items() }
+            self._snapshot = (self.format, self.version, properties,
+                              dict(self._raw), dict(self._raw_lines))
+        # The properties decoded may be changed in place from now on, their
+        # text as loaded is not to be used any more (see to_str)
+        raw_lines = self._raw_lines
+        for name in self._properties:
+            raw_lines.pop(name, None)
+        super().set_changed()
+
+    def get_changes(self):
+        """Return the changes made since the handler was loaded (or saved)
+        as a dict {name: (old, new)} of the serialized properties changed,
+        with None for a missing property.  The change of format is given
+        by the 'format' name.
+
+        The properties are compared by their values: both are serialized
+        the same way, so a property loaded from a text written otherwise
+        (parameters order, escaping, folding) is not reported if not
+        changed.
+
+        Return None if the state as loaded is not known.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or self.dirty is None:
+            return None
+
+        changes = {}
+        old_format, old_version, old_properties, old_raw, old_lines = snapshot
+        if (old_format, old_version) != (self.format, self.version):
+            changes['format'] = (
+                _format_to_str(old_format, old_version),
+                _format_to_str(self.format, self.version))
+        old_class = self.get_resource_class(old_format)
+        new_class = self.get_resource_class(self.format)
+
+        # The properties not decoded are not changed
+        properties = self._properties
+        names = set(old_properties) | set(old_raw) | set(properties)
+        for name in sorted(names - set(self._raw)):
+            # The property as loaded (decoded now if not before)
+            old = old_properties.get(name)
+            old_text = None
+            if name in old_raw:
+                try:
+                    old = self._build_property(old_class, name, old_raw[name])
+                except ValueError:
+                    # Cannot be decoded, the text as loaded
+                    old_text = old_lines.get(name)
+            if old is not None:
+                old_text = self._get_property_lines(old_class, old_format,
+                                                    name, old)
+                old_text = ''.join(old_text) or None
+            new = properties.get(name)
+            if new is not None:
+                new = self._get_property_lines(new_class, self.format, name,
+                                               new)
+                new = ''.join(new) or None
+            if old_text != new:
+                changes[name] = (old_text, new)
+        return changes
+
     ########################################################################
     # API
     ########################################################################
@@ -207,7 +389,7 @@ class Metadata(File):
         If it is a multiple property, return the list of properties.
         """
         # Return 'None' if the property is missing
-        property = self.properties.get(name)
+        property = self._get_property(name)
         if not property:
             return None
 
@@ -238,16 +420,19 @@ class Metadata(File):
         return property[language]
 
     def has_property(self, name, language=None):
-        if name not in self.properties:
+        if name not in self._properties and name not in self._raw:
             return False
 
         if language is not None:
-            return language in self.properties[name]
+            return language in self._get_property(name)
 
         return True
 
     def _set_property(self, name, value):
-        properties = self.properties
+        # Decode first (multilingual and multiple properties are updated)
+        self._get_property(name)
+        self._raw_lines.pop(name, None)
+        properties = self._properties
 
         # Case 1: Remove property
         if value is None:
@@ -289,9 +474,34 @@ class Metadata(File):
         self._set_property(name, value)
 
     def del_property(self, name):
-        if name in self.properties:
+        if self.has_property(name):
             self.set_changed()
-            del self.properties[name]
+            self._raw.pop(name, None)
+            self._raw_lines.pop(name, None)
+            self._properties.pop(name, None)
+
+
+def _format_to_str(format, version):
+    if version is None:
+        return f'format:{format}\n'
+    return f'format;version={version}:{format}\n'
+
+
+def _copy_property(property):
+    """Copy the given property (or the dict or list of properties), with
+    its value and parameters.
+    """
+    p_type = type(property)
+    if p_type is dict:
+        return {k: _copy_property(v) for k, v in property.items()}
+    if p_type is list:
+        return [_copy_property(x) for x in property]
+
+    property = copy(property)
+    property.parameters = deepcopy(property.parameters)
+    if 'value' in property.__dict__:
+        property.value = deepcopy(property.value)
+    return property
 
 
 ###########################################################################
@@ -70,24 +70,30 @@ def escape_data(data, escape_table=escape_table):
     return data
 
 
-def unfold_lines(data):
-    """Unfold the folded lines.
+def unfold_lines(data, raw=False):
+    """Unfold the folded lines.  If 'raw' is true yield the unfolded line
+    with the text of the lines it comes from.
     """
-    i = 0
     lines = data.splitlines()
-    lines = decode_lines(lines)
+    if type(data) is bytes:
+        # Most often all the lines are utf-8
+        try:
+            lines = [x.decode('utf-8') for x in lines]
+        except UnicodeDecodeError:
+            lines = decode_lines(lines)
     line = ''
-    while i < len(lines):
-        next = lines[i]
+    folded = []
+    for next in lines:
         if next and (next[0] == ' ' or next[0] == '\t'):
             line += next[1:]
+            folded.append(next)
         else:
             if line:
-                yield line
+                yield (line, '\n'.join(folded) + '\n') if raw else line
             line = next
-        i += 1
+            folded = [next]
     if line:
-        yield line
+        yield (line, '\n'.join(folded) + '\n') if raw else line
 
 
 def fold_line(data):
@@ -267,7 +273,52 @@ def get_tokens(property):
     return value, parameters
 
 
-def parse_table(data):
+# The characters allowed in names, besides the alphanumeric ones
+name_strip = str.maketrans('', '', ''.join(allowed))
+param_name_strip = str.maketrans('', '', '-_')
+
+def split_line(line):
+    """Fast path for the common lines, without quoted parameter values:
+
+        name[;param-name=param-value[,param-value]...]:value
+
+    Returns the name, value and parameters as read_name and get_tokens do,
+    or None if the line is not such a line (then the full parser must be
+    used).
+    """
+    idx = line.find(':')
+    if idx <= 0:
+        return None
+    head = line[:idx]
+    if '"' in head:
+        return None
+
+    # Name
+    name, *params = head.split(';')
+    if not name[:1].isalnum():
+        return None
+    if not name.isalnum() and not name.translate(name_strip).isalnum():
+        return None
+
+    # Parameters
+    parameters = {}
+    for param in params:
+        param_name, sep, param_value = param.partition('=')
+        if not sep or not param_name[:1].isalnum():
+            return None
+        if (not param_name.isalnum() and
+                not param_name.translate(param_name_strip).isalnum()):
+            return None
+        parameters[param_name] = param_value.split(',')
+
+    # Value
+    value = line[idx+1:]
+    if '\\' in value:
+        value = unescape_data(value)
+    return name, value, parameters
+
+
+def parse_table(data, raw=False):
     """This is the public interface of the module "itools.ical.parser", a
     low-level parser of iCalendar files.
 
@@ -278,12 +329,20 @@ def parse_table(data):
 
     Where all the elements ('name', 'value', 'param_name' and 'param_value')
     are byte strings.
+
+    If 'raw' is true the tuples have a fourth element, the text of the
+    lines parsed.
     """
-    for line in unfold_lines(data):
-        name, line = read_name(line)
-        # Read the parameters and the property value
-        value, parameters = get_tokens(line)
-        yield name, value, parameters
+    for line in unfold_lines(data, raw):
+        if raw:
+            line, text = line
+        tokens = split_line(line)
+        if tokens is None:
+            name, line = read_name(line)
+            # Read the parameters and the property value
+            value, parameters = get_tokens(line)
+            tokens = name, value, parameters
+        yield (*tokens, text) if raw else tokens
 
 
 ###########################################################################
@@ -30,7 +30,7 @@ def register_field(name, field_cls):
     if old is new:
         return
 
-    keys = ['default', 'indexed', 'stored', 'multiple',
+    keys = ['default', 'indexed', 'stored', 'sortable', 'multiple',
             'decode', 'encode', 'is_empty']
     for key in keys:
         old_value = getattr(old, key, None)
@@ -18,12 +18,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+from os import environ
 from os.path import splitext
 from sys import getrefcount
 from fnmatch import fnmatch
 
 # Import from itools
-from itools.core import LRUCache
+from itools.core import TwoQueueCache
 from itools.handlers import File, Folder, get_handler_class_by_mimetype
 from itools.uri import Path
 
@@ -32,6 +33,12 @@ from .backends import backends_registry
 from .exceptions import ReadonlyError
 from .metadata import Metadata
 from .registry import get_register_fields
+from .sharedcache import MetadataCache, SharedCache
+from .sharedcache import get_blob_id, get_shared_cache_path
+
+
+DB_SHARED_CACHE = bool(int(environ.get('DB_SHARED_CACHE') or 0))
+DB_METADATA_CACHE = bool(int(environ.get('DB_METADATA_CACHE') or 0))
 
 
 class SearchResults:
@@ -47,11 +54,17 @@ class SearchResults:
         results = self.results.search(query, **kw)
         return SearchResults(self.database, results)
 
-    def get_documents(self, sort_by=None, reverse=False, start=0, size=0):
-        return self.results.get_documents(sort_by, reverse, start, size)
+    def get_facets(self, names, limit=None):
+        return self.results.get_facets(names, limit)
+
+    def get_documents(self, sort_by=None, reverse=False, start=0, size=0,
+                      fields=None):
+        return self.results.get_documents(sort_by, reverse, start, size,
+                                          fields)
 
-    def get_resources(self, sort_by=None, reverse=False, start=0, size=0):
-        brains = list(self.get_documents(sort_by, reverse, start, size))
+    def get_resources(self, sort_by=None, reverse=False, start=0, size=0,
+                      fields=None):
+        brains = self.get_documents(sort_by, reverse, start, size, fields)
         for brain in brains:
             yield self.database.get_resource_from_brain(brain)
 
@@ -60,6 +73,15 @@ class RODatabase:
 
     read_only = True
     backend_cls = None
+    # The weight of the handlers in cache (their approximate memory used, in
+    # bytes), beyond the number of handlers given by size_min/size_max
+    cache_weight_min = 192 * 2**20
+    cache_weight_max = 256 * 2**20
+    # Share the handlers loaded with the other processes (see SharedCache)
+    shared_cache = DB_SHARED_CACHE
+    # Keep the metadata parsed in the 'metadata_cache' folder of the
+    # database (see MetadataCache)
+    metadata_cache = DB_METADATA_CACHE
 
     def __init__(self, path=None, size_min=4800, size_max=5200, backend='lfs'):
         # Init path
@@ -76,7 +98,17 @@ class RODatabase:
         # init backend
         self.init_backend()
         # A mapping from key to handler
-        self.cache = LRUCache(size_min, size_max, automatic=False)
+        self.cache = TwoQueueCache(size_min, size_max, self.cache_weight_min,
+                                   self.cache_weight_max)
+        # The second level cache, shared with the other processes
+        if self.shared_cache and path is not None:
+            self.shared_cache = SharedCache(get_shared_cache_path(path))
+        else:
+            self.shared_cache = None
+        if self.metadata_cache and path is not None:
+            self.metadata_cache = MetadataCache(f'{path}/metadata_cache')
+        else:
+            self.metadata_cache = None
 
     def init_backend(self):
         self.backend = self.backend_cls(self.path, self.fields, self.read_only)
@@ -88,6 +120,8 @@ class RODatabase:
 
     def close(self):
         self.backend.close()
+        if self.shared_cache is not None:
+            self.shared_cache.close()
 
     def check_database(self):
         """This function checks whether the database is in a consisitent state,
@@ -163,30 +197,34 @@ class RODatabase:
     def normalize_key(self, path):
         return self.backend.normalize_key(path)
 
-    def push_handler(self, key, handler):
-        """Adds the given resource to the cache.
+    def push_handler(self, key, handler, size=0):
+        """Adds the given resource to the cache, the size of its file (if
+        known) gives its weight.
         """
         handler.database = self
         handler.key = key
         # Folders are not stored in the cache
-        if type(handler) is Folder:
+        handler_class = type(handler)
+        if handler_class is Folder:
             return
         # Store in the cache
-        self.cache[key] = handler
+        weight = handler_class.get_footprint(size)
+        self.cache.set(key, handler, weight, handler_class.__name__)
 
     def make_room(self):
-        """Remove handlers from the cache until it fits the defined size.
+        """Remove handlers from the cache, once full, until it fits the
+        defined size.
 
         Use with caution. If the handlers we are about to discard are still
         used outside the database, and one of them (or more) are modified, then
         there will be an error.
         """
-        n = len(self.cache) - self.cache.size_min
-        for key, handler in self.cache.items():
-            # Stop condition
-            if n <= 0:
-                break
+        cache = self.cache
+        if not cache.is_full():
+            return
 
+        for key in cache.victims():
+            handler = cache[key]
             # Skip modified (not new) handlers
             if handler.dirty is not None:
                 continue
@@ -202,12 +240,18 @@ class RODatabase:
             # resource is in cache (else we cannot move resource)
             if not key.endswith('.metadata'):
                 metadata_key = splitext(key)[0] + '.metadata'
-                if metadata_key in self.cache:
+                if metadata_key in cache:
                     continue
 
             # Discard this handler
-            n -= 1
-            self._discard_handler(key)
+            cache.evict(key)
+            handler.__dict__.clear()
+
+    def get_cache_stats(self):
+        """Returns the statistics of the cache of handlers, by handler class:
+        {class_name: {'count', 'weight', 'hits', 'misses', 'evictions'}}
+        """
+        return self.cache.get_stats()
 
     def has_handler(self, key):
         key = self.normalize_key(key)
@@ -255,6 +299,7 @@ class RODatabase:
             if cls is not None and not isinstance(handler, cls):
                 raise LookupError(f"expected '{cls}' class, '{handler.__class__}' found")
             # Cache hit
+            self.cache.touch(key)
             return handler
 
         # Check the resource exists
@@ -272,12 +317,12 @@ class RODatabase:
         # Build the handler and update the cache
         handler = object.__new__(cls)
         # Put handler in cache
-        self.push_handler(key, handler)
+        self.push_handler(key, handler, len(data))
         self.make_room()
         # Load handler data
         # FIXME We should reset handler state on errors
         try:
-            handler.load_state_from_string(data)
+            self._load_handler(handler, key, data)
             handler.timestamp = self.backend.get_handler_mtime(key)
         except Exception:
             # Remove handler from cache if cannot load it
@@ -287,6 +332,37 @@ class RODatabase:
         # Ok
         return handler
 
+    def _load_handler(self, handler, key, data):
+        """Load the state of the given handler from the given data, or from
+        the caches of the handlers parsed before, if any.
+        """
+        cls = type(handler)
+        shared_cache = self.shared_cache if cls.shareable else None
+        metadata_cache = self.metadata_cache
+        if metadata_cache is not None and not issubclass(cls, Metadata):
+            metadata_cache = None
+        if shared_cache is None and metadata_cache is None:
+            handler.load_state_from_string(data)
+            return
+
+        # Ask the other processes first
+        sha = get_blob_id(data)
+        if shared_cache is not None:
+            state = shared_cache.get(key, sha, cls)
+            if state is not None:
+                handler.__dict__.update(state)
+                return
+
+        # Then the metadata cache, or parse
+        if metadata_cache is None:
+            handler.load_state_from_string(data)
+        elif not metadata_cache.load(handler, sha):
+            handler.load_state_from_string(data)
+            metadata_cache.save(handler, sha)
+
+        if shared_cache is not None:
+            shared_cache.set(key, sha, handler)
+
     def traverse_resources(self):
         return self.backend.traverse_resources()
 
@@ -488,7 +564,11 @@ class RODatabase:
         results = self.backend.search(query, **kw)
         return SearchResults(database=self, results=results)
 
-    def reindex_catalog(self, base_abspath, recursif=True):
+    def reindex_catalog(self, base_abspath, recursif=True, workers=None):
+        raise ReadonlyError
+
+    def rebuild_catalog(self, base_abspath='/', checkpoint=10000,
+                        workers=None):
         raise ReadonlyError
 
 
@@ -17,6 +17,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from itertools import islice
+from time import time
 import datetime
 import fnmatch
 import logging
@@ -94,7 +96,7 @@ class RWDatabase(RODatabase):
 
     def close(self):
         self.abort_changes()
-        self.backend.close()
+        super().close()
 
     def _sync_filesystem(self, key):
         # Don't check if handler has been modified since last loading,
@@ -492,8 +494,12 @@ class RWDatabase(RODatabase):
         _, _, _, docs_to_index, docs_to_unindex = data
         self.backend.flush_catalog(docs_to_unindex, docs_to_index)
 
-    def reindex_catalog(self, base_abspath, recursif=True):
+    def reindex_catalog(self, base_abspath, recursif=True, workers=None):
         """Reindex the catalog & return nb resources re-indexed
+
+        If 'workers' is given, the Xapian documents are built by that many
+        processes (see Catalog.index_documents), the catalog values are
+        still computed by the current process.
         """
         catalog = self.catalog
         base_resource = self.get_resource(base_abspath, soft=True)
@@ -502,10 +508,12 @@ class RWDatabase(RODatabase):
         n = 0
         # Recursif ?
         if recursif:
-            for item in base_resource.traverse_resources():
-                values = item.get_catalog_values()
-                catalog.index_document(values)
-                n += 1
+            resources = base_resource.traverse_resources()
+            documents = (x.get_catalog_values() for x in resources)
+            n = catalog.index_documents(documents, workers=workers)
+            # Every document has its sort keys now
+            if str(base_resource.abspath) == '/':
+                catalog.fill_sort_values()
         else:
             # Reindex resource
             values = base_resource.get_catalog_values()
@@ -517,6 +525,71 @@ class RWDatabase(RODatabase):
         # Ok
         return n
 
+    def rebuild_catalog(self, base_abspath='/', checkpoint=10000,
+                        workers=None):
+        """Rebuild the catalog from scratch & return nb resources indexed.
+
+        The new catalog is built beside the current one, which is still used
+        meanwhile, and replaces it at the end.  The new catalog is committed
+        every 'checkpoint' resources, so if the rebuild is interrupted it can
+        be resumed by calling this method again: the resources already in
+        the new catalog are skipped.
+
+        The database should not be changed during the rebuild, the changes
+        may be missing from the new catalog.
+        """
+        base_resource = self.get_resource(base_abspath)
+        catalog = self.backend.get_catalog_rebuild()
+        total = self.catalog._db.get_doccount()
+        done = catalog._db.get_doccount()
+        if done:
+            log.info(f'[Catalog] Resume rebuild after {done} resources')
+
+        def get_documents():
+            for resource in base_resource.traverse_resources():
+                if catalog.has_document(str(resource.abspath)):
+                    continue
+                yield resource.get_catalog_values()
+
+        n = 0
+        t0 = time()
+        documents = get_documents()
+        try:
+            while True:
+                batch = list(islice(documents, checkpoint))
+                if not batch:
+                    break
+                n += catalog.index_documents(batch, workers=workers)
+                catalog.save_changes()
+                # Report throughput & ETA
+                speed = n / max(time() - t0, 0.001)
+                todo = max(total - done - n, 0)
+                eta = datetime.timedelta(seconds=int(todo / speed))
+                log.info(f'[Catalog] Rebuild: {done + n}/{total} resources, '
+                         f'{speed:.1f} docs/s, ETA {eta}')
+        except BaseException:
+            # Keep the resources indexed so far, to resume
+            catalog.close()
+            raise
+
+        # Replace the current catalog
+        self.backend.swap_catalog_rebuild(catalog)
+        return done + n
+
+    def prune_metadata_cache(self):
+        """Remove from the metadata cache the versions of the files not in
+        the database any more, return the number of versions removed.
+        """
+        metadata_cache = self.metadata_cache
+        if metadata_cache is None:
+            return 0
+        shas = self.backend.get_blob_ids()
+        if shas is None:
+            return 0
+        n = metadata_cache.prune(shas)
+        log.info(f'[Metadata cache] {n} versions removed')
+        return n
+
 
 def make_database(path, size_min, size_max, fields=None, backend=None):
     """Create a new empty database if the given path does not exists or
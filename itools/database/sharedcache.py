@@ -0,0 +1,359 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from hashlib import sha1
+from logging import getLogger
+from os.path import abspath, dirname, isdir
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from sqlite3 import connect, Error as DatabaseError
+from tempfile import gettempdir, mkstemp
+from threading import Lock
+from time import time
+import os
+
+log = getLogger("itools.database")
+
+
+def get_blob_id(data):
+    """Return the id git gives to a file with the given data.
+    """
+    if type(data) is str:
+        data = data.encode('utf-8')
+    blob = sha1(b'blob %d\0' % len(data))
+    blob.update(data)
+    return blob.hexdigest()
+
+
+def get_shared_cache_path(path):
+    """Return the path of the shared cache of the database in the given
+    path: in shared memory if available, in a folder only readable by the
+    current user.
+    """
+    root = '/dev/shm' if isdir('/dev/shm') else gettempdir()
+    root = f'{root}/itools-{os.getuid()}'
+    os.makedirs(root, mode=0o700, exist_ok=True)
+    if os.stat(root).st_uid != os.getuid():
+        raise OSError(f'the folder "{root}" is not owned by the user')
+    name = sha1(abspath(path).encode('utf-8')).hexdigest()[:16]
+    return f'{root}/{name}.sqlite'
+
+
+class SharedCache:
+    """Second level cache of the handlers, shared by the processes working
+    with the same database on a node (like the workers of a server), so
+    they do not have to parse again the files parsed by another one.
+
+    The state of the handlers loaded (their attributes, pickled) is kept
+    in a SQLite database in shared memory, with its pages mapped in
+    memory.  It is keyed by the handler key and the git blob id of the
+    file, so a state is never used for another version of the file.  Only
+    the handlers whose class is 'shareable' are kept.
+
+    When the states kept are bigger than 'size_max' bytes, the least
+    recently used are removed until they are not bigger than 'size_min'.
+    The size is checked every 'check_interval' states written.
+    """
+
+    schema_version = 2
+    schema = """
+        CREATE TABLE IF NOT EXISTS handlers (
+            key TEXT PRIMARY KEY,
+            sha TEXT NOT NULL,
+            class TEXT NOT NULL,
+            state BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            used REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS handlers_used ON handlers (used);
+        """
+    # The size of the database mapped in memory
+    mmap_size = 256 * 2**20
+    # The size of the states kept
+    size_min = 96 * 2**20
+    size_max = 128 * 2**20
+    check_interval = 100
+    # The states bigger are not kept
+    max_state_size = 2**20
+    # The access times are written with the next state, or when there are
+    # more than this
+    max_touched = 1000
+    # The attributes not kept
+    exclude = frozenset(['database', 'key', 'timestamp', 'dirty'])
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.connection = None
+        self.pid = None
+        self.hits = self.misses = 0
+        # The states written, and the access times not written {key: time}
+        self.writes = 0
+        self.touched = {}
+
+    def _get_connection(self):
+        # The processes forked must not use the connection of their parent
+        pid = os.getpid()
+        if self.connection is None or self.pid != pid:
+            connection = connect(self.path, timeout=1,
+                                 check_same_thread=False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute(f'PRAGMA mmap_size = {self.mmap_size}')
+            # The cache of another version is dropped
+            cursor = connection.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] != self.schema_version:
+                connection.execute('DROP TABLE IF EXISTS handlers')
+                connection.execute(
+                    f'PRAGMA user_version = {self.schema_version}')
+            connection.executescript(self.schema)
+            self.connection = connection
+            self.touched = {}
+            self.pid = pid
+        return self.connection
+
+    def get(self, key, sha, cls):
+        """Return the state of the handler of the given class, for the given
+        version of the file (git blob id), or None if not in cache.
+        """
+        class_id = f'{cls.__module__}.{cls.__name__}'
+        try:
+            with self.lock:
+                cursor = self._get_connection().execute(
+                    'SELECT state FROM handlers '
+                    'WHERE key = ? AND sha = ? AND class = ?',
+                    (key, sha, class_id))
+                row = cursor.fetchone()
+                if row:
+                    self._touch(key)
+            state = loads(row[0]) if row else None
+        except Exception:
+            log.warning('Cannot read the shared cache', exc_info=True)
+            state = None
+
+        if state is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return state
+
+    def set(self, key, sha, handler):
+        """Keep the state of the given handler, loaded from the given version
+        of the file (git blob id).
+        """
+        cls = handler.__class__
+        class_id = f'{cls.__module__}.{cls.__name__}'
+        state = {
+            name: value for name, value in handler.__dict__.items()
+            if name not in self.exclude }
+        try:
+            state = dumps(state, HIGHEST_PROTOCOL)
+        except Exception:
+            log.debug(f'Cannot pickle the handler "{key}"', exc_info=True)
+            return
+        if len(state) > self.max_state_size:
+            return
+
+        # Another process may be writing, then just skip
+        try:
+            with self.lock:
+                connection = self._get_connection()
+                with connection:
+                    self._write_touched(connection)
+                    connection.execute(
+                        'INSERT OR REPLACE INTO handlers '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (key, sha, class_id, state, len(state), time()))
+                    self.writes += 1
+                    if self.writes % self.check_interval == 0:
+                        self._prune(connection)
+        except DatabaseError:
+            log.debug('Cannot write the shared cache', exc_info=True)
+
+    def _touch(self, key):
+        self.touched[key] = time()
+        if len(self.touched) > self.max_touched:
+            connection = self.connection
+            try:
+                with connection:
+                    self._write_touched(connection)
+            except DatabaseError:
+                log.debug('Cannot write the shared cache', exc_info=True)
+
+    def _write_touched(self, connection):
+        touched = self.touched
+        if touched:
+            connection.executemany(
+                'UPDATE handlers SET used = ? WHERE key = ?',
+                [(used, key) for key, used in touched.items()])
+            touched.clear()
+
+    def _prune(self, connection):
+        """Remove the states least recently used, if too big.
+        """
+        cursor = connection.execute('SELECT total(size) FROM handlers')
+        size = cursor.fetchone()[0]
+        if size <= self.size_max:
+            return
+
+        keys = []
+        cursor = connection.execute(
+            'SELECT key, size FROM handlers ORDER BY used')
+        for key, state_size in cursor:
+            if size <= self.size_min:
+                break
+            keys.append((key,))
+            size -= state_size
+        connection.executemany('DELETE FROM handlers WHERE key = ?', keys)
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self.lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute('DELETE FROM handlers')
+            self.touched.clear()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None and self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+
+class MetadataCache:
+    """Cache of the metadata parsed, in a local folder, used to load them
+    faster than from the text (on start for instance).
+
+    The binary state of the Metadata handlers (see Metadata.dump_state) is
+    kept in a file named by the git blob id of the metadata file, so it is
+    only used for the same data.  The folder may be removed at any time.
+
+    Every change of a metadata file makes a new version, so the files are
+    pruned (see prune): when they are bigger than 'size_max' bytes, the
+    least recently used are removed until they are not bigger than
+    'size_min'.  The size is checked every 'check_interval' files written.
+    """
+
+    # The size of the files kept
+    size_min = 192 * 2**20
+    size_max = 256 * 2**20
+    check_interval = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = self.misses = 0
+        self.writes = 0
+
+    def _get_path(self, sha):
+        return f'{self.path}/{sha[:2]}/{sha[2:]}'
+
+    def load(self, handler, sha):
+        """Load the state of the given handler for the given version of the
+        file (git blob id).  Return False if not in cache.
+        """
+        try:
+            with open(self._get_path(sha), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        try:
+            handler.load_state_from_binary(data)
+        except Exception:
+            log.warning(f'Cannot load the metadata cached "{sha}"',
+                        exc_info=True)
+            self.misses += 1
+            return False
+        self.hits += 1
+        # The time of last use, to prune the least recently used
+        try:
+            os.utime(self._get_path(sha))
+        except OSError:
+            pass
+        return True
+
+    def save(self, handler, sha):
+        """Keep the state of the given handler, loaded from the given version
+        of the file (git blob id).
+        """
+        data = handler.dump_state()
+        if data is None:
+            return
+
+        # Atomic write
+        path = self._get_path(sha)
+        folder = dirname(path)
+        try:
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+            fd, tmp = mkstemp(dir=folder)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            log.warning('Cannot write the metadata cache', exc_info=True)
+            return
+
+        self.writes += 1
+        if self.writes % self.check_interval == 0:
+            self.prune()
+
+    def prune(self, shas=None):
+        """Remove the states of the versions of the files (git blob ids) not
+        in the given set, if given.  Then remove the states least recently
+        used, if they are bigger than 'size_max' bytes.  Return the number
+        of states removed.
+        """
+        files = []
+        removed = []
+        for root, folders, names in os.walk(self.path):
+            prefix = root[len(self.path) + 1:]
+            for name in names:
+                path = f'{root}/{name}'
+                if shas is not None and prefix + name not in shas:
+                    removed.append(path)
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(x[1] for x in files)
+        if size > self.size_max:
+            files.sort()
+            for mtime, file_size, path in files:
+                if size <= self.size_min:
+                    break
+                removed.append(path)
+                size -= file_size
+
+        n = 0
+        for path in removed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Removed by another process
+                pass
+            except OSError:
+                log.warning('Cannot prune the metadata cache', exc_info=True)
+            else:
+                n += 1
+        return n
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
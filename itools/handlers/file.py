@@ -51,6 +51,14 @@ class File(Handler):
     class_mimetypes = ['application/octet-stream']
     is_text = False
 
+    # The approximate memory used by a loaded handler, a fixed part plus a
+    # multiple of the size of the file (see get_footprint)
+    footprint_base = 1024
+    footprint_ratio = 1
+    # Whether the state of a loaded handler can be shared with other
+    # processes (pickled), see itools.database.sharedcache
+    shareable = False
+
     # By default handlers are not loaded
     timestamp = None
     dirty = None
@@ -141,6 +149,19 @@ class File(Handler):
     def save_state_to(self, key):
         self.database.save_handler(key, self)
 
+    def to_str_append(self):
+        """Returns the data to append to the file of the handler, as loaded
+        or saved last, to save the changes; or None if the whole file is to
+        be written (see 'to_str').  By default the whole file is written.
+        """
+        return None
+
+    def set_saved(self, appended):
+        """Called by the database once the handler is saved to its file,
+        'appended' tells whether it was by appending (see 'to_str_append').
+        """
+        pass
+
     clone_exclude = frozenset(['database', 'key', 'timestamp', 'dirty'])
 
     def clone(self, cls=None):
@@ -198,6 +219,14 @@ class File(Handler):
     #########################################################################
     # API
     #########################################################################
+    @classmethod
+    def get_footprint(cls, size):
+        """Returns the approximate memory used by a handler of this class,
+        loaded from a file of the given size (in bytes).  Used to weigh the
+        handlers in the cache of the database.
+        """
+        return cls.footprint_base + int(size * cls.footprint_ratio)
+
     def get_mtime(self):
         """Returns the last modification time.
         """
@@ -44,6 +44,7 @@ class TextFile(File):
     class_mimetypes = ['text']
     class_extension = 'txt'
     is_text = True
+    footprint_ratio = 2
 
     def new(self, data=''):
         self.data = data
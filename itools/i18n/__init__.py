@@ -17,6 +17,7 @@
 
 # Import from itools
 from .accept import AcceptLanguageType, get_accept, select_language
+from .collation import get_sort_key
 from .fuzzy import get_distance, get_similarity, is_similar, get_most_similar
 from .languages import has_language, get_languages, get_language_name
 from .locale_ import format_date, format_time, format_datetime
@@ -30,6 +31,8 @@ __all__ = [
     'AcceptLanguageType',
     'get_accept',
     'select_language',
+    # collation
+    'get_sort_key',
     # fuzzy
     'get_distance',
     'get_similarity',
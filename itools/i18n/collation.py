@@ -0,0 +1,94 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sort keys to sort unicode strings following the collation of a language.
+
+If PyICU is installed the ICU collators are used.  Otherwise the keys are
+an approximation: letters are compared without accents nor case first,
+then accents and case break the ties, with the tailorings of some
+languages (letters sorted after 'z').
+"""
+
+# Import from the Standard Library
+from unicodedata import combining, normalize
+
+# Import from PyICU
+try:
+    from icu import Collator, Locale
+except ImportError:
+    Collator = None
+
+
+# The letters sorted after 'z', in order
+LETTERS_AFTER_Z = {
+    'da': 'æøå',
+    'fi': 'åäö',
+    'nb': 'æøå',
+    'nn': 'æøå',
+    'no': 'æøå',
+    'sv': 'åäö',
+}
+
+# Other letters sorted as a different letter (of the same language)
+LETTERS_AFTER = {
+    'es': {'ñ': 'n\uffff'},
+}
+
+
+def _make_tailoring(language):
+    tailoring = {}
+    for i, letter in enumerate(LETTERS_AFTER_Z.get(language, '')):
+        tailoring[ord(letter)] = f'z\uffff{chr(i + 1)}'
+    for letter, key in LETTERS_AFTER.get(language, {}).items():
+        tailoring[ord(letter)] = key
+    return tailoring
+
+
+_collators = {}
+
+
+def _get_collator(language):
+    collator = _collators.get(language)
+    if collator is None:
+        if Collator is None:
+            collator = _make_tailoring(language)
+        else:
+            locale = Locale(language) if language else Locale.getRoot()
+            collator = Collator.createInstance(locale)
+        _collators[language] = collator
+    return collator
+
+
+def get_sort_key(value, language=None):
+    """Return the sort key (a byte string) of the given unicode string, for
+    the given language.  Byte string comparison of the keys follows the
+    collation of the language.
+    """
+    collator = _get_collator(language)
+    if Collator is not None:
+        return collator.getSortKey(value)
+
+    # 3rd level: case (lower case first, like ICU)
+    tertiary = normalize('NFKD', value).swapcase()
+    # 2nd level: accents
+    secondary = normalize('NFKD', value).casefold()
+    # 1st level: letters
+    primary = normalize('NFC', value).casefold().translate(collator)
+    primary = normalize('NFKD', primary)
+    primary = ''.join([c for c in primary if not combining(c)])
+
+    key = f'{primary}\x00{secondary}\x00{tertiary}'
+    return key.encode('utf-8')
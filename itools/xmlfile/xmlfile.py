@@ -38,6 +38,8 @@ class XMLFile(TextFile):
 
     class_mimetypes = ['text/xml', 'application/xml']
     class_extension = 'xml'
+    footprint_ratio = 10
+    shareable = True
     __hash__ = None
 
     def new(self):
@@ -0,0 +1,159 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark of the LRU cache: throughput of get, set, touch and evict,
+and memory used by entry.  The former implementation (a dict plus a doubly
+linked list of nodes, in Python) is given for comparison.
+"""
+
+# Import from the Standard Library
+from optparse import OptionParser
+from time import perf_counter
+import tracemalloc
+
+# Import from itools
+from itools.core import LRUCache
+
+
+class DNode:
+
+    __slots__ = ['prev', 'next', 'key']
+
+    def __init__(self, key):
+        self.key = key
+
+
+class LinkedLRUCache(dict):
+    """The former LRU cache, for comparison.
+    """
+
+    def __init__(self, size_min, size_max=None, automatic=True):
+        super().__init__()
+        self.first = None
+        self.last = None
+        self.key2node = {}
+        self.size_min = size_min
+        self.size_max = size_max or size_min
+        self.automatic = automatic
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        node = DNode(key)
+        self.key2node[key] = node
+        node.prev = self.last
+        node.next = None
+        if self.first is None:
+            self.first = node
+        else:
+            self.last.next = node
+        self.last = node
+        if self.automatic is True and len(self) > self.size_max:
+            while len(self) > self.size_min:
+                self.popitem()
+
+    def _remove(self, key):
+        node = self.key2node.pop(key)
+        if node.prev is None:
+            self.first = node.next
+        else:
+            node.prev.next = node.next
+        if node.next is None:
+            self.last = node.prev
+        else:
+            node.next.prev = node.prev
+
+    def pop(self, key):
+        self._remove(key)
+        return dict.pop(self, key)
+
+    def popitem(self):
+        key = self.first.key
+        return key, self.pop(key)
+
+    def touch(self, key):
+        node = self.key2node[key]
+        if node.next is None:
+            return
+        if node.prev is None:
+            self.first = node.next
+        else:
+            node.prev.next = node.next
+        node.next.prev = node.prev
+        node.prev = self.last
+        node.next = None
+        self.last.next = node
+        self.last = node
+
+
+def bench(cache_class, size):
+    keys = [f'/database/{i}.metadata' for i in range(size)]
+    results = {}
+
+    # Set
+    cache = cache_class(size)
+    t0 = perf_counter()
+    for key in keys:
+        cache[key] = key
+    results['set'] = perf_counter() - t0
+
+    # Get
+    get = cache.get
+    t0 = perf_counter()
+    for key in keys:
+        get(key)
+    results['get'] = perf_counter() - t0
+
+    # Touch
+    touch = cache.touch
+    t0 = perf_counter()
+    for key in reversed(keys):
+        touch(key)
+    results['touch'] = perf_counter() - t0
+
+    # Evict
+    t0 = perf_counter()
+    for key in keys:
+        cache[key + '~'] = key
+    results['evict'] = perf_counter() - t0
+
+    # Memory by entry (the keys and values are not counted)
+    tracemalloc.start()
+    cache = cache_class(size)
+    snapshot = tracemalloc.take_snapshot()
+    for key in keys:
+        cache[key] = key
+    size_used = tracemalloc.take_snapshot().compare_to(snapshot, 'filename')
+    tracemalloc.stop()
+    results['memory'] = sum(x.size_diff for x in size_used) / size
+
+    return results
+
+
+if __name__ == '__main__':
+    usage = '%prog [OPTIONS]'
+    parser = OptionParser(usage)
+    parser.add_option('-n', '--size', type='int', default=100000,
+        help='the number of entries in the cache (default 100000)')
+    options, args = parser.parse_args()
+    size = options.size
+
+    print(f'{size} entries, time by operation (µs) and memory by entry (b)')
+    print(f'{"":16} {"set":>8} {"get":>8} {"touch":>8} {"evict":>8} {"memory":>8}')
+    for cache_class in LinkedLRUCache, LRUCache:
+        results = bench(cache_class, size)
+        line = [f'{cache_class.__name__:16}']
+        for name in 'set', 'get', 'touch', 'evict':
+            line.append(f'{results[name] * 1e6 / size:8.3f}')
+        line.append(f'{results["memory"]:8.0f}')
+        print(' '.join(line))
@@ -0,0 +1,82 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the metadata parser over the metadata files of a database,
+comparing the parser with the full state machine for every line (the
+former parser).  The output of both must be identical.
+
+Usage: bench_metadata.py <path to the database folder>
+"""
+
+# Import from the Standard Library
+from optparse import OptionParser
+from os import walk
+from os.path import join
+from time import perf_counter
+
+# Import from itools
+from itools.database.metadata_parser import parse_table, unfold_lines
+from itools.database.metadata_parser import read_name, get_tokens
+
+
+def parse_table_full(data):
+    for line in unfold_lines(data):
+        name, line = read_name(line)
+        value, parameters = get_tokens(line)
+        yield name, value, parameters
+
+
+def parse(parser, corpus):
+    result = []
+    for data in corpus:
+        try:
+            result.append(list(parser(data)))
+        except SyntaxError as e:
+            result.append(str(e))
+    return result
+
+
+if __name__ == '__main__':
+    usage = '%prog [OPTIONS] <path>'
+    parser = OptionParser(usage)
+    parser.add_option('-n', '--passes', type='int', default=5,
+        help='the number of passes (default 5)')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('the path to the database is expected')
+
+    # Load the corpus
+    corpus = []
+    for root, dirs, files in walk(args[0]):
+        dirs[:] = [x for x in dirs if x != '.git']
+        for name in files:
+            if name.endswith('.metadata'):
+                with open(join(root, name), 'rb') as f:
+                    corpus.append(f.read())
+    size = sum(len(x) for x in corpus)
+    print(f'{len(corpus)} files, {size / 2**20:.2f} Mb')
+
+    # Check
+    if parse(parse_table, corpus) != parse(parse_table_full, corpus):
+        raise AssertionError('the output of the parsers differ')
+
+    # Go
+    for parser in parse_table_full, parse_table:
+        times = []
+        for i in range(options.passes):
+            t0 = perf_counter()
+            parse(parser, corpus)
+            times.append(perf_counter() - t0)
+        t = min(times)
+        print(f'{parser.__name__:20} {t:8.3f} s  {size / 2**20 / t:8.2f} Mb/s')
@@ -21,6 +21,7 @@ from sys import exit
 from unittest import TestLoader, TestSuite, TextTestRunner
 
 # Import tests
+import test_catalog
 import test_core
 import test_csv
 import test_dispatcher
@@ -28,12 +29,17 @@ import test_dispatcher
 # import test_database
 import test_datatypes
 import test_gettext
+import test_git
+import test_git_backend
 import test_handlers
 import test_html
 import test_i18n
 import test_ical
+import test_metadata
 import test_odf
+import test_patchs
 import test_rss
+import test_sharedcache
 import test_srx
 import test_stl
 import test_tmx
@@ -46,10 +52,12 @@ import test_xliff
 import test_xml
 import test_xmlfile
 
-test_modules = [test_core, test_csv, test_datatypes, test_dispatcher,
-    test_gettext, test_handlers, test_html, test_i18n, test_ical, test_odf,
-    test_rss, test_srx, test_stl, test_tmx, test_uri, test_fs,
-    test_validators, test_web, test_workflow, test_xliff, test_xml, test_xmlfile]
+test_modules = [test_catalog, test_core, test_csv, test_datatypes,
+    test_dispatcher, test_gettext, test_git, test_git_backend, test_handlers,
+    test_html, test_i18n, test_ical, test_metadata, test_odf, test_patchs,
+    test_rss, test_sharedcache, test_srx, test_stl, test_tmx, test_uri,
+    test_fs, test_validators, test_web, test_workflow, test_xliff, test_xml,
+    test_xmlfile]
 
 #test_modules = [test_core, test_csv, test_dispatcher, test_datatypes]
 
@@ -0,0 +1,457 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from os.path import exists
+from pickle import dumps, loads
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from itools
+from itools.database import AndQuery, OrQuery, NotQuery, PhraseQuery
+from itools.database import RangeQuery, StartQuery, TextQuery
+from itools.database.backends.catalog import CachedDocuments, Catalog
+from itools.database.backends.catalog import Documents, SearchResults
+from itools.database.backends.catalog import make_catalog
+from itools.database.backends.catalog import _get_field_spec, _make_field
+from itools.database.backends.catalog import _get_query_key, _get_xquery
+from itools.database.backends.catalog import _make_sort_key
+from itools.datatypes import Integer, String, Unicode
+from itools.i18n import get_sort_key
+
+
+fields = {
+    'abspath': String(stored=True, indexed=True),
+    'format': String(stored=True, indexed=True),
+    'tags': String(stored=True, indexed=True, multiple=True),
+    'count': Integer(stored=True, indexed=True)}
+
+documents = [
+    {'abspath': '/1', 'format': 'a', 'tags': ['x', 'y'], 'count': 1},
+    {'abspath': '/2', 'format': 'a', 'tags': ['x', 'y'], 'count': 2},
+    {'abspath': '/3', 'format': 'b', 'tags': ['x', 'z'], 'count': 3}]
+
+
+
+###########################################################################
+# Query keys
+###########################################################################
+class QueryKeyTestCase(TestCase):
+
+    def test_and_or(self):
+        a = PhraseQuery('format', 'a')
+        b = PhraseQuery('tags', 'x')
+        for operator in AndQuery, OrQuery:
+            key = _get_query_key(operator(a, b))
+            self.assertEqual(key, _get_query_key(operator(b, a)))
+            self.assertEqual(key[1], frozenset(['format', 'tags']))
+        self.assertNotEqual(_get_query_key(AndQuery(a, b)),
+                            _get_query_key(OrQuery(a, b)))
+
+    def test_keywords(self):
+        query = AndQuery(PhraseQuery('format', 'a'), PhraseQuery('tags', 'x'))
+        self.assertEqual(_get_query_key(format='a', tags='x'),
+                         _get_query_key(query))
+        self.assertEqual(_get_query_key(), (('all',), frozenset(['*'])))
+
+    def test_values(self):
+        key = _get_query_key(PhraseQuery('tags', ['x', 'y']))
+        self.assertEqual(key, _get_query_key(PhraseQuery('tags', ('x', 'y'))))
+        # 1 and True are equal, but not the same query
+        self.assertNotEqual(_get_query_key(PhraseQuery('count', 1)),
+                            _get_query_key(PhraseQuery('count', True)))
+        self.assertNotEqual(_get_query_key(RangeQuery('count', 1, 2)),
+                            _get_query_key(RangeQuery('count', 1, 3)))
+        self.assertNotEqual(_get_query_key(PhraseQuery('format', 'a')),
+                            _get_query_key(StartQuery('format', 'a')))
+        # Not hashable
+        self.assertEqual(_get_query_key(PhraseQuery('format', {})), None)
+        query = AndQuery(PhraseQuery('format', 'a'),
+                         PhraseQuery('format', {}))
+        self.assertEqual(_get_query_key(query), None)
+
+    def test_nested(self):
+        a = PhraseQuery('format', 'a')
+        b = PhraseQuery('tags', 'x')
+        c = PhraseQuery('count', 1)
+        key = _get_query_key(AndQuery(a, b, c))
+        self.assertEqual(_get_query_key(AndQuery(AndQuery(a, b), c)), key)
+        self.assertEqual(_get_query_key(AndQuery(a, a)), _get_query_key(a))
+        self.assertNotEqual(_get_query_key(AndQuery(OrQuery(a, b), c)), key)
+
+    def test_not(self):
+        key, depends = _get_query_key(NotQuery(PhraseQuery('format', 'a')))
+        self.assertEqual(depends, frozenset(['format', '*']))
+
+
+
+###########################################################################
+# Fields sent to the indexing workers
+###########################################################################
+class FieldSpecTestCase(TestCase):
+
+    def test_make_field(self):
+        for name, field_cls in fields.items():
+            spec = loads(dumps(_get_field_spec(field_cls)))
+            copy = _make_field(*spec)
+            self.assertTrue(issubclass(copy, field_cls.__bases__[0]))
+            for key in 'stored', 'indexed', 'multiple':
+                self.assertEqual(getattr(copy, key), getattr(field_cls, key))
+        # Made in several steps
+        field_cls = String(indexed=True)(multiple=True)
+        spec = _get_field_spec(field_cls)
+        self.assertEqual(spec, ('itools.datatypes.primitive', 'String',
+                                [{'indexed': True}, {'multiple': True}]))
+        self.assertEqual(_get_field_spec(String), (
+            'itools.datatypes.primitive', 'String', []))
+
+
+
+###########################################################################
+# Catalog
+###########################################################################
+class CatalogTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.catalog = make_catalog(f'{self.path}/catalog', fields)
+        for document in documents:
+            self.catalog.index_document(document)
+        self.catalog.save_changes()
+
+    def tearDown(self):
+        self.catalog.close()
+        rmtree(self.path)
+
+    def search(self, query=None, **kw):
+        catalog = self.catalog
+        xquery = _get_xquery(catalog, query, **kw)
+        key = _get_query_key(query, **kw)
+        return SearchResults(catalog, xquery, key)
+
+    def get_abspaths(self, query=None, **kw):
+        results = self.search(query, **kw)
+        documents = results.get_documents(sort_by='abspath')
+        return [x.abspath for x in documents]
+
+    def index_document(self, document):
+        self.catalog.index_document(document)
+        self.catalog.save_changes()
+
+    def test_results_cache(self):
+        catalog = self.catalog
+        self.assertEqual(self.get_abspaths(format='a'), ['/1', '/2'])
+        self.assertEqual(self.get_abspaths(format='a'), ['/1', '/2'])
+        stats = catalog.get_results_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        # Another field changed, the results are kept
+        self.index_document(dict(documents[0], count=5))
+        self.assertEqual(self.get_abspaths(format='a'), ['/1', '/2'])
+        stats = catalog.get_results_cache_stats()
+        self.assertEqual((stats['hits'], stats['invalidations']), (2, 0))
+
+        # The field changed, the results are dropped
+        self.index_document(dict(documents[2], format='a'))
+        self.assertEqual(self.get_abspaths(format='a'), ['/1', '/2', '/3'])
+        stats = catalog.get_results_cache_stats()
+        self.assertEqual((stats['hits'], stats['invalidations']), (2, 1))
+
+        # A document removed
+        catalog.unindex_document('/1')
+        catalog.save_changes()
+        self.assertEqual(self.get_abspaths(format='a'), ['/2', '/3'])
+
+    def test_results_cache_search(self):
+        results = self.search(format='a').search(tags='y')
+        self.assertEqual(results._key, _get_query_key(format='a', tags='y'))
+        documents = results.get_documents(sort_by='abspath')
+        self.assertEqual([x.abspath for x in documents], ['/1', '/2'])
+        self.assertEqual(self.get_abspaths(format='a', tags='y'),
+                         ['/1', '/2'])
+        stats = self.catalog.get_results_cache_stats()
+        self.assertEqual(stats['hits'], 1)
+
+    def test_compiled_queries(self):
+        catalog = self.catalog
+        for query in [PhraseQuery('format', 'a'), RangeQuery('count', 1, 2),
+                      StartQuery('abspath', '/')]:
+            xquery = catalog._query2xquery(query)
+            self.assertIs(catalog._query2xquery(query), xquery)
+        # The text queries are not kept
+        size = len(catalog._xquery_cache)
+        catalog._query2xquery(TextQuery('format', 'a'))
+        self.assertEqual(len(catalog._xquery_cache), size)
+
+    def test_phrase_query(self):
+        self.assertEqual(self.get_abspaths(tags='y'), ['/1', '/2'])
+        self.assertEqual(self.get_abspaths(PhraseQuery('tags', ['x', 'z'])),
+                         ['/3'])
+        self.assertEqual(self.get_abspaths(count=2), ['/2'])
+        self.assertEqual(self.get_abspaths(RangeQuery('count', 2, None)),
+                         ['/2', '/3'])
+
+    def get_xdocs(self, catalog):
+        """Return the terms and values of the Xapian documents of the given
+        catalog, by their unique term.
+        """
+        db = catalog._db
+        xdocs = {}
+        for item in db.postlist(''):
+            xdoc = db.get_document(item.docid)
+            terms = [(x.term, x.wdf) for x in xdoc.termlist()]
+            values = [(x.num, x.value) for x in xdoc.values()]
+            key = [x for x, wdf in terms if x.startswith(b'Q')]
+            xdocs[key[0]] = (terms, values)
+        return xdocs
+
+    def test_index_documents(self):
+        expected = self.get_xdocs(self.catalog)
+        self.assertEqual(len(expected), len(documents))
+        # The same documents, built by this process and by other processes
+        for workers in 1, 2:
+            catalog = make_catalog(f'{self.path}/catalog-{workers}', fields)
+            try:
+                n = catalog.index_documents(documents, workers=workers,
+                                            chunksize=1)
+                self.assertEqual(n, len(documents))
+                catalog.save_changes()
+                self.assertEqual(self.get_xdocs(catalog), expected)
+            finally:
+                catalog.close()
+
+    def test_count(self):
+        catalog = self.catalog
+        results = self.search(format='a')
+        self.assertEqual(results.get_count(), 2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(len(catalog._count_cache), 1)
+        self.assertEqual(results.get_count(exact=False), 2)
+        lower, estimated, upper = results.get_count_bounds()
+        self.assertTrue(lower <= estimated <= upper)
+        self.assertTrue(lower <= 2 <= upper)
+        self.assertEqual(results.get_count_bounds(check_at_least=10),
+                         (2, 2, 2))
+        self.assertEqual(self.search(tags='missing').get_count(), 0)
+        self.assertEqual(self.search(format='a').search(tags='z').get_count(),
+                         0)
+
+        # The catalog changed, the counts are dropped
+        self.index_document({'abspath': '/4', 'format': 'a', 'count': 4})
+        self.assertEqual(len(catalog._count_cache), 0)
+        self.assertEqual(self.search(format='a').get_count(), 3)
+        query = NotQuery(PhraseQuery('format', 'a'))
+        self.assertEqual(self.search(query).get_count(), 1)
+        self.assertEqual(self.search().get_count_bounds(check_at_least=10),
+                         (4, 4, 4))
+
+    def get_documents(self, cls, **kw):
+        """Return the documents found as a lazy sequence of the given class
+        (not cached or cached).
+        """
+        catalog = self.catalog
+        catalog.results_cache_max_ids = 0 if cls is Documents else 1000
+        documents = self.search().get_documents(**kw)
+        self.assertIs(type(documents), cls)
+        return documents
+
+    def test_documents(self):
+        for count in range(4, 13):
+            self.catalog.index_document(
+                {'abspath': f'/{count}', 'format': 'c', 'count': count})
+        self.catalog.save_changes()
+        counts = lambda documents: [x.count for x in documents]
+
+        for cls in Documents, CachedDocuments:
+            documents = self.get_documents(cls, sort_by='count')
+            documents.page_size = 5
+            self.assertEqual(len(documents), 12)
+            self.assertEqual(counts(documents), list(range(1, 13)))
+            # The page is released at the end of the iteration
+            self.assertIsNone(documents._page)
+            # Index
+            self.assertEqual(documents[0].count, 1)
+            self.assertEqual(documents[-1].count, 12)
+            self.assertEqual(documents[-12].count, 1)
+            self.assertRaises(IndexError, documents.__getitem__, 12)
+            self.assertRaises(IndexError, documents.__getitem__, -13)
+            # Only the current page is kept
+            documents[7]
+            self.assertEqual((documents._page_start, len(documents._page)),
+                             (5, 5))
+            documents[11]
+            self.assertEqual((documents._page_start, len(documents._page)),
+                             (10, 2))
+            # Slices
+            window = documents[2:8]
+            self.assertIs(type(window), cls)
+            self.assertEqual(len(window), 6)
+            self.assertEqual(counts(window), [3, 4, 5, 6, 7, 8])
+            self.assertEqual(window[-1].count, 8)
+            self.assertEqual(counts(window[1:3]), [4, 5])
+            self.assertEqual(counts(documents[::3]), [1, 4, 7, 10])
+            self.assertEqual(counts(documents[-3:]), [10, 11, 12])
+            self.assertEqual(counts(documents[10:20]), [11, 12])
+            self.assertEqual(len(documents[5:2]), 0)
+            # Reverse
+            self.assertEqual(counts(reversed(documents)),
+                             list(range(12, 0, -1)))
+            self.assertEqual(counts(reversed(window)), [8, 7, 6, 5, 4, 3])
+            documents = self.get_documents(cls, sort_by='count', reverse=True,
+                                           start=2, size=3)
+            self.assertEqual(counts(documents), [10, 9, 8])
+            self.assertEqual(counts(documents[::-1]), [8, 9, 10])
+            # Start and size
+            documents = self.get_documents(cls, sort_by='count', start=10,
+                                           size=5)
+            self.assertEqual(counts(documents), [11, 12])
+            documents = self.get_documents(cls, start=20)
+            self.assertEqual(list(documents), [])
+            # By relevance
+            documents = self.get_documents(cls)
+            reverse = self.get_documents(cls, reverse=True)
+            self.assertEqual(counts(reverse), counts(documents)[::-1])
+            self.assertEqual(counts(reverse[:2]), counts(documents)[:-3:-1])
+
+    def test_fields(self):
+        self.index_document({'abspath': '/4', 'format': 'c'})
+        names = ['format', 'tags', 'count']
+        documents = self.search().get_documents(sort_by='abspath')
+        projected = self.search().get_documents(
+            sort_by='abspath', fields=names + ['unknown', 'format'])
+        self.assertEqual(len(projected), 4)
+        for document, doc in zip(documents, projected):
+            # Decoded at once, the same values
+            for name in names:
+                self.assertIn(name, doc.__dict__)
+                self.assertEqual(doc.__dict__[name], getattr(document, name))
+            self.assertNotIn('abspath', doc.__dict__)
+            self.assertNotIn('unknown', doc.__dict__)
+            self.assertEqual(doc.abspath, document.abspath)
+        # The windows keep the projection
+        doc = projected[1:][0]
+        self.assertEqual(doc.__dict__['tags'], ['x', 'y'])
+
+    def test_facets(self):
+        facets = self.search().get_facets(['format', 'tags', 'unknown'])
+        self.assertEqual(facets, {
+            'format': [('a', 2), ('b', 1)],
+            'tags': [('x', 3), ('y', 2), ('z', 1)],
+            'unknown': []})
+        facets = self.search().get_facets(['tags'], limit=1)
+        self.assertEqual(facets, {'tags': [('x', 3)]})
+        # Within the documents found
+        facets = self.search(format='a').get_facets(['tags', 'count'])
+        self.assertEqual(dict(facets['tags']), {'x': 2, 'y': 2})
+        self.assertEqual(dict(facets['count']), {1: 1, 2: 1})
+
+
+
+###########################################################################
+# Sort
+###########################################################################
+words = ['Zoo', 'été', 'apple', 'école', 'zèbre']
+# Sorted by the encoded values, and following the collation
+words_by_value = ['Zoo', 'apple', 'zèbre', 'école', 'été']
+words_by_key = ['apple', 'école', 'été', 'zèbre', 'Zoo']
+
+
+class SortTestCase(TestCase):
+
+    fields = {
+        'abspath': String(stored=True, indexed=True),
+        'title': Unicode(stored=True, indexed=True, sortable=True)}
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.catalog = None
+
+    def tearDown(self):
+        if self.catalog is not None:
+            self.catalog.close()
+        rmtree(self.path)
+
+    def open_catalog(self, fields=None):
+        if self.catalog is not None:
+            self.catalog.close()
+        path = f'{self.path}/catalog'
+        fields = fields or self.fields
+        self.catalog = Catalog(path, fields) if exists(path) else \
+            make_catalog(path, fields)
+        return self.catalog
+
+    def index_documents(self, words, language=None):
+        catalog = self.catalog
+        for i, word in enumerate(words):
+            title = {language: word} if language else word
+            catalog.index_document({'abspath': f'/{i}', 'title': title})
+        catalog.save_changes()
+
+    def get_titles(self, reverse=False):
+        catalog = self.catalog
+        results = SearchResults(catalog, _get_xquery(catalog))
+        documents = results.get_documents(sort_by='title', reverse=reverse)
+        return [x.title for x in documents]
+
+    def test_sort(self):
+        self.open_catalog()
+        self.index_documents(words)
+        self.assertEqual(self.get_titles(), words_by_key)
+        self.assertEqual(self.get_titles(reverse=True), words_by_key[::-1])
+
+    def test_sort_language(self):
+        self.open_catalog()
+        self.index_documents(['öl', 'zebra', 'ål', 'apa'], 'sv')
+        self.assertEqual(self.catalog._get_sort_value('title'),
+                         self.catalog._metadata['title_sv']['sort'])
+        self.assertEqual(self.get_titles(), ['apa', 'zebra', 'ål', 'öl'])
+
+    def test_fill_sort_values(self):
+        # Not sortable
+        fields = dict(self.fields, title=Unicode(stored=True, indexed=True))
+        self.open_catalog(fields)
+        self.index_documents(words)
+        self.assertEqual(self.get_titles(), words_by_value)
+
+        # Sortable: the sort keys are used once filled
+        catalog = self.open_catalog()
+        self.assertIn('sort_pending', catalog._metadata['title'])
+        self.assertEqual(self.get_titles(), words_by_value)
+        self.index_documents(words)
+        self.assertEqual(self.get_titles(), words_by_value)
+        catalog.fill_sort_values()
+        catalog.save_changes()
+        self.assertEqual(self.get_titles(), words_by_key)
+        # Kept
+        catalog = self.open_catalog()
+        self.assertNotIn('sort_pending', catalog._metadata['title'])
+        self.assertEqual(self.get_titles(), words_by_key)
+
+    def test_make_sort_key(self):
+        for language in None, 'sv':
+            keys = [_make_sort_key(x, language) for x in words]
+            self.assertEqual(keys, [get_sort_key(x, language) for x in words])
+        # Multiple: the first value
+        self.assertEqual(_make_sort_key(['zèbre', 'apple'], None),
+                         get_sort_key('zèbre'))
+        self.assertEqual(_make_sort_key([], None), get_sort_key(''))
+        self.assertEqual(sorted(words, key=lambda x: _make_sort_key(x, None)),
+                         words_by_key)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -13,12 +13,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from copy import deepcopy
+from pickle import dumps, loads
 from string import ascii_lowercase
+from sys import modules
 from unittest import TestCase, main
+from warnings import catch_warnings, simplefilter
 
 # Import from itools
 from itools.core import freeze, frozenlist, frozendict
-from itools.core import LRUCache
+from itools.core import LRUCache, TwoQueueCache
 
 
 ###########################################################################
@@ -300,6 +304,13 @@ class CacheTestCase(TestCase):
         self.assertEqual(cache[key], value)
 
 
+    def test_setitem_existing(self):
+        cache = self.cache
+        cache['x'] = 'x'
+        self.assertEqual(cache.keys(), list('yzx'))
+        self.assertEqual(len(cache), cache.size_min)
+
+
     def test_delitem(self):
         cache = self.cache
         self.assertEqual(len(cache), cache.size_min)
@@ -327,6 +338,21 @@ class CacheTestCase(TestCase):
         self.assertRaises(NotImplementedError, cache.copy)
 
 
+    def test_deepcopy(self):
+        cache = LRUCache(3, 5, automatic=False)
+        for c in 'abcd':
+            cache[c] = [c.upper()]
+        cache.touch('a')
+        for copy in deepcopy(cache), loads(dumps(cache)):
+            self.assertIsInstance(copy, LRUCache)
+            self.assertEqual(copy.size_min, 3)
+            self.assertEqual(copy.size_max, 5)
+            self.assertEqual(copy.automatic, False)
+            self.assertEqual(copy.items(), cache.items())
+            self.assertEqual(copy.keys(), list('bcda'))
+            self.assertIsNot(copy['a'], cache['a'])
+
+
     def test_fromkeys(self):
         cache = self.cache
         self.assertRaises(NotImplementedError, cache.fromkeys, 'abc')
@@ -400,6 +426,17 @@ class CacheTestCase(TestCase):
         self.assertEqual(values, list('XYZ'))
 
 
+    def test_odict(self):
+        # The former ordered dict is still there, deprecated
+        modules.pop('itools.core.odict', None)
+        with catch_warnings(record=True) as warnings:
+            simplefilter('always')
+            from itools.core.odict import OrderedDict
+        self.assertEqual(warnings[0].category, DeprecationWarning)
+        odict = OrderedDict([('a', 1), ('b', 2)])
+        self.assertEqual(odict.keys(), ['a', 'b'])
+
+
     #######################################################################
     # Specific API
     def test_touch(self):
@@ -411,6 +448,63 @@ class CacheTestCase(TestCase):
 
 
 
+class TwoQueueCacheTestCase(TestCase):
+
+    def make_room(self, cache):
+        for key in cache.victims():
+            cache.evict(key)
+
+
+    def test_init(self):
+        self.assertRaises(ValueError, TwoQueueCache, 5, 3)
+        self.assertRaises(ValueError, TwoQueueCache, 5, 5, 100, 50)
+
+
+    def test_weight(self):
+        cache = TwoQueueCache(10, 20, 100, 200)
+        cache.set('a', 'A', 150, 'x')
+        self.assertFalse(cache.is_full())
+        cache.set('b', 'B', 100, 'y')
+        self.assertTrue(cache.is_full())
+        self.make_room(cache)
+        self.assertTrue(cache.has_room())
+        self.assertEqual(list(cache), ['b'])
+        self.assertEqual(cache.weight, 100)
+
+
+    def test_scan_resistance(self):
+        cache = TwoQueueCache(10, 10)
+        # Values used often: seen once, then again after eviction
+        for key in 'abcde':
+            cache[key] = key.upper()
+        for key in 'abcde':
+            cache.evict(key)
+        for key in 'abcde':
+            cache[key] = key.upper()
+            cache.touch(key)
+        # A scan of many values
+        for i in range(100):
+            cache[i] = i
+            if cache.is_full():
+                self.make_room(cache)
+        for key in 'abcde':
+            self.assertIn(key, cache)
+
+
+    def test_stats(self):
+        cache = TwoQueueCache(2)
+        cache.set('a', 'A', 10, 'x')
+        cache.set('b', 'B', 20, 'x')
+        cache.set('c', 'C', 30, 'y')
+        cache.touch('a')
+        self.make_room(cache)
+        stats = cache.get_stats()
+        self.assertEqual(stats['x'], {'count': 1, 'weight': 20, 'hits': 1,
+                                      'misses': 2, 'evictions': 1})
+        self.assertEqual(stats['y']['count'], 1)
+
+
+
 if __name__ == '__main__':
     main()
 
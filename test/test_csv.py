@@ -22,7 +22,7 @@ from datetime import date
 from unittest import TestCase, main
 
 # Import from itools
-from itools.csv import CSVFile, Table, UniqueError
+from itools.csv import CSVFile, Property, Table, UniqueError
 from itools.csv.table import parse_table, unfold_lines
 from itools.datatypes import Date, Integer, Unicode, URI, String
 from itools.fs import lfs
@@ -215,6 +215,7 @@ class Agenda(Table):
         'firstname': Unicode(indexed=True, multiple=False),
         'lastname': Unicode(multiple=False),
         'email': Unicode(indexed=True, multiple=False, unique=True)}
+    sorted_indexes = ('lastname',)
 
 
 books_file = """id:0/0
@@ -331,6 +332,54 @@ class TableTestCase(TestCase):
         self.assertEqual(ids, [1])
 
 
+    def test_search_index(self):
+        agenda = Agenda(string=agenda_file)
+        agenda.add_record({'firstname': 'Karl', 'lastname': 'Popper'})
+        ids = [ x.id for x in agenda.search('firstname', 'Karl') ]
+        self.assertEqual(ids, [0, 2])
+        # Update
+        agenda.update_record(0, firstname='Friedrich')
+        ids = [ x.id for x in agenda.search('firstname', 'Karl') ]
+        self.assertEqual(ids, [2])
+        ids = [ x.id for x in agenda.search('firstname', 'Friedrich') ]
+        self.assertEqual(ids, [0])
+        # Delete
+        agenda.del_record(2)
+        self.assertEqual(agenda.search('firstname', 'Karl'), [])
+        self.assertEqual(agenda.get_n_records(), 2)
+
+
+    def test_search_index_in_place(self):
+        agenda = Agenda(string=agenda_file)
+        self.assertEqual([ x.id for x in agenda.search('firstname', 'Karl') ],
+                         [0])
+        # The old value was never indexed for this record
+        record = agenda.get_record(0)
+        record['firstname'] = Property('Jean-Jacques')
+        record['lastname'] = Property('Rousseau')
+        agenda.update_record(0, firstname='Friedrich', lastname='Engels')
+        self.assertEqual(agenda.search('firstname', 'Karl'), [])
+        ids = [ x.id for x in agenda.search('firstname', 'Jean-Jacques') ]
+        self.assertEqual(ids, [1])
+        ids = [ x.id for x in agenda.search('firstname', 'Friedrich') ]
+        self.assertEqual(ids, [0])
+        ids = [ x.id for x in agenda.search_range('lastname') ]
+        self.assertEqual(ids, [0, 1])
+
+
+    def test_search_range(self):
+        agenda = Agenda(string=agenda_file)
+        agenda.add_record({'firstname': 'Karl', 'lastname': 'Popper'})
+        agenda.add_record({'firstname': 'Albert', 'lastname': 'Camus'})
+        ids = [ x.id for x in agenda.search_range('lastname', 'D', 'Q') ]
+        self.assertEqual(ids, [0, 2])
+        ids = [ x.id for x in agenda.search_range('lastname', end='Marx') ]
+        self.assertEqual(ids, [3, 0])
+        agenda.update_record(3, lastname='Sartre')
+        ids = [ x.id for x in agenda.search_range('lastname', 'Popper') ]
+        self.assertEqual(ids, [2, 1, 3])
+
+
     def test_save(self):
         agenda = Agenda(string=agenda_file)
         agenda.save_state_to('tests/agenda')
@@ -350,6 +399,38 @@ class TableTestCase(TestCase):
         lfs.remove('tests/agenda')
 
 
+    def read_agenda(self):
+        with lfs.open('tests/agenda') as file:
+            return file.read().decode('utf-8')
+
+
+    def test_save_append(self):
+        agenda = Agenda(string=agenda_file)
+        agenda.save_state_to('tests/agenda')
+        size = len(self.read_agenda())
+        # Change: the changes are appended
+        agenda = Agenda('tests/agenda')
+        agenda.add_record({'firstname': 'Albert', 'lastname': 'Einstein'})
+        agenda.add_record({'firstname': 'Toto', 'lastname': 'Fofo'})
+        agenda.update_record(0, lastname='Engels')
+        agenda.del_record(3)
+        agenda.save_state()
+        data = self.read_agenda()
+        self.assertTrue(len(data) > size)
+        self.assertTrue('id:3/DELETED' in data)
+        # Test
+        expected = agenda.to_str()
+        agenda = Agenda('tests/agenda')
+        self.assertEqual(agenda.to_str(), expected)
+        self.assertEqual(agenda.get_n_records(), 3)
+        # Compact: the deleted records are removed
+        agenda.del_record(1)
+        agenda.save_state()
+        data = self.read_agenda()
+        self.assertTrue('DELETED' not in data)
+        self.assertEqual(Agenda('tests/agenda').to_str(), data)
+
+
     def test_unique(self):
         agenda = Agenda(string=agenda_file)
         email = 'karl@itaapy.com'
@@ -0,0 +1,297 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from os import mkdir, remove, walk
+from os.path import exists, relpath
+from shutil import copy2, copytree, rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from pygit2
+from pygit2 import Repository, init_repository
+
+# Import from itools
+from itools.database.git import open_worktree
+
+
+class GitTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        repo = init_repository(self.path)
+        repo.config['user.name'] = 'Test'
+        repo.config['user.email'] = 'test@example.com'
+        mkdir(f'{self.path}/folder')
+        self.n = 0
+        self.worktree = open_worktree(self.path)
+        self.worktrees = [self.worktree]
+
+    def tearDown(self):
+        for worktree in self.worktrees:
+            history = worktree.history
+            if history.thread is not None:
+                history.thread.join()
+        rmtree(self.path)
+
+    def open_worktree(self, path=None, spawn_git=False):
+        worktree = open_worktree(path or self.path)
+        worktree.spawn_git = spawn_git
+        self.worktrees.append(worktree)
+        return worktree
+
+    def write(self, *names):
+        self.n += 1
+        for name in names:
+            with open(f'{self.path}/{name}', 'w') as f:
+                f.write(f'{self.n} {name}\n')
+
+    def commit(self, *names):
+        worktree = self.worktree
+        self.write(*names)
+        worktree.git_add(*names)
+        worktree.git_commit(f'change {", ".join(names)}')
+
+    def make_history(self, n):
+        for i in range(n):
+            names = ['a.metadata'] if i % 2 else ['b.metadata']
+            if i % 5 == 0:
+                names.append('folder/c.metadata')
+            self.commit(*names)
+
+
+
+###########################################################################
+# Worktree
+###########################################################################
+class WorktreeTestCase(GitTestCase):
+
+    def get_files(self, path):
+        """Return the files of the working tree and of the index file.
+        """
+        files = {}
+        for root, folders, names in walk(path):
+            if '.git' in folders:
+                folders.remove('.git')
+            for name in names:
+                name = relpath(f'{root}/{name}', path)
+                with open(f'{path}/{name}', 'rb') as f:
+                    files[name] = f.read()
+        index = [(x.path, str(x.id)) for x in Repository(path).index]
+        return files, sorted(index)
+
+    def test_diff(self):
+        self.make_history(6)
+        worktree = self.worktree
+        spawn = self.open_worktree(spawn_git=True)
+        for args in [('HEAD~3', 'HEAD', None), ('HEAD~3', 'HEAD', ['folder']),
+                     ('HEAD~3', 'HEAD', ['a.metadata', 'folder']),
+                     ('HEAD', None, None), ('HEAD~5', None, None)]:
+            diff = worktree.git_diff(*args)
+            self.assertTrue(diff)
+            self.assertEqual(diff, spawn.git_diff(*args))
+            self.assertEqual(b''.join(worktree.iter_diff(*args)), diff)
+            self.assertEqual(b''.join(spawn.iter_diff(*args)), diff)
+            self.assertEqual(worktree.git_stats(*args), spawn.git_stats(*args))
+        # Nothing changed
+        args = 'HEAD~3', 'HEAD', ['missing']
+        self.assertEqual(worktree.git_diff(*args), b'')
+        self.assertEqual(worktree.git_stats(*args), spawn.git_stats(*args))
+        # The files changed
+        for since, until in ('HEAD~3', 'HEAD'), ('HEAD~1', 'HEAD'):
+            files = worktree.get_files_changed(since, until)
+            self.assertEqual(files, spawn.get_files_changed(since, until))
+        self.assertEqual(worktree.get_files_changed('HEAD~5', 'HEAD'),
+                         {'a.metadata', 'b.metadata', 'folder/c.metadata'})
+
+    def test_reset(self):
+        self.make_history(6)
+        path = mkdtemp()
+        self.addCleanup(rmtree, path)
+        path = f'{path}/copy'
+        copytree(self.path, path)
+        spawn = self.open_worktree(path, spawn_git=True)
+        # A change not committed, in the index file
+        self.write('d.metadata')
+        copy2(f'{self.path}/d.metadata', f'{path}/d.metadata')
+        for worktree in self.worktree, spawn:
+            worktree.git_add('d.metadata')
+            worktree.index.write()
+            worktree.git_reset('HEAD~2')
+        self.assertEqual(Repository(self.path).head.target,
+                         Repository(path).head.target)
+        self.assertEqual(self.get_files(self.path), self.get_files(path))
+        # The index in memory is the index reset
+        self.assertNotIn('d.metadata', self.worktree.index)
+        self.assertNotIn('d.metadata', spawn.index)
+
+    def test_cache(self):
+        worktree = self.worktree
+        worktree.cache_blobs_size = 100
+        worktree.cache_blob_max_size = 60
+        names = {'a': 40, 'b': 40, 'c': 40, 'd': 80}
+        for name, size in names.items():
+            with open(f'{self.path}/{name}', 'w') as f:
+                f.write(name * size)
+        worktree.git_add(*names)
+        worktree.git_commit('blobs')
+        tree = worktree.lookup(worktree.get_metadata()['tree'])
+        shas = {x.name: str(x.id) for x in tree}
+
+        # The trees and the blobs are kept apart
+        self.assertIs(worktree.lookup(tree.id), tree)
+        self.assertIsNone(worktree.blobs_cache.get(str(tree.id)))
+        blob = worktree.lookup(shas['a'])
+        self.assertIs(worktree.lookup(shas['a']), blob)
+        # The least recently used blob is removed, by size
+        worktree.lookup(shas['b'])
+        worktree.lookup(shas['a'])
+        worktree.lookup(shas['c'])
+        blobs_cache = worktree.blobs_cache
+        self.assertIsNone(blobs_cache.get(shas['b']))
+        self.assertIsNotNone(blobs_cache.get(shas['a']))
+        self.assertIsNotNone(blobs_cache.get(shas['c']))
+        # Too big
+        self.assertEqual(worktree.lookup(shas['d']).size, 80)
+        self.assertIsNone(blobs_cache.get(shas['d']))
+        self.assertEqual(worktree.get_cache_stats()['bytes'], 80)
+
+    def test_make_tree(self):
+        worktree = self.worktree
+        self.assertIsNone(worktree.make_tree(['a.metadata'], []))
+        self.make_history(3)
+        mkdir(f'{self.path}/folder/sub')
+        steps = [
+            (['folder/d.metadata', 'folder/sub/e.metadata', 'a.metadata'],
+             ['b.metadata']),
+            ([], ['folder/sub/e.metadata', 'folder/c.metadata']),
+            ([], ['folder/d.metadata', 'missing.metadata'])]
+        for added, removed in steps:
+            self.write(*added)
+            worktree.git_add(*added)
+            worktree.git_rm(*removed)
+            tree = worktree.make_tree(added, removed)
+            self.assertEqual(tree, worktree.index.write_tree())
+            worktree.git_commit('change', tree=tree)
+        # The same tree by the git command
+        tree = worktree.lookup(tree)
+        self.assertEqual([x.name for x in tree], ['a.metadata'])
+        worktree.write_index()
+        data = worktree._call(['git', 'write-tree'])
+        self.assertEqual(data.decode().strip(), str(tree.id))
+
+    def test_write_index(self):
+        worktree = self.worktree
+        self.make_history(1)
+        worktree.index_write_interval = 3
+        spawn = self.open_worktree(spawn_git=True)
+        ls_files = lambda: spawn._call(['git', 'ls-files']).decode().split()
+        for name in 'd', 'e', 'f', 'g':
+            name = f'{name}.metadata'
+            self.write(name)
+            worktree.git_add(name)
+            worktree.git_commit(name, tree=worktree.make_tree([name], []))
+            if name == 'e.metadata':
+                # Not written yet
+                self.assertEqual(worktree.index_changes, 2)
+                self.assertNotIn('d.metadata', ls_files())
+                self.assertIn('e.metadata', worktree.index)
+            elif name == 'f.metadata':
+                self.assertEqual(worktree.index_changes, 0)
+                self.assertIn('f.metadata', ls_files())
+        self.assertNotIn('g.metadata', ls_files())
+        worktree.write_index()
+        self.assertIn('g.metadata', ls_files())
+        # The index file is the tree of the last commit
+        head = worktree.get_metadata()['tree']
+        self.assertEqual(spawn._call(['git', 'write-tree']).decode().strip(),
+                         head)
+
+
+
+###########################################################################
+# History index
+###########################################################################
+class HistoryIndexTestCase(GitTestCase):
+
+    def assert_log(self, paths):
+        """The log given with the index has the commits given by walking
+        the history (when the reference is not HEAD).  The commits made in
+        the same second may be in another order, they are compared by SHA.
+        """
+        worktree = self.worktree
+        head = str(worktree._resolve_reference('HEAD'))
+        expected = worktree.git_log(paths, reference=head)
+        expected = sorted(x['sha'] for x in expected)
+        log = worktree.git_log(paths)
+        self.assertEqual(sorted(x['sha'] for x in log), expected)
+        self.assertEqual(worktree.git_log(paths, n=2), log[:2])
+        self.assertEqual(worktree.git_log(paths, reverse=True), log[::-1])
+        return log
+
+    def test_git_log(self):
+        self.make_history(12)
+        history = self.worktree.history
+        self.assertIsNotNone(history.get_commits(['a.metadata']))
+        self.assertEqual(len(self.assert_log(['a.metadata'])), 6)
+        self.assertEqual(len(self.assert_log(['folder'])), 3)
+        self.assertEqual(len(self.assert_log(['folder/c.metadata'])), 3)
+        self.assertEqual(len(self.assert_log(['a.metadata', 'folder'])), 8)
+        self.assertEqual(self.assert_log(['missing']), [])
+
+    def test_build(self):
+        self.make_history(10)
+        history = self.worktree.history
+        # Too many commits to add on use, the index is to be built
+        history.max_update = 0
+        builds = []
+        history.build = lambda: builds.append(True)
+        self.commit('a.metadata')
+        self.assertEqual(builds, [True])
+        self.assertIsNone(history.get_commits(['a.metadata']))
+        self.assert_log(['a.metadata'])
+        # Built in the background
+        del history.build
+        history.build()
+        history.thread.join()
+        self.assertIsNotNone(history.get_commits(['a.metadata']))
+        self.assert_log(['a.metadata'])
+
+    def test_read_only(self):
+        self.make_history(4)
+        history = self.worktree.history
+        history.connection.close()
+        remove(history.path)
+        worktree = open_worktree(self.path, read_only=True)
+        self.assertIsNone(worktree.history)
+        log = worktree.git_log(['a.metadata'])
+        self.assertEqual(len(log), 2)
+        # Nothing written in the repository
+        self.assertFalse(exists(f'{self.path}/.git/itools_history.sqlite'))
+
+    def test_reset(self):
+        self.make_history(10)
+        worktree = self.worktree
+        worktree.git_reset('HEAD~3')
+        history = worktree.history
+        self.assertIsNone(history.get_commits(['a.metadata']))
+        history.thread.join()
+        self.assertIsNotNone(history.get_commits(['a.metadata']))
+        self.assertEqual(len(self.assert_log(['b.metadata'])), 4)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from os import listdir, remove, rename
+from shutil import copytree, rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from pygit2
+from pygit2 import Repository, init_repository
+
+# Import from itools
+from itools.database import Field, Metadata, Resource, RWDatabase
+from itools.database import get_register_fields
+from itools.database.backends.git import GitBackend, GitCommitter
+from itools.database.backends.git import GroupCommitter
+from itools.database.git import open_worktree
+from itools.datatypes import String, Unicode
+from itools.fs import lfs
+
+
+class Document(Resource):
+
+    class_id = 'test-git-backend-document'
+    class_version = '20260101'
+
+    abspath = Field(datatype=String(indexed=True, stored=True),
+                    indexed=True, stored=True)
+    title = Field(datatype=Unicode(indexed=True, stored=True),
+                  indexed=True, stored=True)
+
+    # The abspaths of the resources that fail to be indexed, and those
+    # indexed
+    fail = set()
+    indexed = []
+
+    def __init__(self, abspath, database, metadata=None, brain=None):
+        self.abspath = abspath
+        self.database = database
+        self.metadata = metadata
+
+    def traverse_resources(self):
+        yield self
+        if str(self.abspath) != '/':
+            return
+        database = self.database
+        for name in sorted(database.get_handler_names('')):
+            if name.endswith('.metadata') and name != '.metadata':
+                yield database.get_resource(f'/{name[:-9]}')
+
+    def get_catalog_values(self):
+        abspath = str(self.abspath)
+        if abspath in self.fail:
+            raise RuntimeError(f'cannot index {abspath}')
+        self.indexed.append(abspath)
+        title = self.metadata.get_property('title')
+        return {
+            'abspath': abspath,
+            'title': title.value if title else None}
+
+
+class PatchsBackend:
+    """The part of the patches API used by the committers.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def get_changed_keys(self, since):
+        return set(self.keys)
+
+
+class Backend:
+    """The part of the git backend API used by the committers.
+    """
+
+    def __init__(self, path, keys=()):
+        self.path_data = f'{path}/'
+        self.worktree = open_worktree(path)
+        self.patchs_backend = PatchsBackend(keys)
+        self.fs = lfs.open(path)
+
+    def get_handler_fs_by_key(self, key):
+        return self.fs
+
+    do_git_transaction = GitBackend.do_git_transaction
+
+
+class GitBackendTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        repo = init_repository(self.path)
+        repo.config['user.name'] = 'Test'
+        repo.config['user.email'] = 'test@example.com'
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def write(self, *names):
+        for name in names:
+            with open(f'{self.path}/{name}', 'w') as f:
+                f.write(f'{name}\n')
+
+    def get_head(self):
+        repo = Repository(self.path)
+        return repo[repo.head.target]
+
+    def get_names(self):
+        return sorted(x.name for x in self.get_head().tree)
+
+    def join(self, worktree):
+        # The history index may be built in the background
+        thread = worktree.history.thread
+        if thread is not None:
+            thread.join()
+
+    def commit(self, *names):
+        self.write(*names)
+        worktree = open_worktree(self.path)
+        worktree.git_add(*names)
+        worktree.git_commit('First')
+        self.join(worktree)
+
+
+
+###########################################################################
+# The catalog
+###########################################################################
+class CatalogTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        GitBackend.init_backend(self.path, get_register_fields())
+        repo = Repository(f'{self.path}/database')
+        repo.config['user.name'] = 'Test'
+        repo.config['user.email'] = 'test@example.com'
+        database = RWDatabase(self.path, 100, 200, backend='git')
+        for name in '', 'a', 'b', 'c':
+            metadata = Metadata(cls=Document)
+            metadata.set_property('title', f'Title {name}')
+            database.set_handler(f'{name}.metadata', metadata)
+        database.save_changes()
+        database.close()
+        Document.fail = set()
+        Document.indexed = []
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def open_database(self):
+        return RWDatabase(self.path, 100, 200, backend='git')
+
+    def get_abspaths(self, database, **kw):
+        results = database.search(**kw)
+        return sorted(x.abspath for x in results.get_documents())
+
+    def test_rebuild(self):
+        with self.open_database() as database:
+            # Interrupted
+            Document.fail = {'/b'}
+            self.assertRaises(RuntimeError, database.rebuild_catalog,
+                              checkpoint=1)
+            self.assertEqual(Document.indexed, ['/', '/a'])
+            self.assertEqual(database.catalog._db.get_doccount(), 0)
+        self.assertIn('catalog.rebuild', listdir(self.path))
+
+        with self.open_database() as database:
+            # Resumed, the resources indexed are skipped
+            Document.fail = set()
+            Document.indexed = []
+            self.assertEqual(database.rebuild_catalog(checkpoint=1), 4)
+            self.assertEqual(Document.indexed, ['/b', '/c'])
+            self.assertEqual(self.get_abspaths(database),
+                             ['/', '/a', '/b', '/c'])
+            self.assertEqual(self.get_abspaths(database, abspath='/a'),
+                             ['/a'])
+        names = listdir(self.path)
+        self.assertNotIn('catalog.rebuild', names)
+        self.assertNotIn('catalog.old', names)
+
+    def test_group_commit(self):
+        group_commit = GitBackend.group_commit
+        GitBackend.group_commit = True
+        try:
+            database = self.open_database()
+        finally:
+            GitBackend.group_commit = group_commit
+        committer = database.backend.committer
+        committer.delay = 3600
+        metadata = Metadata(cls=Document)
+        metadata.set_property('title', 'Title d')
+        database.set_handler('d.metadata', metadata)
+        database.save_changes()
+        # Committed on close, before the index file is written
+        database.close()
+        self.assertFalse(committer.thread.is_alive())
+        repo = Repository(f'{self.path}/database')
+        tree = repo[repo.head.target].tree
+        self.assertIn('d.metadata', tree)
+        self.assertIn('d.metadata', repo.index)
+
+    def test_recover_swap(self):
+        with self.open_database() as database:
+            database.rebuild_catalog()
+        catalog = f'{self.path}/catalog'
+
+        # Interrupted after the current catalog was renamed
+        copytree(catalog, f'{catalog}.rebuild')
+        rename(catalog, f'{catalog}.old')
+        with self.open_database() as database:
+            self.assertEqual(len(database.search()), 4)
+        names = listdir(self.path)
+        self.assertIn('catalog', names)
+        self.assertNotIn('catalog.rebuild', names)
+        self.assertNotIn('catalog.old', names)
+
+        # Interrupted before the old catalog was removed
+        copytree(catalog, f'{catalog}.old')
+        with self.open_database() as database:
+            self.assertEqual(len(database.search()), 4)
+        self.assertNotIn('catalog.old', listdir(self.path))
+
+        # The old catalog alone
+        rename(catalog, f'{catalog}.old')
+        with self.open_database() as database:
+            self.assertEqual(len(database.search()), 4)
+        self.assertEqual(
+            sorted(x for x in listdir(self.path) if x.startswith('catalog')),
+            ['catalog'])
+
+
+
+###########################################################################
+# Group commit
+###########################################################################
+class GroupCommitterTestCase(GitBackendTestCase):
+
+    def stop(self, committer):
+        committer.stop()
+        self.join(committer.backend.worktree)
+
+    def test_wait(self):
+        self.commit('a.metadata')
+        committer = GroupCommitter(Backend(self.path), delay=0)
+        try:
+            self.write('b.metadata', 'c.metadata')
+            committer.put((None, None, 'B', [], []), ['b.metadata'])
+            committer.put((None, None, 'C', [], []), ['c.metadata', 'c.txt'])
+            committer.wait()
+            self.assertEqual(self.get_names(),
+                             ['a.metadata', 'b.metadata', 'c.metadata'])
+            self.assertEqual(committer.nb_transactions, 2)
+        finally:
+            self.stop(committer)
+
+    def test_stop(self):
+        self.commit('a.metadata')
+        committer = GroupCommitter(Backend(self.path), delay=3600)
+        self.write('b.metadata')
+        committer.put((None, None, 'B', [], []), ['b.metadata'])
+        remove(f'{self.path}/a.metadata')
+        committer.put((None, None, 'A', [], []), ['a.metadata'])
+        # The transactions queued are committed first, in one commit
+        self.stop(committer)
+        self.assertFalse(committer.thread.is_alive())
+        commit = self.get_head()
+        self.assertEqual(commit.message, 'B\nA')
+        self.assertEqual(self.get_names(), ['b.metadata'])
+        self.assertEqual(committer.nb_batches, 1)
+        self.assertRaises(RuntimeError, committer.put,
+                          (None, None, 'C', [], []), ['c.metadata'])
+
+    def test_crash(self):
+        self.commit('a.metadata')
+        committer = GroupCommitter(Backend(self.path), delay=3600)
+        self.write('b.metadata', 'c.metadata')
+        committer.put((None, None, 'B', [], []), ['b.metadata'])
+        # Stopped before the commit, the queue is lost
+        with committer.condition:
+            committer.queue.clear()
+            committer.stopped = True
+            committer.condition.notify_all()
+        committer.thread.join()
+        self.join(committer.backend.worktree)
+        self.assertEqual(self.get_names(), ['a.metadata'])
+
+        # The keys changed since the last commit are recovered on start
+        keys = ['a.metadata', 'b.metadata', 'c.metadata', 'd.metadata']
+        committer = GroupCommitter(Backend(self.path, keys), delay=3600)
+        self.assertEqual(committer.queue[0][1], {'b.metadata', 'c.metadata'})
+        self.stop(committer)
+        self.assertEqual(self.get_names(),
+                         ['a.metadata', 'b.metadata', 'c.metadata'])
+        # Nothing more
+        committer = GroupCommitter(Backend(self.path, keys), delay=3600)
+        self.assertEqual(committer.queue, [])
+        self.stop(committer)
+
+    def test_crash_empty(self):
+        # No commit yet: the files of the working tree are recovered
+        self.write('a.metadata', 'b.metadata', 'b.txt')
+        committer = GroupCommitter(Backend(self.path), delay=0)
+        self.stop(committer)
+        self.assertEqual(self.get_names(), ['a.metadata', 'b.metadata'])
+
+
+
+###########################################################################
+# The committer process (TEST_DB_WITHOUT_COMMITS)
+###########################################################################
+class GitCommitterTestCase(GitBackendTestCase):
+
+    def test_empty(self):
+        # No commit yet: every file is committed on start
+        self.write('a.metadata', 'b.metadata')
+        committer = GitCommitter(Backend(self.path), interval=3600)
+        committer.stop(timeout=60)
+        self.assertIsNone(committer.process)
+        commit = self.get_head()
+        self.assertEqual(commit.message, 'Autocommit')
+        self.assertEqual(sorted(x.name for x in commit.tree),
+                         ['a.metadata', 'b.metadata'])
+
+    def test_keys(self):
+        self.write('a.metadata')
+        worktree = open_worktree(self.path)
+        worktree.git_add('a.metadata')
+        worktree.git_commit('First')
+        # The keys changed since the last commit are recovered, the keys
+        # sent are committed when stopped
+        self.write('b.metadata', 'c.metadata', 'd.metadata')
+        committer = GitCommitter(Backend(self.path, ['b.metadata']),
+                                 interval=3600)
+        committer.put(['c.metadata', 'c.txt'])
+        committer.stop(timeout=60)
+        commit = self.get_head()
+        self.assertEqual(commit.message, 'Autocommit')
+        self.assertEqual(sorted(x.name for x in commit.tree),
+                         ['a.metadata', 'b.metadata', 'c.metadata'])
+        stats = committer.get_stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['restarts'], 0)
+
+    def test_restart(self):
+        self.write('a.metadata')
+        committer = GitCommitter(Backend(self.path), interval=3600)
+        committer.process.kill()
+        committer.process.join()
+        # Restarted on use
+        self.write('b.metadata')
+        committer.put(['b.metadata'])
+        self.assertEqual(committer.restarts, 1)
+        committer.stop(timeout=60)
+        self.assertEqual(sorted(x.name for x in self.get_head().tree),
+                         ['a.metadata', 'b.metadata'])
+
+
+
+if __name__ == '__main__':
+    main()
@@ -18,11 +18,13 @@
 
 # Import from the Standard Library
 from decimal import Decimal
-from unittest import TestCase, main
+from unittest import TestCase, main, skipIf
+from unittest.mock import patch
 
 # Import from itools
 from itools.i18n import is_similar, get_most_similar, guess_language
-from itools.i18n import AcceptLanguageType, format_number
+from itools.i18n import AcceptLanguageType, format_number, get_sort_key
+from itools.i18n import collation
 
 
 
@@ -313,5 +315,54 @@ class FormatNumberTestCase(TestCase):
 
 
 
+############################################################################
+# Collation
+############################################################################
+class SortKeyTestCase(TestCase):
+
+    def sort(self, words, language=None):
+        return sorted(words, key=lambda x: get_sort_key(x, language))
+
+    def test_accents_and_case(self):
+        words = ['Zoo', 'été', 'apple', 'école', 'ete', 'Émile', 'zèbre']
+        words = self.sort(words)
+        self.assertEqual(words[0], 'apple')
+        self.assertEqual(words[-2:], ['zèbre', 'Zoo'])
+        self.assertLess(get_sort_key('ete'), get_sort_key('été'))
+        self.assertLess(get_sort_key('ete'), get_sort_key('Ete'))
+
+
+    def test_swedish(self):
+        words = ['öl', 'zebra', 'ål', 'apa']
+        self.assertEqual(self.sort(words, 'sv'), ['apa', 'zebra', 'ål', 'öl'])
+        self.assertEqual(self.sort(words), ['ål', 'apa', 'öl', 'zebra'])
+
+
+    def test_spanish(self):
+        words = ['oso', 'ñu', 'nube']
+        self.assertEqual(self.sort(words, 'es'), ['nube', 'ñu', 'oso'])
+        self.assertEqual(self.sort(words), ['ñu', 'nube', 'oso'])
+
+
+    def test_fallback(self):
+        # The same order without ICU
+        with patch.object(collation, 'Collator', None), \
+             patch.dict(collation._collators, clear=True):
+            self.test_accents_and_case()
+            self.test_swedish()
+            self.test_spanish()
+            self.assertIsInstance(get_sort_key('été', 'sv'), bytes)
+
+
+    @skipIf(collation.Collator is None, 'PyICU is not installed')
+    def test_icu(self):
+        words = ['Zoo', 'été', 'apple', 'école', 'ete', 'Émile', 'zèbre']
+        with patch.object(collation, 'Collator', None), \
+             patch.dict(collation._collators, clear=True):
+            expected = self.sort(words)
+        self.assertEqual(self.sort(words), expected)
+
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,273 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from os import utime
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from itools
+from itools.database import Resource
+from itools.database.metadata import Metadata, DefaultField
+from itools.database.metadata_parser import get_tokens, read_name
+from itools.database.metadata_parser import parse_table, split_line
+from itools.database.sharedcache import MetadataCache, get_blob_id
+from itools.datatypes import String, Unicode
+
+
+class Document(Resource):
+
+    class_id = 'test-metadata-document'
+    class_version = '20260101'
+
+    name = DefaultField(datatype=String, multiple=False)
+    tags = DefaultField(datatype=String, multiple=True)
+    title = DefaultField(datatype=Unicode, multilingual=True, multiple=False,
+                         parameters_schema={'lang': String})
+
+
+class Database:
+    """The part of the database API used by the metadata handlers.
+    """
+
+    def __init__(self, files):
+        self.files = files
+
+    def get_handler_data(self, key, text=False):
+        return self.files[key]
+
+    def get_handler_mtime(self, key):
+        return 1
+
+    def normalize_key(self, key):
+        return key
+
+    def get_resource_class(self, class_id):
+        return Document
+
+    def touch_handler(self, key, handler):
+        pass
+
+
+data = (
+    'format;version=20260101:test-metadata-document\n'
+    'name:hello\n'
+    'tags:a\n'
+    'tags:b\n'
+    'title;lang=en:Hello\n'
+    'title;lang=fr:Bonjour\n')
+
+
+def load_metadata(data=data):
+    database = Database({'a.metadata': data})
+    return Metadata(key='a.metadata', database=database, cls=Document)
+
+
+
+###########################################################################
+# Parser
+###########################################################################
+class ParserTestCase(TestCase):
+
+    def test_split_line(self):
+        lines = [
+            'name:value',
+            'name:',
+            'name:a:b',
+            'name-x:value',
+            'name_x:value',
+            'name.x@y:value',
+            'title;lang=en:Hello',
+            'title;lang=en;dc-x=a,b:Hello',
+            'title;lang=:Hello',
+            'title;lang=en,fr:Hello',
+            'name:a\\nb\\rc',
+            'name:a\\\\b',
+            'name:été']
+        for line in lines:
+            name, rest = read_name(line)
+            value, parameters = get_tokens(rest)
+            self.assertEqual(split_line(line), (name, value, parameters))
+
+    def test_split_line_fallback(self):
+        # Lines left to the full parser
+        lines = [
+            'title;lang="en":Hello',
+            'title;lang="a:b":Hello',
+            ':value',
+            '-name:value',
+            'name',
+            'na/me:value',
+            'title;lang:Hello',
+            'title;-lang=en:Hello']
+        for line in lines:
+            self.assertEqual(split_line(line), None)
+
+    def test_parse_table(self):
+        data = (
+            'name:hello\n'
+            'title;lang="en":Hello\n'
+            ' World\n'
+            'title;lang=fr:Bonjour\n')
+        self.assertEqual(list(parse_table(data)), [
+            ('name', 'hello', {}),
+            ('title', 'HelloWorld', {'lang': ['en']}),
+            ('title', 'Bonjour', {'lang': ['fr']})])
+        self.assertEqual(list(parse_table(data, raw=True))[1],
+            ('title', 'HelloWorld', {'lang': ['en']},
+             'title;lang="en":Hello\n World\n'))
+
+
+
+###########################################################################
+# Metadata
+###########################################################################
+class MetadataTestCase(TestCase):
+
+    def test_lazy(self):
+        metadata = load_metadata()
+        self.assertEqual(set(metadata._raw), {'name', 'tags', 'title'})
+        self.assertEqual(metadata.get_property('name').value, 'hello')
+        self.assertEqual(set(metadata._raw), {'tags', 'title'})
+        self.assertEqual(metadata.get_property('title', 'fr').value,
+                         'Bonjour')
+        self.assertEqual(set(metadata._raw), {'tags'})
+        self.assertEqual(metadata.to_str(), data)
+
+    def test_not_lazy(self):
+        metadata = Metadata(database=Database({}), cls=Document)
+        metadata.lazy_decoding = False
+        metadata.load_state_from_string(data)
+        self.assertEqual(metadata._raw, {})
+        self.assertEqual([x.value for x in metadata.get_property('tags')],
+                         ['a', 'b'])
+
+    def test_get_changes(self):
+        metadata = load_metadata()
+        self.assertEqual(metadata.get_changes(), None)
+        metadata.set_property('name', 'world')
+        metadata.del_property('tags')
+        self.assertEqual(metadata.get_changes(), {
+            'name': ('name:hello\n', 'name:world\n'),
+            'tags': ('tags:a\ntags:b\n', None)})
+
+    def test_get_changes_in_place(self):
+        metadata = load_metadata()
+        property = metadata.get_property('title', 'fr')
+        metadata.set_changed()
+        property.value = 'Salut'
+        self.assertEqual(metadata.get_changes(), {
+            'title': ('title;lang=en:Hello\ntitle;lang=fr:Bonjour\n',
+                      'title;lang=en:Hello\ntitle;lang=fr:Salut\n')})
+        self.assertIn('title;lang=fr:Salut\n', metadata.to_str())
+
+    def test_get_changes_serialization(self):
+        # Written otherwise, the same values
+        metadata = load_metadata(
+            'format;version=20260101:test-metadata-document\n'
+            'name:hel\n'
+            ' lo\n'
+            'title;lang="en":Hello\n')
+        metadata.get_property('name')
+        metadata.get_property('title', 'en')
+        metadata.set_property('tags', ['a'])
+        self.assertEqual(metadata.get_changes(),
+                         {'tags': (None, 'tags:a\n')})
+
+    def test_get_changes_none(self):
+        metadata = load_metadata()
+        metadata.get_property('name')
+        metadata.set_changed()
+        self.assertEqual(metadata.get_changes(), {})
+
+
+
+###########################################################################
+# Binary state
+###########################################################################
+class BinaryStateTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def test_dump_load(self):
+        metadata = load_metadata()
+        state = metadata.dump_state()
+        self.assertIsInstance(state, bytes)
+
+        copy = Metadata(database=Database({}), cls=Document)
+        copy.load_state_from_binary(state)
+        self.assertEqual(copy.format, metadata.format)
+        self.assertEqual(copy.version, metadata.version)
+        self.assertEqual(copy.to_str(), data)
+        self.assertEqual(copy.get_property('title', 'en').value, 'Hello')
+        self.assertEqual([x.value for x in copy.get_property('tags')],
+                         ['a', 'b'])
+
+    def test_dump_decoded(self):
+        metadata = load_metadata()
+        metadata.get_property('name')
+        self.assertEqual(metadata.dump_state(), None)
+
+    def test_load_bad_version(self):
+        metadata = load_metadata()
+        state = metadata.dump_state()
+        copy = Metadata(database=Database({}), cls=Document)
+        copy.binary_version = metadata.binary_version + 1
+        self.assertRaises(ValueError, copy.load_state_from_binary, state)
+
+    def test_metadata_cache(self):
+        cache = MetadataCache(f'{self.path}/metadata_cache')
+        sha = get_blob_id(data)
+        copy = Metadata(database=Database({}), cls=Document)
+        self.assertEqual(cache.load(copy, sha), False)
+        cache.save(load_metadata(), sha)
+        copy = Metadata(database=Database({}), cls=Document)
+        self.assertEqual(cache.load(copy, sha), True)
+        self.assertEqual(copy.to_str(), data)
+        # Prune
+        self.assertEqual(cache.prune({sha}), 0)
+        self.assertEqual(cache.prune(set()), 1)
+        self.assertEqual(cache.load(copy, sha), False)
+
+    def test_metadata_cache_size(self):
+        cache = MetadataCache(f'{self.path}/metadata_cache')
+        metadata = load_metadata()
+        size = len(metadata.dump_state())
+        cache.size_min = 2 * size
+        cache.size_max = 3 * size
+        cache.check_interval = 4
+        shas = [get_blob_id(f'{data}name:{i}\n') for i in range(4)]
+        for sha in shas[:3]:
+            cache.save(metadata, sha)
+        # The first version used, it is kept
+        utime(cache._get_path(shas[1]), (0, 0))
+        utime(cache._get_path(shas[2]), (0, 0))
+        copy = Metadata(database=Database({}), cls=Document)
+        self.assertEqual(cache.load(copy, shas[0]), True)
+        # Pruned on write, the least recently used first
+        cache.save(metadata, shas[3])
+        copy = Metadata(database=Database({}), cls=Document)
+        loaded = [cache.load(copy, sha) for sha in shas]
+        self.assertEqual(loaded, [True, False, False, True])
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from datetime import datetime, timedelta
+from os import listdir, makedirs
+from os.path import exists
+from shutil import rmtree
+from sqlite3 import OperationalError
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from itools
+from itools.database.backends.patchs import PatchsBackend
+from itools.fs import lfs
+
+
+class Handler:
+    """The part of the metadata handler API used by the patches.
+    """
+
+    def __init__(self, data, changes=None):
+        self.data = data
+        self.changes = changes
+
+    def to_str(self):
+        return self.data
+
+    def get_changes(self):
+        return self.changes
+
+
+class PatchsBackendTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        makedirs(f'{self.path}/database/.git')
+        self.fs = lfs.open(f'{self.path}/database')
+        self.backend = PatchsBackend(self.path, self.fs, False)
+
+    def tearDown(self):
+        self.backend.close()
+        rmtree(self.path)
+
+    def get_patches(self, **kw):
+        return [
+            (author, keys, changes)
+            for the_time, author, keys, changes
+            in self.backend.get_patches(**kw) ]
+
+    def test_create_patch(self):
+        backend = self.backend
+        since = datetime.now()
+        handler = Handler('format:a\ntitle:A\n')
+        backend.create_patch(['a.metadata', 'a.txt'], [], [],
+                             {'a.metadata': handler}, (1, 'a@example.com'))
+        changes = {'title': ('title:A\n', 'title:B\n')}
+        handler = Handler('format:a\ntitle:B\n', changes)
+        backend.create_patch([], ['a.metadata'], [],
+                             {'a.metadata': handler}, (2, 'b@example.com'))
+        # Nothing to record
+        backend.create_patch(['a.txt'], [], [], {}, (2, 'b@example.com'))
+
+        self.assertEqual(self.get_patches(), [
+            ('1', ['a.metadata'],
+             [{'key': 'a.metadata', 'op': 'add',
+               'new': 'format:a\ntitle:A\n'}]),
+            ('2', ['a.metadata'],
+             [{'key': 'a.metadata', 'op': 'change',
+               'properties': {'title': ['title:A\n', 'title:B\n']}}])])
+        self.assertEqual(len(self.get_patches(author=2)), 1)
+        self.assertEqual(len(self.get_patches(key='a.metadata')), 2)
+        self.assertEqual(self.get_patches(key='b.metadata'), [])
+        self.assertEqual(self.get_patches(since=datetime.now()), [])
+        self.assertEqual(backend.get_changed_keys(since), {'a.metadata'})
+        self.assertEqual(backend.get_changed_keys(datetime.now()), set())
+
+    def test_diff(self):
+        with self.fs.make_file('a.metadata') as f:
+            f.write(b'format:a\ntitle:A\n')
+        # The changes are not known, or none found: a diff is given
+        for changes in None, {}:
+            handler = Handler('format:a\ntitle:B\n', changes)
+            self.backend.create_patch([], ['a.metadata'], [],
+                                      {'a.metadata': handler}, (None, None))
+        patches = self.get_patches()
+        self.assertEqual(len(patches), 2)
+        for author, keys, changes in patches:
+            self.assertEqual(author, None)
+            self.assertEqual(keys, ['a.metadata'])
+            diff = changes[0]['diff']
+            self.assertIn('-title:A\n', diff)
+            self.assertIn('+title:B\n', diff)
+
+    def test_synchronous(self):
+        backend = self.backend
+        backend.synchronous = True
+        handler = Handler('format:a\n')
+        backend.create_patch(['a.metadata'], [], [], {'a.metadata': handler},
+                             (None, None))
+        # Written by create_patch, not by the writer thread
+        self.assertEqual(backend.queue.unfinished_tasks, 0)
+        connection = backend._get_connection()
+        cursor = connection.execute('SELECT key FROM keys')
+        self.assertEqual(cursor.fetchall(), [('a.metadata',)])
+
+    def test_rotate(self):
+        backend = self.backend
+        old = datetime.now() - backend.rotate_interval - timedelta(days=2)
+        old = old.replace(hour=12)
+        records = [
+            (old, 'a', ['a.metadata'], b'a'),
+            (old + timedelta(seconds=1), 'b', ['b.metadata'], b'b'),
+            (datetime.now(), 'c', ['c.metadata'], b'c')]
+        for record in records:
+            backend._write(*record)
+        old_segment = old.strftime('%Y%m%d')
+        new_segment = datetime.now().strftime('%Y%m%d')
+        segments_path = backend.segments_path
+        self.assertTrue(exists(f'{segments_path}/{old_segment}.log'))
+
+        backend.rotate()
+        names = set(listdir(segments_path)) - {'index.sqlite'}
+        self.assertEqual(names, {f'{old_segment[:6]}.log',
+                                 f'{new_segment}.log'})
+        # The patches are read from the new segments
+        self.assertEqual(self.get_patches(), [
+            ('a', ['a.metadata'], [{'diff': 'a'}]),
+            ('b', ['b.metadata'], [{'diff': 'b'}]),
+            ('c', ['c.metadata'], [{'diff': 'c'}])])
+        self.assertEqual(backend.get_changed_keys(old),
+                         {'a.metadata', 'b.metadata', 'c.metadata'})
+
+    def test_legacy(self):
+        now = datetime.now()
+        folder = f'{self.backend.patchs_path}/{now.strftime("%Y%m%d")}'
+        makedirs(folder)
+        name = f'{now.strftime("%Hh%Mm%S.%f")}-user.patch'
+        with open(f'{folder}/{name}', 'w') as f:
+            f.write('--- a.metadata\n+++ a.metadata\n@@ -1 +1 @@\n')
+        since = now - timedelta(seconds=1)
+        self.assertEqual(self.backend.get_changed_keys(since),
+                         {'a.metadata'})
+
+    def test_read_only(self):
+        path = mkdtemp()
+        try:
+            makedirs(f'{path}/database/.git')
+            backend = PatchsBackend(path, None, True)
+            self.assertEqual(listdir(f'{path}/database/.git'), [])
+            self.assertEqual(backend.thread, None)
+            self.assertEqual(list(backend.get_patches()), [])
+            self.assertEqual(backend.get_changed_keys(datetime.now()), set())
+            backend.close()
+        finally:
+            rmtree(path)
+
+        # The patches written are read, the index is not changed
+        handler = Handler('format:a\n')
+        self.backend.create_patch(['a.metadata'], [], [],
+                                  {'a.metadata': handler}, (None, None))
+        self.backend.flush()
+        backend = PatchsBackend(self.path, None, True)
+        try:
+            self.assertEqual(len(list(backend.get_patches())), 1)
+            connection = backend._get_connection()
+            self.assertRaises(OperationalError, connection.execute,
+                              'DELETE FROM keys')
+        finally:
+            backend.close()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Copyright (C) 2026 The itools contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from os import getuid, stat
+from os.path import dirname
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+from unittest.mock import patch
+
+# Import from itools
+from itools.database.sharedcache import SharedCache, get_blob_id
+from itools.database.sharedcache import get_shared_cache_path
+
+
+class Handler:
+
+    def __init__(self, data):
+        self.data = data
+        self.key = 'a.metadata'
+        self.database = None
+        self.dirty = None
+        self.timestamp = None
+
+
+class OtherHandler(Handler):
+    pass
+
+
+
+class SharedCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.cache = SharedCache(f'{self.path}/cache.sqlite')
+
+    def tearDown(self):
+        self.cache.close()
+        rmtree(self.path)
+
+    def set(self, key, data):
+        sha = get_blob_id(data)
+        self.cache.set(key, sha, Handler(data))
+        return sha
+
+    def test_get_set(self):
+        cache = self.cache
+        sha = self.set('a.metadata', 'A')
+        # The state without the attributes of the instance
+        state = cache.get('a.metadata', sha, Handler)
+        self.assertEqual(state, {'data': 'A'})
+        # Another key, class or version
+        self.assertEqual(cache.get('b.metadata', sha, Handler), None)
+        self.assertEqual(cache.get('a.metadata', sha, OtherHandler), None)
+        self.assertEqual(cache.get('a.metadata', get_blob_id('B'), Handler),
+                         None)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 3})
+        # Shared with the other processes
+        other = SharedCache(cache.path)
+        try:
+            self.assertEqual(other.get('a.metadata', sha, Handler), state)
+        finally:
+            other.close()
+
+    def test_new_version(self):
+        cache = self.cache
+        old = self.set('a.metadata', 'A')
+        new = self.set('a.metadata', 'B')
+        self.assertEqual(cache.get('a.metadata', old, Handler), None)
+        self.assertEqual(cache.get('a.metadata', new, Handler), {'data': 'B'})
+
+    def test_prune(self):
+        cache = self.cache
+        cache.check_interval = 1
+        shas = {}
+        for key in 'a', 'b', 'c':
+            shas[key] = self.set(key, key * 1000)
+        size = cache._get_connection().execute(
+            'SELECT max(size) FROM handlers').fetchone()[0]
+        cache.size_min = 2 * size
+        cache.size_max = 3 * size
+        # The first used
+        cache.get('a', shas['a'], Handler)
+        shas['d'] = self.set('d', 'd' * 1000)
+        # The least recently used are removed
+        found = [
+            key for key in sorted(shas)
+            if cache.get(key, shas[key], Handler) is not None ]
+        self.assertEqual(found, ['a', 'd'])
+
+    def test_bad_state(self):
+        cache = self.cache
+        sha = self.set('a.metadata', 'A')
+        with cache._get_connection() as connection:
+            connection.execute("UPDATE handlers SET state = x'00'")
+        self.assertEqual(cache.get('a.metadata', sha, Handler), None)
+        # Not pickled
+        handler = Handler(lambda: None)
+        cache.set('b.metadata', sha, handler)
+        self.assertEqual(cache.get('b.metadata', sha, Handler), None)
+
+    def test_unavailable(self):
+        # The database cannot be opened, nothing is kept
+        cache = SharedCache(f'{self.path}/missing/cache.sqlite')
+        cache.set('a.metadata', get_blob_id('A'), Handler('A'))
+        self.assertEqual(cache.get('a.metadata', get_blob_id('A'), Handler),
+                         None)
+        cache.close()
+
+    def test_path(self):
+        path = get_shared_cache_path(self.path)
+        self.assertEqual(path, get_shared_cache_path(f'{self.path}/'))
+        self.assertNotEqual(path, get_shared_cache_path(f'{self.path}/x'))
+        # Without shared memory, in the temporary folder
+        with patch('itools.database.sharedcache.isdir', return_value=False), \
+             patch('itools.database.sharedcache.gettempdir',
+                   return_value=self.path):
+            path = get_shared_cache_path(self.path)
+        root = dirname(path)
+        self.assertEqual(root, f'{self.path}/itools-{getuid()}')
+        self.assertEqual(stat(root).st_mode & 0o777, 0o700)
+        cache = SharedCache(path)
+        sha = get_blob_id('A')
+        cache.set('a.metadata', sha, Handler('A'))
+        self.assertEqual(cache.get('a.metadata', sha, Handler), {'data': 'A'})
+        cache.close()
+
+
+
+if __name__ == '__main__':
+    main()